@@ -0,0 +1,233 @@
+# TaskuOpe/ops_analyzer.py
+"""Tekstianalysaattorit OPS-hakua varten.
+
+Analysaattori muuntaa tekstin indeksoitaviksi termeiksi. Sama analysaattori
+ajetaan sekä indeksiä rakennettaessa että kyselylle, joten taivutusmuodot
+("murtoluvut", "murtolukujen") päätyvät samaan termiin jo indeksissä ja
+kyselyn aikainen työ on pelkkä sanakirjahaku.
+
+Käytettävä analysaattori valitaan asetuksella OPS_ANALYZER (oletus "finnish").
+Analysaattorin nimi on osa indeksin versioleimaa, joten sen vaihtaminen
+hylkää vanhan indeksin automaattisesti.
+
+- "simple": pienaakkoset ja \\w+-tokenisointi (vanha käytös)
+- "finnish": stop-sanat, kevyt suomen taivutuspäätteiden karsinta
+  astevaihtelun normalisoinnilla sekä yhdyssanojen pilkkominen korpuksen
+  sanaston avulla
+"""
+
+import re
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Callable, Container, Dict, List, Optional
+
+from django.conf import settings
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+VOWELS = "aeiouyäö"
+
+# Yleisimmät suomen (ja ruotsinkielisten OPS-osien) funktiosanat. Mukana myös
+# datan HTML-jäänteet (p, li), jotka muuten olisivat korpuksen yleisimpiä termejä.
+STOPWORDS = frozenset("""
+ja tai sekä että eli mutta vaan kuin kun jos jotta koska niin myös
+on ovat oli olla ei eivät se ne sen niiden sitä siitä siinä sille niitä niissä
+joka jotka jonka joiden jota joita mikä mitkä mitä tämä tämän tätä nämä näiden
+he hän eri kuten esim mm ym jne
+och att i av med som för de sig samt en ett på till om eller det den
+p li ul ol br
+""".split())
+
+# Liitepartikkelit ja omistusliitteet, karsitaan ennen sijapäätteitä
+CLITICS = ("kaan", "kään", "kin")
+POSSESSIVES = ("nsa", "nsä", "mme", "nne")
+
+# Sija- ja monikkopäätteet pisimmästä lyhimpään. "a"/"ä"-päätteitä ei listata,
+# koska loppuvokaalit karsitaan erikseen.
+CASE_ENDINGS = tuple(sorted((
+    "itten", "iden", "ihin", "issa", "issä", "ista", "istä", "illa", "illä",
+    "ilta", "iltä", "ille", "iksi", "itta", "ittä", "ina", "inä",
+    "seen", "siin", "ssa", "ssä", "sta", "stä", "lla", "llä", "lta", "ltä",
+    "lle", "ksi", "tta", "ttä", "jen", "ien", "hin",
+    "aan", "ään", "een", "iin", "oon", "uun", "yyn",
+    "na", "nä", "ja", "jä", "ta", "tä", "n", "t",
+), key=len, reverse=True))
+
+# Päätteet, jotka karsitaan vain vokaalin jäljestä ("lukuja" -> "luku", mutta ei "kirja")
+_AFTER_VOWEL = frozenset({"jen", "ja", "jä", "n", "t"})
+
+# Astevaihtelu: vartalon viimeinen konsonanttiryhmä normalisoidaan vahvaan asteeseen
+GRADATION = {
+    "kk": "k", "pp": "p", "tt": "t", "d": "t",
+    "nn": "nt", "mm": "mp", "ng": "nk", "ll": "lt", "rr": "rt", "hd": "ht",
+}
+_LAST_CLUSTER_RE = re.compile(rf"([{VOWELS}])([^{VOWELS}]+)$")
+
+MIN_STEM = 3
+# Yhdyssanan osan vähimmäispituus (merkkeinä ennen vartalointia)
+MIN_COMPOUND_PART = 4
+# Yhdyssanan alkuosa on yleensä nominatiivi tai genetiivi
+_HEAD_ENDINGS = tuple(VOWELS) + ("n", "s")
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokenisoi tekstin ja muuttaa tokenit pieniksi kirjaimiksi.
+
+    Args:
+        text: Käsiteltävä tekstimerkkijono.
+
+    Returns:
+        Lista pieniksi kirjaimiksi muunnettuja tokeneita.
+    """
+    return [t.lower() for t in WORD_RE.findall(text)]
+
+
+def _strip_suffix(word: str, suffixes, after_vowel=frozenset()) -> str:
+    """Karsii ensimmäisen sopivan päätteen, jos vartaloon jää vähintään MIN_STEM merkkiä."""
+    for suf in suffixes:
+        if word.endswith(suf) and len(word) - len(suf) >= MIN_STEM:
+            if suf in after_vowel and word[-len(suf) - 1] not in VOWELS:
+                continue
+            return word[: -len(suf)]
+    return word
+
+
+def _gradate(stem: str) -> str:
+    """Normalisoi vartalon viimeisen konsonanttiryhmän astevaihtelun (luv- -> luk-)."""
+    m = _LAST_CLUSTER_RE.search(stem)
+    if not m:
+        return stem
+    vowel, cluster = m.groups()
+    if cluster == "v" and vowel in "uy":
+        # luku/luvun, kyky/kyvyn
+        strong = "k"
+    else:
+        strong = GRADATION.get(cluster, cluster)
+    return stem[: m.start(2)] + strong
+
+
+@lru_cache(maxsize=65536)
+def stem_fi(token: str) -> str:
+    """Kevyt suomen vartaloija.
+
+    Karsii liitepartikkelin, omistusliitteen, yhden sija-/monikkopäätteen ja
+    loppuvokaalit sekä normalisoi astevaihtelun. Tulos ei ole kieliopillinen
+    perusmuoto vaan vertailuavain: "murtoluvut", "murtolukujen" ja
+    "murtoluvuilla" saavat kaikki avaimen "murtoluk".
+
+    Args:
+        token: Pieniksi kirjaimiksi muunnettu sana.
+
+    Returns:
+        Sanan vartalo.
+    """
+    if len(token) <= MIN_STEM or not token.isalpha():
+        return token
+    word = _strip_suffix(token, CLITICS)
+    word = _strip_suffix(word, POSSESSIVES)
+    word = _strip_suffix(word, CASE_ENDINGS, _AFTER_VOWEL)
+    while len(word) > MIN_STEM and word[-1] in VOWELS:
+        word = word[:-1]
+    return _gradate(word)
+
+
+class Analyzer(ABC):
+    """Analysaattorien abstrakti kantaluokka: teksti -> lista indeksitermejä."""
+
+    name = "base"
+
+    @abstractmethod
+    def analyze(self, text: str, lexicon: Optional[Container[str]] = None) -> List[str]:
+        """Palauttaa tekstin termit.
+
+        Args:
+            text: Analysoitava teksti.
+            lexicon: Valinnainen korpuksen termisanasto (esim. indeksin termit),
+                jota analysaattori voi käyttää yhdyssanojen pilkkomiseen.
+
+        Returns:
+            Lista termejä.
+        """
+
+
+class SimpleAnalyzer(Analyzer):
+    """Pelkkä pienaakkostettu \\w+-tokenisointi."""
+
+    name = "simple"
+
+    def analyze(self, text: str, lexicon: Optional[Container[str]] = None) -> List[str]:
+        return tokenize(text)
+
+
+class FinnishAnalyzer(Analyzer):
+    """Stop-sanat, kevyt vartalointi ja yhdyssanojen pilkkominen.
+
+    Yhdyssana pilkotaan kahteen osaan, jos molempien osien vartalot löytyvät
+    annetusta sanastosta ja alkuosa näyttää perusmuodolta tai genetiiviltä.
+    Alkuperäinen vartalo säilyy termeissä, joten "ilmaisutaitojen" osuu sekä
+    hakuun "ilmaisutaidot" että hakuun "taidot".
+    """
+
+    name = "finnish"
+
+    def split_compound(self, token: str, lexicon: Container[str]) -> List[str]:
+        """Palauttaa yhdyssanan osien vartalot tai tyhjän listan.
+
+        Args:
+            token: Pieniksi kirjaimiksi muunnettu sana.
+            lexicon: Tunnettujen vartaloiden joukko.
+
+        Returns:
+            Lista [alkuosa, loppuosa] tai [], jos sopivaa jakoa ei löydy.
+        """
+        if len(token) < 2 * MIN_COMPOUND_PART or not token.isalpha():
+            return []
+        for i in range(MIN_COMPOUND_PART, len(token) - MIN_COMPOUND_PART + 1):
+            if not token[:i].endswith(_HEAD_ENDINGS):
+                continue
+            head, tail = stem_fi(token[:i]), stem_fi(token[i:])
+            if min(len(head), len(tail)) > MIN_STEM and head in lexicon and tail in lexicon:
+                return [head, tail]
+        return []
+
+    def analyze(self, text: str, lexicon: Optional[Container[str]] = None) -> List[str]:
+        terms: List[str] = []
+        for token in tokenize(text):
+            if token in STOPWORDS:
+                continue
+            terms.append(stem_fi(token))
+            if lexicon is not None:
+                terms.extend(self.split_compound(token, lexicon))
+        return terms
+
+
+ANALYZERS: Dict[str, Callable[[], Analyzer]] = {
+    SimpleAnalyzer.name: SimpleAnalyzer,
+    FinnishAnalyzer.name: FinnishAnalyzer,
+}
+
+
+def register_analyzer(name: str, factory: Callable[[], Analyzer]) -> None:
+    """Rekisteröi uuden analysaattorin nimellä, jota voi käyttää OPS_ANALYZER-asetuksessa."""
+    ANALYZERS[name] = factory
+    _get_cached.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def _get_cached(name: str) -> Analyzer:
+    try:
+        return ANALYZERS[name]()
+    except KeyError:
+        raise ValueError(f"Tuntematon OPS-analysaattori: {name!r}") from None
+
+
+def get_analyzer(name: Optional[str] = None) -> Analyzer:
+    """Palauttaa analysaattorin nimen tai OPS_ANALYZER-asetuksen perusteella.
+
+    Args:
+        name: Analysaattorin nimi; oletuksena asetus OPS_ANALYZER tai "finnish".
+
+    Returns:
+        Analyzer-instanssi.
+    """
+    return _get_cached(name or getattr(settings, "OPS_ANALYZER", "finnish"))
@@ -4,26 +4,193 @@
 Lukee opetussuunnitelmadatan JSON-tiedostosta ja tarjoaa
 toimintoja OPS-chunkien hakuun ja suodatukseen.
 
+Haku käyttää käänteisindeksiä (termi → postings-lista (rivi, tf)) ja
+BM25-pisteytystä. Indeksi rakennetaan kerran latauksen yhteydessä, joten
+kysely käy läpi vain kyselytermien postings-listat eikä koko korpusta.
+Facet-suodatus (oppiaine, luokka-aste, sisältötyyppi) tehdään latauksessa
+rakennetuilla bittijoukoilla, jolloin suodattimet ovat pelkkiä joukko-operaatioita.
+
+Indeksi voidaan kääntää etukäteen binääritiedostoiksi komennolla
+``python manage.py build_ops_index``. Tällöin jokainen gunicorn-worker
+muistikartoittaa (mmap) samat NumPy-taulukot vain luku -tilassa, eikä JSONia
+tarvitse jäsentää workereissa lainkaan. Jos valmista indeksiä ei ole tai se on
+rakennettu eri datasta, indeksi rakennetaan muistiin JSONista kuten ennenkin.
+
+Tekstit analysoidaan ops_analyzer-moduulin analysaattorilla (OPS_ANALYZER,
+oletus suomen kevyt vartaloija). Analyysi tehdään indeksiä rakennettaessa, joten
+kyselyn aikana termit ovat suoria sanakirjahakuja.
+
+Avainsanahaun (BM25) rinnalla on paikallinen vektorihaku (ops_vectors) sekä
+hybriditila, joka yhdistää molempien rankingit (Reciprocal Rank Fusion).
+Tila valitaan retrieve_chunksin mode-parametrilla tai asetuksella
+OPS_SEARCH_MODE (oletus "bm25").
+
+retrieve_chunksin tulokset välimuistitetaan prosessikohtaiseen LRU:hun
+(OPS_CACHE_SIZE) ja valinnaisesti jaettuun Django-välimuistiin
+(OPS_CACHE_ALIAS). Avaimessa on indeksin versioleima, joten uusi indeksi
+mitätöi vanhat tulokset automaattisesti.
+
+Asetuksella OPS_SEARCH_BACKEND = "db" haku ja facetit ohjataan
+tietokantaan (ks. ops_db ja OpsChunk-malli); oletus on "memory".
+
 Lukee JSONin: TaskuOpe/ops_data/opetussuunnitelma_1-6_API_data.json
 """
 
+import hashlib
 import json
+import math
 import os
-import re
+import shutil
+import threading
 import time
-from collections import Counter
+from collections import Counter, OrderedDict, defaultdict
 from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 from django.conf import settings
 
+from TaskuOpe import ops_vectors
+from TaskuOpe.ops_analyzer import Analyzer, get_analyzer, tokenize
+
 JSON_FILENAME = "opetussuunnitelma_1-6_API_data.json"
+INDEX_DIRNAME = "ops_index"
+# Kasvata, jos tiedostomuoto tai ops_vectorsin parametrit muuttuvat;
+# vanhat indeksit hylätään automaattisesti
+INDEX_FORMAT = 3
+
+SEARCH_MODES = ("bm25", "vector", "hybrid")
+# Hybridihaussa kummastakin rankingista fuusioon otettavien ehdokkaiden määrä
+HYBRID_CANDIDATES = 50
+
+# BM25-parametrit (Robertson & Zaragoza -oletukset)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Rivin kentät, jotka tallennetaan koodeina (arvo -> indeksi nimilistaan)
+_ROW_FIELDS = ("subject", "grade_context", "content_type", "source")
+
+_ARRAY_NAMES = ("row_src", "row_codes", "text_offsets", "post_ptr", "post_doc",
+                "post_tf", "idf", "len_norm", "by_length")
+_VECTOR_NAMES = ("vectors", "vec_features", "vec_idf", "vec_components")
+
+# Facet-avain -> rivin kenttä
+_FACET_FIELDS = {
+    "subjects": "subject",
+    "grades": "grade_context",
+    "content_types": "content_type",
+}
+
+
+class OpsIndex:
+    """Ladattu OPS-indeksi.
+
+    Taulukot ovat joko muistissa rakennettuja NumPy-taulukoita tai levyltä
+    muistikartoitettuja (mmap_mode="r"). Molemmissa tapauksissa rakenne on sama:
+
+    - postings CSR-muodossa: termin t postingsit ovat välillä
+      ``post_ptr[t]:post_ptr[t + 1]`` taulukoissa ``post_doc`` ja ``post_tf``
+    - ``idf`` termeittäin ja ``len_norm`` riveittäin (BM25)
+    - rivien tekstit yhtenä UTF-8-blobina ja alkukohdat ``text_offsets``-taulukossa
+    - rivien metatiedot koodeina ``row_codes``-taulukossa (ks. _ROW_FIELDS)
+
+    Facet-bittijoukot rakennetaan koodeista latauksen yhteydessä. Vektorihaun
+    taulukot (ks. ops_vectors) luetaan indeksistä tai lasketaan muistiin
+    ensimmäisellä vektorihaulla.
+    """
 
-_DATA: List[Dict] = []
-_FACETS: Dict[str, List[str]] = {}
-_LOADED_PATH = ""
-_LOADED_MTIME = 0.0
+    def __init__(self, meta: Dict, arrays: Dict[str, np.ndarray], text_blob):
+        self.version: str = meta["version"]
+        self.meta = meta
+        self.n_docs: int = int(meta["n_docs"])
+        self.term_ids: Dict[str, int] = {t: i for i, t in enumerate(meta["terms"])}
+        self.analyzer: Analyzer = get_analyzer(meta.get("analyzer"))
+        self.labels: Dict[str, List[str]] = meta["labels"]
+
+        self.row_src = arrays["row_src"]
+        self.row_codes = arrays["row_codes"]
+        self.text_offsets = arrays["text_offsets"]
+        self.post_ptr = arrays["post_ptr"]
+        self.post_doc = arrays["post_doc"]
+        self.post_tf = arrays["post_tf"]
+        self.idf = arrays["idf"]
+        self.len_norm = arrays["len_norm"]
+        self.by_length = arrays["by_length"]
+        self.text_blob = text_blob
+        self._vectors: Optional[Dict[str, np.ndarray]] = (
+            {name: arrays[name] for name in _VECTOR_NAMES} if "vectors" in arrays else None
+        )
+        self._vectors_lock = threading.Lock()
+
+        self.facets = {
+            facet: sorted(v for v in self.labels[field] if v)
+            for facet, field in _FACET_FIELDS.items()
+        }
+        self.facet_bits, self.facet_labels = self._build_facet_bits()
+
+    def _build_facet_bits(self) -> Tuple[Dict[str, Dict[str, int]], Dict[str, Dict[str, str]]]:
+        """Rakentaa facet-arvoittaiset bittijoukot rivien koodeista.
+
+        Bittijoukot ovat Pythonin kokonaislukuja, joten yhdiste (|), leikkaus (&)
+        ja lukumäärä (bit_count) toimivat C-nopeudella.
+
+        Returns:
+            Tuple (bitit, nimet), joissa bitit on muotoa facet -> arvo -> maski ja
+            nimet facet -> arvo -> alkuperäinen kirjoitusasu.
+        """
+        bits: Dict[str, Dict[str, int]] = {}
+        labels: Dict[str, Dict[str, str]] = {}
+        for facet, field in _FACET_FIELDS.items():
+            col = np.asarray(self.row_codes[:, _ROW_FIELDS.index(field)])
+            bits[facet] = defaultdict(int)
+            labels[facet] = {}
+            for code, value in enumerate(self.labels[field]):
+                if not value:
+                    continue
+                packed = np.packbits(col == code, bitorder="little").tobytes()
+                key = value.lower()
+                bits[facet][key] |= int.from_bytes(packed, "little")
+                labels[facet].setdefault(key, value)
+            bits[facet] = dict(bits[facet])
+        return bits, labels
+
+    def analyze(self, text: str) -> List[str]:
+        """Analysoi kyselyn samalla analysaattorilla, jolla indeksi on rakennettu."""
+        return self.analyzer.analyze(text, self.term_ids)
+
+    @property
+    def vectors(self) -> Dict[str, np.ndarray]:
+        """Palauttaa vektorihaun taulukot (lasketaan tarvittaessa kerran)."""
+        if self._vectors is None:
+            with self._vectors_lock:
+                if self._vectors is None:
+                    self._vectors = ops_vectors.build_vectors(
+                        [self.text(i) for i in range(self.n_docs)]
+                    )
+        return self._vectors
+
+    def text(self, i: int) -> str:
+        """Palauttaa rivin i tekstin."""
+        start, end = int(self.text_offsets[i]), int(self.text_offsets[i + 1])
+        return bytes(self.text_blob[start:end]).decode("utf-8")
+
+    def row(self, i: int) -> Dict:
+        """Palauttaa rivin i julkiset kentät sanakirjana."""
+        codes = self.row_codes[i]
+        out = {"id": f"ops-{int(self.row_src[i])}", "text": self.text(i)}
+        for col, field in enumerate(_ROW_FIELDS):
+            out[field] = self.labels[field][int(codes[col])]
+        return out
+
+
+_INDEX: Optional[OpsIndex] = None
+_LOAD_LOCK = threading.Lock()
+_CHECKED_AT = 0.0
+
+# retrieve_chunksin tulosvälimuisti: avain -> lista tuloksia (LRU-järjestyksessä)
+_RESULT_CACHE: "OrderedDict[Tuple, List[Dict]]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+_CACHE_STATS = {"hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0}
 
-WORD_RE = re.compile(r"\w+", re.UNICODE)
 
 def _json_path() -> str:
     """Palauttaa JSON-tiedoston koko polun."""
@@ -32,27 +199,22 @@ def _json_path() -> str:
     # BASE_DIR osoittaa yleensä .../TaskuOpe
     return os.path.join(settings.BASE_DIR, "ops_data", JSON_FILENAME)
 
-def _build_facets(rows: List[Dict]) -> Dict[str, List[str]]:
-    """Rakentaa facetit (aiheet, luokka-asteet, sisältötyypit) datasta.
+def _index_dir() -> str:
+    """Palauttaa valmiiksi käännetyn indeksin hakemiston.
 
-    Args:
-        rows: Lista sanakirjoja, jotka edustavat OPS-chunkkeja.
+    Oletus on ``BASE_DIR/ops_data/ops_index``; voidaan ohittaa asetuksella
+    OPS_INDEX_DIR.
+    """
+    return str(getattr(settings, "OPS_INDEX_DIR", None)
+               or os.path.join(settings.BASE_DIR, "ops_data", INDEX_DIRNAME))
 
-    Returns:
-        Sanakirja, jossa avaimina ovat facet-tyypit ja arvoina
-        listat uniikeista facet-arvoista.
-    """
-    subs, grades, ctypes = set(), set(), set()
-    for r in rows:
-        subs.add((r.get("subject") or "").strip())
-        grades.add((r.get("grade_context") or "").strip())
-        ctypes.add((r.get("content_type") or "").strip())
-    clean = lambda s: sorted([x for x in s if x])
-    return {
-        "subjects": clean(subs),
-        "grades": clean(grades),
-        "content_types": clean(ctypes),
-    }
+def _source_version(path: str) -> str:
+    """Laskee lähdedatan versioleiman (sisällön tiiviste + tiedostomuoto + analysaattori)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return f"{h.hexdigest()[:16]}.f{INDEX_FORMAT}.{get_analyzer().name}"
 
 def _tokenize(text: str) -> List[str]:
     """Tokenisoi tekstin ja muuttaa tokenit pieniksi kirjaimiksi.
@@ -64,86 +226,402 @@ def _tokenize(text: str) -> List[str]:
         Lista pieniksi kirjaimiksi muunnettuja tokeneita.
     """
 
-    return [t.lower() for t in WORD_RE.findall(text)]
+    return tokenize(text)
 
-def _load_data(force: bool = False) -> None:
-    """Lataa ja esikäsittelee OPS-datan JSON-tiedostosta.
+def build_index(raw: List[Dict], version: str) -> Tuple[Dict, Dict[str, np.ndarray], bytes]:
+    """Rakentaa OPS-indeksin taulukot raakadatasta.
 
-    Data ladataan vain kerran tai jos tiedostoa on muokattu tai force=True.
+    Samaa funktiota käytetään sekä muistiin rakennettavaan indeksiin että
+    build_ops_index-komennon kirjoittamaan tiedostoon.
 
     Args:
-        force: Pakottaa datan uudelleenlatauksen, vaikka sitä ei olisi muokattu.
-    """
-        
-    global _DATA, _FACETS, _LOADED_PATH, _LOADED_MTIME
-    path = _json_path()
-    st = os.stat(path)
-    if (not force) and _LOADED_PATH == path and _LOADED_MTIME == st.st_mtime and _DATA:
-        return
+        raw: JSON-tiedoston rivit (content, subject, grade_context, content_type, source).
+        version: Indeksin versioleima (ks. _source_version).
 
-    with open(path, "r", encoding="utf-8") as f:
-        raw = json.load(f)
+    Returns:
+        Tuple (meta, taulukot, tekstiblobi).
+    """
+    labels: Dict[str, Dict[str, int]] = {field: {} for field in _ROW_FIELDS}
+    row_src: List[int] = []
+    row_codes: List[List[int]] = []
+    texts: List[bytes] = []
+    analyzer = get_analyzer()
 
-    norm: List[Dict] = []
     for i, r in enumerate(raw):
         txt = (r.get("content") or "").strip()
         if not txt:
             continue
-        subj = (r.get("subject") or "").strip()
-        grade = (r.get("grade_context") or "").strip()
-        ctype = (r.get("content_type") or "").strip()
-        src = (r.get("source") or "POPS_2014").strip()
-        tokens = _tokenize(txt)
-        tf = Counter(tokens)
-        norm.append({
-            "id": f"ops-{i}",
-            "text": txt,
-            "subject": subj,
-            "grade_context": grade,
-            "content_type": ctype,
-            "source": src,
-            "_tokens": tokens,
-            "_tf": tf,                  # term frequencies
-            "_len": max(len(tokens), 1) # pituus normaaliin
-        })
+        values = {
+            "subject": (r.get("subject") or "").strip(),
+            "grade_context": (r.get("grade_context") or "").strip(),
+            "content_type": (r.get("content_type") or "").strip(),
+            "source": (r.get("source") or "POPS_2014").strip(),
+        }
+        row_src.append(i)
+        row_codes.append([labels[f].setdefault(values[f], len(labels[f])) for f in _ROW_FIELDS])
+        texts.append(txt.encode("utf-8"))
+
+    # Kaksi kierrosta: ensin korpuksen sanasto, sitten analyysi yhdyssanojen
+    # pilkkomisella tätä sanastoa vasten
+    decoded = [t.decode("utf-8") for t in texts]
+    lexicon = {term for txt in decoded for term in analyzer.analyze(txt)}
+    token_lists = [analyzer.analyze(txt, lexicon) for txt in decoded]
+
+    # Käänteisindeksi: termi -> [(rivin indeksi, termifrekvenssi), ...]
+    postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    doc_len: List[int] = []
+    for doc_id, tokens in enumerate(token_lists):
+        doc_len.append(max(len(tokens), 1))
+        for term, tf in Counter(tokens).items():
+            postings[term].append((doc_id, tf))
+
+    n_docs = len(doc_len)
+    avg_len = (sum(doc_len) / n_docs) if n_docs else 1.0
+    terms = sorted(postings)
+
+    post_ptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    post_doc = np.empty(sum(len(p) for p in postings.values()), dtype=np.int32)
+    post_tf = np.empty_like(post_doc)
+    idf = np.empty(len(terms), dtype=np.float32)
+    pos = 0
+    for t, term in enumerate(terms):
+        plist = postings[term]
+        post_doc[pos:pos + len(plist)] = [d for d, _ in plist]
+        post_tf[pos:pos + len(plist)] = [tf for _, tf in plist]
+        # BM25-idf, joka pysyy positiivisena myös hyvin yleisille termeille
+        idf[t] = math.log(1.0 + (n_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+        pos += len(plist)
+        post_ptr[t + 1] = pos
+
+    dl = np.asarray(doc_len, dtype=np.float32)
+    # BM25:n pituusnormalisointi esilaskettuna riveittäin: k1 * (1 - b + b * dl / avgdl)
+    len_norm = (BM25_K1 * (1.0 - BM25_B + BM25_B * dl / avg_len)).astype(np.float32)
+
+    text_offsets = np.zeros(n_docs + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in texts], out=text_offsets[1:])
+    # Rivi-indeksit tekstin merkkimäärän mukaan (tyhjä kysely palauttaa lyhyimmät);
+    # tavupituus suosisi ääkkösettömiä rivejä
+    by_length = np.argsort([len(t) for t in decoded], kind="stable").astype(np.int32)
+
+    meta = {
+        "format": INDEX_FORMAT,
+        "version": version,
+        "analyzer": analyzer.name,
+        "n_docs": n_docs,
+        "terms": terms,
+        "labels": {f: list(labels[f]) for f in _ROW_FIELDS},
+    }
+    arrays = {
+        "row_src": np.asarray(row_src, dtype=np.int32),
+        "row_codes": np.asarray(row_codes, dtype=np.int16).reshape(n_docs, len(_ROW_FIELDS)),
+        "text_offsets": text_offsets,
+        "post_ptr": post_ptr,
+        "post_doc": post_doc,
+        "post_tf": post_tf,
+        "idf": idf,
+        "len_norm": len_norm,
+        "by_length": by_length,
+    }
+    return meta, arrays, b"".join(texts)
 
-    _DATA = norm
-    _FACETS = _build_facets(norm)
-    _LOADED_PATH = path
-    _LOADED_MTIME = st.st_mtime
+def write_index(out_dir: Optional[str] = None, source_path: Optional[str] = None) -> Dict:
+    """Kääntää OPS-JSONin binääri-indeksiksi hakemistoon.
 
-def get_facets() -> Dict[str, List[str]]:
-    """Palauttaa saatavilla olevat facet-arvot (aiheet, luokka-asteet, sisältötyypit).
+    Hakemisto kirjoitetaan ensin väliaikaiseen nimeen ja vaihdetaan paikalleen
+    vasta valmiina, joten käynnissä olevat workerit eivät näe puolivalmista
+    indeksiä (vanhat mmap-kartoitukset pysyvät voimassa).
+
+    Args:
+        out_dir: Kohdehakemisto (oletus _index_dir()).
+        source_path: Lähde-JSON (oletus _json_path()).
 
     Returns:
-        Sanakirja, jossa avaimina facet-tyypit ja arvoina listat uniikeista arvoista.
+        Kirjoitetun indeksin metatiedot.
     """
+    out_dir = out_dir or _index_dir()
+    source_path = source_path or _json_path()
+    with open(source_path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    meta, arrays, blob = build_index(raw, _source_version(source_path))
+    arrays.update(ops_vectors.build_vectors([t.decode("utf-8") for t in _split_blob(blob, arrays)]))
+    meta["source"] = os.path.basename(source_path)
+    meta["built_at"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+
+    tmp_dir = f"{out_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), arr)
+    with open(os.path.join(tmp_dir, "text.bin"), "wb") as f:
+        f.write(blob)
+    # meta.json kirjoitetaan viimeisenä: sen olemassaolo tarkoittaa valmista indeksiä
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    old_dir = f"{out_dir}.old-{os.getpid()}"
+    if os.path.exists(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return meta
+
+def _split_blob(blob: bytes, arrays: Dict[str, np.ndarray]) -> List[bytes]:
+    """Pilkkoo tekstiblobin riveiksi text_offsets-taulukon avulla."""
+    offsets = arrays["text_offsets"]
+    return [blob[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+def _read_meta(index_dir: str) -> Optional[Dict]:
+    """Lukee indeksin meta.json-tiedoston tai palauttaa None."""
+    try:
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _open_index(index_dir: str, meta: Dict) -> OpsIndex:
+    """Muistikartoittaa valmiin indeksin vain luku -tilassa."""
+    arrays = {
+        name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+        for name in _ARRAY_NAMES
+    }
+    if os.path.exists(os.path.join(index_dir, "vectors.npy")):
+        for name in _VECTOR_NAMES:
+            arrays[name] = np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+    blob_path = os.path.join(index_dir, "text.bin")
+    if os.path.getsize(blob_path):
+        blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+    else:
+        blob = b""
+    return OpsIndex(meta, arrays, blob)
+
+def _load_data(force: bool = False) -> None:
+    """Lataa OPS-indeksin.
+
+    Ensisijaisesti käytetään build_ops_index-komennolla käännettyä indeksiä,
+    joka muistikartoitetaan. Jos sitä ei ole tai sen versioleima ei vastaa
+    lähde-JSONia, indeksi rakennetaan muistiin JSONista.
+
+    Latauksen jälkeen tiedostoja ei tutkita jokaisella kutsulla. Asetuksella
+    OPS_INDEX_CHECK_INTERVAL (sekunteina, oletus 0 = ei koskaan) voi sallia
+    versioleiman tarkistuksen määrävälein.
+
+    Args:
+        force: Pakottaa indeksin uudelleenlatauksen.
+    """
+    global _INDEX, _CHECKED_AT
+    if _INDEX is not None and not force:
+        interval = float(getattr(settings, "OPS_INDEX_CHECK_INTERVAL", 0) or 0)
+        if interval <= 0 or time.monotonic() - _CHECKED_AT < interval:
+            return
+
+    with _LOAD_LOCK:
+        _CHECKED_AT = time.monotonic()
+        source_path = _json_path()
+        expected = _source_version(source_path) if os.path.exists(source_path) else None
+        if _INDEX is not None and not force and _INDEX.version == expected:
+            return
+
+        index_dir = _index_dir()
+        meta = _read_meta(index_dir)
+        index: Optional[OpsIndex] = None
+        if meta and meta.get("format") == INDEX_FORMAT and (expected is None or meta.get("version") == expected):
+            try:
+                index = _open_index(index_dir, meta)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"OPS-indeksin avaus epäonnistui ({index_dir}): {e}")
+        elif meta:
+            print(f"OPS-indeksi {index_dir} on vanhentunut, rakennetaan muistiin.")
+
+        if index is None:
+            with open(source_path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            meta, arrays, blob = build_index(raw, expected or "")
+            index = OpsIndex(meta, arrays, blob)
+
+        if _INDEX is None or _INDEX.version != index.version:
+            clear_cache()
+        _INDEX = index
+
+def _get_index() -> OpsIndex:
+    """Palauttaa ladatun indeksin (lataa tarvittaessa)."""
     _load_data()
-    return _FACETS
+    return _INDEX
+
+def index_version() -> str:
+    """Palauttaa ladatun OPS-indeksin versioleiman."""
+    return _get_index().version
 
-def _score(query_tokens: List[str], row: Dict) -> float:
-    """Yksinkertainen avainsanapisteytys OPS-chunkille.
+def get_facets(
+    subjects: Optional[List[str]] = None,
+    grades: Optional[List[str]] = None,
+    ctypes: Optional[List[str]] = None,
+) -> Dict:
+    """Palauttaa saatavilla olevat facet-arvot (aiheet, luokka-asteet, sisältötyypit).
+
+    Lisäksi avaimen "counts" alla palautetaan rivimäärät facet-arvoittain.
+    Jos suodattimia annetaan, lukumäärät lasketaan suodatetusta joukosta
+    (esim. kuinka monta riviä kullakin luokka-asteella on valitussa oppiaineessa).
+
+    Args:
+        subjects: Valinnainen lista aiheista lukumäärien rajaamiseen.
+        grades: Valinnainen lista luokka-asteista lukumäärien rajaamiseen.
+        ctypes: Valinnainen lista sisältötyypeistä lukumäärien rajaamiseen.
+
+    Returns:
+        Sanakirja, jossa avaimina facet-tyypit ja arvoina listat uniikeista arvoista
+        sekä "counts": facet -> arvo -> rivimäärä.
+    """
+    if _use_db():
+        from TaskuOpe import ops_db
+        return ops_db.get_facets(subjects, grades, ctypes)
+    index = _get_index()
+    mask = _facet_mask(index, subjects, grades, ctypes)
+    counts: Dict[str, Dict[str, int]] = {}
+    for facet, table in index.facet_bits.items():
+        labels = index.facet_labels[facet]
+        counts[facet] = {
+            labels[key]: (bits if mask is None else bits & mask).bit_count()
+            for key, bits in table.items()
+        }
+    return {**index.facets, "counts": counts}
+
+def _facet_mask(
+    index: OpsIndex,
+    subjects: Optional[List[str]] = None,
+    grades: Optional[List[str]] = None,
+    ctypes: Optional[List[str]] = None,
+) -> Optional[int]:
+    """Yhdistää facet-suodattimet yhdeksi bittimaskiksi.
 
-    - summaa kyselytermien esiintymät (TF)
-    - normalisoi kevyesti dokumentin pituudella
-    - bonus jos kaikki termit löytyvät
+    Saman facetin arvot yhdistetään (OR) ja eri facetit leikataan (AND).
 
     Args:
+        index: Ladattu indeksi.
+        subjects: Lista aiheista, joilla suodattaa.
+        grades: Lista luokka-asteista, joilla suodattaa.
+        ctypes: Lista sisältötyypeistä, joilla suodattaa.
+
+    Returns:
+        Bittimaski sallituista riveistä tai None, jos suodattimia ei annettu.
+    """
+    mask: Optional[int] = None
+    for facet, values in (("subjects", subjects), ("grades", grades), ("content_types", ctypes)):
+        keys = {v.strip().lower() for v in (values or []) if v}
+        if not keys:
+            continue
+        table = index.facet_bits.get(facet, {})
+        facet_bits = 0
+        for key in keys:
+            facet_bits |= table.get(key, 0)
+        mask = facet_bits if mask is None else (mask & facet_bits)
+    return mask
+
+def _mask_to_array(index: OpsIndex, mask: int) -> np.ndarray:
+    """Muuntaa bittimaskin pakatuksi uint8-taulukoksi vektoroitua jäsenyystestiä varten.
+
+    Rivin i jäsenyys: ``a[i >> 3] >> (i & 7) & 1``.
+    """
+    return np.frombuffer(mask.to_bytes((index.n_docs + 7) // 8 or 1, "little"), dtype=np.uint8)
+
+def _in_mask(packed: np.ndarray, docs: np.ndarray) -> np.ndarray:
+    """Palauttaa totuusarvotaulukon: kuuluuko kukin rivi pakattuun maskiin."""
+    return ((packed[docs >> 3] >> (docs & 7).astype(np.uint8)) & 1).astype(bool)
+
+def _bm25_scores(
+    index: OpsIndex, query_tokens: List[str], allowed: Optional[int] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Laskee BM25-pisteet käymällä läpi vain kyselytermien postings-listat.
+
+    Args:
+        index: Ladattu indeksi.
         query_tokens: Lista tokeneita hakukyselystä.
-        row: Sanakirja, joka edustaa yhtä OPS-chunkkia (sisältäen _tf ja _len).
+        allowed: Valinnainen bittimaski riveistä, joihin tulokset rajataan
+            (facet-suodatus). None tarkoittaa, että kaikki rivit kelpaavat.
+
+    Returns:
+        Tuple (rivi-indeksit, pisteet) niille riveille, joilla on osumia.
+    """
+    packed = _mask_to_array(index, allowed) if allowed is not None else None
+    doc_parts: List[np.ndarray] = []
+    score_parts: List[np.ndarray] = []
+    for term, qtf in Counter(query_tokens).items():
+        t = index.term_ids.get(term)
+        if t is None:
+            continue
+        lo, hi = int(index.post_ptr[t]), int(index.post_ptr[t + 1])
+        docs = np.asarray(index.post_doc[lo:hi])
+        tf = np.asarray(index.post_tf[lo:hi], dtype=np.float32)
+        if packed is not None:
+            keep = _in_mask(packed, docs)
+            docs, tf = docs[keep], tf[keep]
+        weight = qtf * float(index.idf[t]) * (BM25_K1 + 1.0)
+        doc_parts.append(docs)
+        score_parts.append(weight * tf / (tf + index.len_norm[docs]))
+
+    if not doc_parts:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+    docs = np.concatenate(doc_parts)
+    contrib = np.concatenate(score_parts)
+    uniq, inverse = np.unique(docs, return_inverse=True)
+    return uniq, np.bincount(inverse, weights=contrib)
+
+def _vector_scores(
+    index: OpsIndex, query: str, allowed: Optional[int] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Laskee kyselyn kosinisamankaltaisuuden riveihin (ks. ops_vectors).
+
+    Args:
+        index: Ladattu indeksi.
+        query: Kyselyteksti.
+        allowed: Valinnainen bittimaski sallituista riveistä.
 
     Returns:
-        Chunkin pistemäärä, nolla jos ei osumia.
-    """
-    if not query_tokens:
-        return 0.0
-    tf = row["_tf"]
-    hits = sum(tf.get(t, 0) for t in query_tokens)
-    if hits == 0:
-        return 0.0
-    coverage = len({t for t in query_tokens if tf.get(t, 0) > 0}) / len(set(query_tokens))
-    base = hits / (0.5 + 0.5 * row["_len"])  # kevyt pituuspenalti
-    return base * (1.0 + coverage)           # palkitse kattavuudesta (1–2x)
+        Tuple (rivi-indeksit, pisteet) sallituille riveille.
+    """
+    vec = index.vectors
+    qv = ops_vectors.embed_query(query, vec["vec_features"], vec["vec_idf"], vec["vec_components"])
+    if not qv.any():
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+    scores = ops_vectors.cosine_scores(vec["vectors"], qv)
+    if allowed is None:
+        return np.arange(index.n_docs), scores
+    packed = _mask_to_array(index, allowed)
+    docs = np.flatnonzero(np.unpackbits(packed, bitorder="little")[:index.n_docs])
+    return docs, scores[docs]
+
+def _hybrid_scores(
+    index: OpsIndex, query: str, allowed: Optional[int] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Yhdistää BM25- ja vektorirankingit Reciprocal Rank Fusionilla.
+
+    Kummastakin rankingista otetaan HYBRID_CANDIDATES parasta ehdokasta.
+    Pisteet ovat RRF-pisteitä, eivät BM25- tai kosiniarvoja.
+    """
+    rankings = []
+    for docs, scores in (
+        _bm25_scores(index, index.analyze(query), allowed),
+        _vector_scores(index, query, allowed),
+    ):
+        top = _top_k(docs, scores, HYBRID_CANDIDATES, 0.0)
+        rankings.append(np.asarray([i for _, i in top], dtype=np.int64))
+    fused = ops_vectors.rrf_fuse(rankings, index.n_docs)
+    docs = np.flatnonzero(fused)
+    return docs, fused[docs]
+
+def _top_k(docs: np.ndarray, scores: np.ndarray, k: int, min_score: float) -> List[Tuple[float, int]]:
+    """Valitsee k parasta (pisteet, rivi) -paria osittaisella lajittelulla.
+
+    Tasapisteissä pienempi rivi-indeksi ensin, jotta järjestys on vakaa.
+    """
+    keep = scores > min_score
+    docs, scores = docs[keep], scores[keep]
+    if k <= 0 or not len(docs):
+        return []
+    if len(docs) > k:
+        part = np.argpartition(-scores, k - 1)[:k]
+        docs, scores = docs[part], scores[part]
+    order = np.lexsort((docs, -scores))
+    return [(float(scores[i]), int(docs[i])) for i in order]
 
 def retrieve_chunks(
     query: str = "",
@@ -151,9 +629,10 @@ def retrieve_chunks(
     subjects: Optional[List[str]] = None,
     grades: Optional[List[str]] = None,
     ctypes: Optional[List[str]] = None,
-    min_score: float = 0.0
+    min_score: float = 0.0,
+    mode: Optional[str] = None,
 ) -> List[Dict]:
-    """Palauttaa top-k chunkit ilman RapidFuzzia.
+    """Palauttaa top-k chunkit BM25-, vektori- tai hybridihaulla ilman RapidFuzzia.
 
     Jos query on tyhjä, palauttaa k lyhyintä riviä valituilla suodattimilla.
 
@@ -163,46 +642,278 @@ def retrieve_chunks(
         subjects: Lista aiheista, joilla suodattaa.
         grades: Lista luokka-asteista, joilla suodattaa.
         ctypes: Lista sisältötyypeistä, joilla suodattaa.
-        min_score: Minimipistemäärä, jolla chunk palautetaan.
+        min_score: Minimipistemäärä, jolla chunk palautetaan. Asteikko riippuu
+            tilasta (BM25-pisteet, kosinisamankaltaisuus tai RRF-pisteet).
+        mode: "bm25", "vector" tai "hybrid"; oletuksena asetus OPS_SEARCH_MODE.
+            Tietokantataustalla (OPS_SEARCH_BACKEND = "db") käytetään aina
+            tietokannan kokotekstihakua.
 
     Returns:
         Lista sanakirjoja, jotka edustavat löydettyjä OPS-chunkkeja
         pisteytyksen tai pituuden mukaan järjestettynä.
+
+    Raises:
+        ValueError: Jos mode on tuntematon.
     """
-    _load_data()
-    subj_set = {s.strip().lower() for s in (subjects or []) if s}
-    grade_set = {g.strip().lower() for g in (grades or []) if g}
-    type_set = {t.strip().lower() for t in (ctypes or []) if t}
+    mode = (mode or getattr(settings, "OPS_SEARCH_MODE", "bm25")).lower()
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Tuntematon hakutila: {mode!r}")
+    if _use_db():
+        from TaskuOpe import ops_db
+        return ops_db.search(query, k, subjects, grades, ctypes, min_score)
+    index = _get_index()
+    key = _cache_key(index, query, k, subjects, grades, ctypes, min_score, mode)
+    cached = _cache_get(key)
+    if cached is None:
+        cached = _retrieve(index, query, k, subjects, grades, ctypes, min_score, mode)
+        _cache_put(key, cached)
+    # Kopiot, jotta kutsujan muutokset eivät päädy välimuistiin
+    return [dict(r) for r in cached]
+
+def retrieve_chunks_batch(queries: List[Dict], snippet_chars: Optional[int] = None) -> List[Dict]:
+    """Suorittaa useita hakuja yhdellä kutsulla.
+
+    Indeksi ladataan ja tarkistetaan kerran koko erälle, ja saman erän
+    identtiset haut (sama normalisoitu kysely, facetit, k ja tila) lasketaan
+    vain kerran. Tulokset kulkevat saman tulosvälimuistin kautta kuin
+    retrieve_chunks.
 
-    rows: List[Dict] = []
-    for r in _DATA:
-        if subj_set and r["subject"].lower() not in subj_set:
-            continue
-        if grade_set and r["grade_context"].lower() not in grade_set:
-            continue
-        if type_set and r["content_type"].lower() not in type_set:
-            continue
-        rows.append(r)
+    Args:
+        queries: Lista hakuja. Avaimet: q, subjects, grades, ctypes, k,
+            offset, limit, min_score ja mode (kaikki valinnaisia). k rajataan
+            asetukseen OPS_MAX_K. limit on sivun koko (oletus ja enintään k)
+            ja offset sivun alku.
+        snippet_chars: Jos annettu, koko tekstin sijaan palautetaan enintään
+            näin pitkä katkelma (kenttä "snippet").
+
+    Returns:
+        Lista, jossa kullekin haulle sanakirja: results, offset, limit,
+        has_more ja took_ms.
+
+    Raises:
+        ValueError: Jos jonkin haun tila on tuntematon.
+    """
+    max_k = max_results()
+    use_db = _use_db()
+    index = None if use_db else _get_index()
+    seen: Dict[Tuple, List[Dict]] = {}
+    out: List[Dict] = []
+    for spec in queries:
+        started = time.perf_counter()
+        query = str(spec.get("q") or "")
+        mode = (spec.get("mode") or getattr(settings, "OPS_SEARCH_MODE", "bm25")).lower()
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Tuntematon hakutila: {mode!r}")
+        k = _clamp(spec.get("k"), 8, 1, max_k)
+        limit = _clamp(spec.get("limit"), k, 1, k)
+        offset = _clamp(spec.get("offset"), 0, 0, max_k)
+        # Haetaan yksi ylimääräinen, jotta tiedetään onko seuraavaa sivua
+        window = min(offset + limit + 1, max_k)
+        facets = (spec.get("subjects"), spec.get("grades"), spec.get("ctypes"))
+        min_score = float(spec.get("min_score") or 0.0)
+
+        if use_db:
+            # Tietokantahaku ei käytä prosessin tulosvälimuistia
+            from TaskuOpe import ops_db
+            key = ("db", query, window, repr(facets), min_score)
+            if key not in seen:
+                seen[key] = ops_db.search(query, window, *facets, min_score)
+        else:
+            key = _cache_key(index, query, window, *facets, min_score, mode)
+            if key not in seen:
+                cached = _cache_get(key)
+                if cached is None:
+                    cached = _retrieve(index, query, window, *facets, min_score, mode)
+                    _cache_put(key, cached)
+                seen[key] = cached
+        hits = seen[key]
+
+        page = [dict(r) for r in hits[offset:offset + limit]]
+        if snippet_chars:
+            for r in page:
+                r["snippet"] = make_snippet(r.pop("text"), snippet_chars)
+        out.append({
+            "results": page,
+            "offset": offset,
+            "limit": limit,
+            "has_more": len(hits) > offset + limit,
+            "took_ms": round((time.perf_counter() - started) * 1000, 3),
+        })
+    return out
+
+def _use_db() -> bool:
+    """Käytetäänkö tietokantapohjaista hakua (OPS_SEARCH_BACKEND = "db")."""
+    return getattr(settings, "OPS_SEARCH_BACKEND", "memory") == "db"
+
+def max_results() -> int:
+    """Palauttaa yhden haun tulosten ylärajan (asetus OPS_MAX_K, oletus 50)."""
+    return int(getattr(settings, "OPS_MAX_K", 50))
+
+def _clamp(value, default: int, low: int, high: int) -> int:
+    """Muuntaa arvon kokonaisluvuksi välille [low, high]; virheellinen arvo -> default."""
+    try:
+        value = int(value) if value not in (None, "") else default
+    except (TypeError, ValueError):
+        value = default
+    return max(low, min(high, value))
 
+def make_snippet(text: str, max_chars: int = 200) -> str:
+    """Lyhentää tekstin sanarajalta enintään max_chars merkkiin.
+
+    Args:
+        text: Lyhennettävä teksti.
+        max_chars: Katkelman enimmäispituus.
+
+    Returns:
+        Katkelma, jonka perään lisätään "…", jos tekstiä lyhennettiin.
+    """
+    text = " ".join(text.split())
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(" ", 1)[0] or text[:max_chars]
+    return cut.rstrip(",.;:") + "…"
+
+def _retrieve(
+    index: OpsIndex,
+    query: str,
+    k: int,
+    subjects: Optional[List[str]],
+    grades: Optional[List[str]],
+    ctypes: Optional[List[str]],
+    min_score: float,
+    mode: str,
+) -> List[Dict]:
+    """Suorittaa haun ilman välimuistia (ks. retrieve_chunks)."""
+    allowed = _facet_mask(index, subjects, grades, ctypes)
+    if allowed == 0 or k <= 0:
+        return []
+
+    if not query.strip():
+        ids = np.asarray(index.by_length)
+        if allowed is not None:
+            ids = ids[_in_mask(_mask_to_array(index, allowed), ids)]
+        return [_public_fields(index.row(int(i)), score=None) for i in ids[:k]]
+
+    if mode == "vector":
+        docs, scores = _vector_scores(index, query, allowed)
+    elif mode == "hybrid":
+        docs, scores = _hybrid_scores(index, query, allowed)
+    else:
+        docs, scores = _bm25_scores(index, index.analyze(query), allowed)
+    # Top-k osittaisella lajittelulla: O(n + k log k) koko lajittelun sijaan
+    top = _top_k(docs, scores, k, min_score)
+    return [_public_fields(index.row(i), score=s) for s, i in top]
+
+def _cache_key(
+    index: OpsIndex,
+    query: str,
+    k: int,
+    subjects: Optional[List[str]],
+    grades: Optional[List[str]],
+    ctypes: Optional[List[str]],
+    min_score: float,
+    mode: str,
+) -> Tuple:
+    """Muodostaa välimuistiavaimen normalisoidusta kyselystä ja suodattimista.
+
+    BM25-tilassa kysely normalisoidaan analysoiduiksi termeiksi, joten esim.
+    "Murtoluvut" ja "murtoluvut!" jakavat saman avaimen. Vektori- ja
+    hybriditilassa käytetään pienaakkostettua, välilyönneiltään tiivistettyä
+    kyselyä, koska merkki-n-grammit riippuvat koko sanasta.
+    """
     if not query.strip():
-        rows.sort(key=lambda x: len(x["text"]))
-        rows = rows[:k]
-        return [_public_fields(x, score=None) for x in rows]
-
-    q_tokens = _tokenize(query)
-    scored = []
-    for r in rows:
-        s = _score(q_tokens, r)
-        if s > min_score:
-            scored.append((s, r))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [_public_fields(r, score=float(s)) for s, r in scored[:k]]
+        q = None  # tyhjä kysely: lyhyimmät rivit
+    elif mode == "bm25":
+        q = tuple(sorted(index.analyze(query)))
+    else:
+        q = " ".join(query.lower().split())
+    facets = tuple(
+        tuple(sorted({v.strip().lower() for v in (values or []) if v}))
+        for values in (subjects, grades, ctypes)
+    )
+    return (index.version, mode, q, facets, int(k), float(min_score))
+
+def _shared_cache():
+    """Palauttaa jaetun Django-välimuistin (OPS_CACHE_ALIAS) tai None."""
+    alias = getattr(settings, "OPS_CACHE_ALIAS", None)
+    if not alias:
+        return None
+    from django.core.cache import caches
+    return caches[alias]
+
+def _shared_key(key: Tuple) -> str:
+    return "ops:" + hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+def _cache_get(key: Tuple) -> Optional[List[Dict]]:
+    """Hakee tuloksen paikallisesta LRU:sta ja sen jälkeen jaetusta välimuistista."""
+    with _CACHE_LOCK:
+        if key in _RESULT_CACHE:
+            _RESULT_CACHE.move_to_end(key)
+            _CACHE_STATS["hits"] += 1
+            return _RESULT_CACHE[key]
+
+    shared = _shared_cache()
+    if shared is not None:
+        try:
+            value = shared.get(_shared_key(key))
+        except Exception as e:
+            print(f"OPS-välimuistin luku epäonnistui: {e}")
+            value = None
+        if value is not None:
+            _cache_put(key, value, shared=False)
+            with _CACHE_LOCK:
+                _CACHE_STATS["shared_hits"] += 1
+            return value
+
+    with _CACHE_LOCK:
+        _CACHE_STATS["misses"] += 1
+    return None
+
+def _cache_put(key: Tuple, value: List[Dict], shared: bool = True) -> None:
+    """Tallentaa tuloksen LRU:hun (ja jaettuun välimuistiin) ja karsii vanhimmat."""
+    maxsize = int(getattr(settings, "OPS_CACHE_SIZE", 512))
+    if maxsize > 0:
+        with _CACHE_LOCK:
+            _RESULT_CACHE[key] = value
+            _RESULT_CACHE.move_to_end(key)
+            while len(_RESULT_CACHE) > maxsize:
+                _RESULT_CACHE.popitem(last=False)
+                _CACHE_STATS["evictions"] += 1
+
+    cache = _shared_cache() if shared else None
+    if cache is not None:
+        try:
+            cache.set(_shared_key(key), value, getattr(settings, "OPS_CACHE_TIMEOUT", 3600))
+        except Exception as e:
+            print(f"OPS-välimuistin kirjoitus epäonnistui: {e}")
+
+def clear_cache() -> None:
+    """Tyhjentää prosessikohtaisen tulosvälimuistin ja nollaa laskurit."""
+    with _CACHE_LOCK:
+        _RESULT_CACHE.clear()
+        for name in _CACHE_STATS:
+            _CACHE_STATS[name] = 0
+
+def cache_stats() -> Dict:
+    """Palauttaa tulosvälimuistin osuma- ja hutilaskurit.
+
+    Returns:
+        Sanakirja: hits, shared_hits, misses, evictions, size, maxsize,
+        hit_rate ja index_version.
+    """
+    with _CACHE_LOCK:
+        stats = dict(_CACHE_STATS)
+        stats["size"] = len(_RESULT_CACHE)
+    lookups = stats["hits"] + stats["shared_hits"] + stats["misses"]
+    stats["maxsize"] = int(getattr(settings, "OPS_CACHE_SIZE", 512))
+    stats["hit_rate"] = round((stats["hits"] + stats["shared_hits"]) / lookups, 4) if lookups else 0.0
+    stats["index_version"] = _INDEX.version if _INDEX is not None else None
+    return stats
 
 def _public_fields(row: Dict, score: Optional[float]) -> Dict:
     """Muokkaa OPS-chunkin sanakirjan julkisesti näkyvään muotoon.
 
-    Piilottaa sisäiset apukentät (esim. _tokens, _tf, _len) ja lisää
-    tarvittaessa pistemäärän.
+    Palauttaa kopion julkisista kentistä ja lisää tarvittaessa pistemäärän.
 
     Args:
         row: Alkuperäinen OPS-chunk-sanakirja.
@@ -0,0 +1,177 @@
+# TaskuOpe/ops_db.py
+"""Tietokantapohjainen OPS-haku (OpsChunk-malli).
+
+Vaihtoehto muistiin ladattavalle indeksille (ops_chunks). Käyttöön asetuksella
+``OPS_SEARCH_BACKEND = "db"``, jolloin retrieve_chunks ja get_facets ohjataan
+tänne. Rivit ladataan komennolla ``python manage.py load_ops_chunks``.
+
+- PostgreSQL: generoitu tsvector-sarake (finnish-konfiguraatio) ja GIN-indeksi,
+  kysely to_tsquery + ts_rank_cd; kyselysanat etuliitteinä OR-ehdoin kuten SQLitessä
+- SQLite: FTS5-taulu (external content, triggerit), kysely MATCH + bm25();
+  kyselysanat vartaloidaan ops_analyzerilla ja haetaan etuliitteinä
+
+Muut tietokannat käyttävät icontains-suodatusta ilman pisteytystä.
+"""
+
+from typing import Dict, List, Optional
+
+from django.db import connection
+from django.db.models import Count, Q
+from django.db.models.functions import Length
+
+from TaskuOpe.ops_analyzer import STOPWORDS, stem_fi, tokenize
+
+
+def _model():
+    from materials.models import OpsChunk
+    return OpsChunk
+
+
+def _facet_filter(subjects, grades, ctypes) -> Q:
+    """Rakentaa facet-suodattimen: OR saman facetin sisällä, AND facettien välillä."""
+    q = Q()
+    for field, values in (("subject", subjects), ("grade_context", grades), ("content_type", ctypes)):
+        values = {v.strip() for v in (values or []) if v and v.strip()}
+        if not values:
+            continue
+        facet_q = Q()
+        for value in values:
+            facet_q |= Q(**{f"{field}__iexact": value})
+        q &= facet_q
+    return q
+
+
+def _public_fields(chunk, score: Optional[float]) -> Dict:
+    out = {
+        "id": chunk.external_id,
+        "text": chunk.content,
+        "subject": chunk.subject,
+        "grade_context": chunk.grade_context,
+        "content_type": chunk.content_type,
+        "source": chunk.source,
+    }
+    if score is not None:
+        out["score"] = round(score, 6)
+    return out
+
+
+def _fts5_query(query: str) -> str:
+    """Muuntaa kyselyn FTS5-lausekkeeksi: vartaloidut sanat etuliitehakuna, OR-ehdoin."""
+    terms = []
+    for token in tokenize(query):
+        if token in STOPWORDS:
+            continue
+        stem = stem_fi(token) if token.isalpha() else token
+        terms.append(f'"{stem}"*')
+    return " OR ".join(dict.fromkeys(terms))
+
+
+def _tsquery(query: str) -> str:
+    """Muuntaa kyselyn to_tsquery-lausekkeeksi: sanat etuliitehakuna, OR-ehdoin.
+
+    Vartalointi jätetään PostgreSQL:n finnish-konfiguraatiolle, jolla myös
+    hakuvektori on laskettu.
+    """
+    terms = [f"'{token}':*" for token in tokenize(query) if token not in STOPWORDS]
+    return " | ".join(dict.fromkeys(terms))
+
+
+def _ranked_ids(query: str, candidates, k: int, min_score: float, filtered: bool) -> List[tuple]:
+    """Palauttaa enintään k [(id, pisteet)] parhaasta huonoimpaan tietokannan kokotekstihaulla.
+
+    Facet-suodatus tehdään samassa kyselyssä alikyselynä (filtered=True).
+    """
+    sub_sql, sub_params = ("", ())
+    if filtered:
+        sql, params = candidates.values("id").query.sql_with_params()
+        sub_sql, sub_params = f" AND {{col}} IN ({sql})", params
+    vendor = connection.vendor
+    with connection.cursor() as cursor:
+        if vendor == "postgresql":
+            tsquery = _tsquery(query)
+            if not tsquery:
+                return []
+            cursor.execute(
+                "SELECT id, ts_rank_cd(search_vector, q) AS rank "
+                "FROM materials_opschunk, to_tsquery('finnish', %s) q "
+                "WHERE search_vector @@ q AND ts_rank_cd(search_vector, q) > %s"
+                + sub_sql.format(col="id") +
+                " ORDER BY rank DESC, id LIMIT %s",
+                [tsquery, min_score, *sub_params, k],
+            )
+        elif vendor == "sqlite":
+            match = _fts5_query(query)
+            if not match:
+                return []
+            # bm25() on sitä pienempi mitä parempi osuma; käännetään etumerkki
+            cursor.execute(
+                "SELECT rowid, -bm25(materials_opschunk_fts) AS rank "
+                "FROM materials_opschunk_fts "
+                "WHERE materials_opschunk_fts MATCH %s AND -bm25(materials_opschunk_fts) > %s"
+                + sub_sql.format(col="rowid") +
+                " ORDER BY rank DESC, rowid LIMIT %s",
+                [match, min_score, *sub_params, k],
+            )
+        else:
+            words = [t for t in tokenize(query) if t not in STOPWORDS]
+            if not words:
+                return []
+            q = Q()
+            for w in words:
+                q |= Q(content__icontains=w)
+            return [(pk, None) for pk in candidates.filter(q).order_by("id").values_list("id", flat=True)[:k]]
+        return [(row[0], float(row[1])) for row in cursor.fetchall()]
+
+
+def search(
+    query: str = "",
+    k: int = 8,
+    subjects: Optional[List[str]] = None,
+    grades: Optional[List[str]] = None,
+    ctypes: Optional[List[str]] = None,
+    min_score: float = 0.0,
+) -> List[Dict]:
+    """Hakee OPS-chunkit tietokannasta. Paluuarvo kuten ops_chunks.retrieve_chunks.
+
+    Args:
+        query: Hakutermi. Tyhjällä kyselyllä palautetaan k lyhyintä riviä.
+        k: Palautettavien chunkien maksimimäärä.
+        subjects: Lista aiheista, joilla suodattaa.
+        grades: Lista luokka-asteista, joilla suodattaa.
+        ctypes: Lista sisältötyypeistä, joilla suodattaa.
+        min_score: Minimipistemäärä (tietokannan oma asteikko).
+
+    Returns:
+        Lista sanakirjoja, jotka edustavat löydettyjä OPS-chunkkeja.
+    """
+    if k <= 0:
+        return []
+    OpsChunk = _model()
+    facet_q = _facet_filter(subjects, grades, ctypes)
+    candidates = OpsChunk.objects.filter(facet_q)
+
+    if not query.strip():
+        rows = candidates.annotate(text_len=Length("content")).order_by("text_len", "id")[:k]
+        return [_public_fields(c, score=None) for c in rows]
+
+    ranked = _ranked_ids(query, candidates, k, min_score, filtered=bool(facet_q))
+    by_id = OpsChunk.objects.in_bulk([pk for pk, _ in ranked])
+    return [_public_fields(by_id[pk], score=s) for pk, s in ranked if pk in by_id]
+
+
+def get_facets(
+    subjects: Optional[List[str]] = None,
+    grades: Optional[List[str]] = None,
+    ctypes: Optional[List[str]] = None,
+) -> Dict:
+    """Palauttaa facet-arvot ja rivimäärät tietokannasta (kuten ops_chunks.get_facets)."""
+    OpsChunk = _model()
+    all_rows = OpsChunk.objects.all()
+    filtered = all_rows.filter(_facet_filter(subjects, grades, ctypes))
+    out: Dict = {"counts": {}}
+    for facet, field in (("subjects", "subject"), ("grades", "grade_context"), ("content_types", "content_type")):
+        values = sorted(v for v in all_rows.values_list(field, flat=True).distinct() if v)
+        counts = dict(filtered.values_list(field).annotate(n=Count("id")).values_list(field, "n"))
+        out[facet] = values
+        out["counts"][facet] = {v: counts.get(v, 0) for v in values}
+    return out
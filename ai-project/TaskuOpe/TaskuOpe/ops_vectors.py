@@ -0,0 +1,160 @@
+# TaskuOpe/ops_vectors.py
+"""Paikalliset tiheät vektorit OPS-hakuun.
+
+Vektorit lasketaan ilman verkkoa ja GPU:ta scikit-learnilla:
+
+1. merkki-n-grammit (char_wb, 3–5) hajautetaan HashingVectorizerilla
+2. sublineaarinen tf ja idf-painotus korpuksessa esiintyville piirteille
+3. TruncatedSVD (LSA) tiivistää vektorit DIM-ulotteisiksi
+4. rivit L2-normalisoidaan, jolloin kosinisamankaltaisuus on pelkkä pistetulo
+
+Tulos on yksi float32-matriisi (rivit x DIM), joka tallennetaan OPS-indeksin
+rinnalle ja muistikartoitetaan kuten muutkin taulukot. Kyselyn upotus tarvitsee
+vain käytettyjen piirteiden idf-arvot ja SVD-komponentit, ei koko
+piirreavaruutta.
+
+Merkki-n-grammit sietävät taivutusta ja yhdyssanoja, ja LSA tuo samaan
+suuntaan sanoja, jotka esiintyvät samoissa yhteyksissä. Siksi vektorihaku
+löytää myös sanamuodoltaan erilaisia, parafrasoituja kyselyjä.
+"""
+
+from typing import Dict, List
+
+import numpy as np
+
+N_FEATURES = 2 ** 16
+NGRAM_RANGE = (3, 5)
+DIM = 128
+# Reciprocal Rank Fusion -vakio (Cormack ym. 2009)
+RRF_K = 60
+
+_VECTORIZER = None
+
+
+def _vectorizer():
+    """Palauttaa jaetun HashingVectorizerin (tilaton, luodaan kerran)."""
+    global _VECTORIZER
+    if _VECTORIZER is None:
+        from sklearn.feature_extraction.text import HashingVectorizer
+        _VECTORIZER = HashingVectorizer(
+            analyzer="char_wb",
+            ngram_range=NGRAM_RANGE,
+            n_features=N_FEATURES,
+            alternate_sign=False,
+            norm=None,
+            lowercase=True,
+        )
+    return _VECTORIZER
+
+
+def _normalize_rows(m: np.ndarray) -> np.ndarray:
+    """L2-normalisoi matriisin rivit (nollarivit jäävät nolliksi)."""
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (m / norms).astype(np.float32)
+
+
+def build_vectors(texts: List[str]) -> Dict[str, np.ndarray]:
+    """Laskee rivivektorit ja kyselyn upottamiseen tarvittavat taulukot.
+
+    Args:
+        texts: OPS-rivien tekstit indeksin rivijärjestyksessä.
+
+    Returns:
+        Sanakirja taulukoista:
+        - ``vectors``: normalisoitu float32-matriisi (rivit x dim)
+        - ``vec_features``: käytetyt hajautetut piirteet nousevassa järjestyksessä
+        - ``vec_idf``: piirteiden idf-painot
+        - ``vec_components``: SVD-komponentit piirteittäin (piirteet x dim)
+    """
+    from sklearn.decomposition import TruncatedSVD
+    from sklearn.preprocessing import normalize
+
+    n_docs = len(texts)
+    if n_docs == 0:
+        return {
+            "vectors": np.zeros((0, 1), dtype=np.float32),
+            "vec_features": np.zeros(0, dtype=np.int32),
+            "vec_idf": np.zeros(0, dtype=np.float32),
+            "vec_components": np.zeros((0, 1), dtype=np.float32),
+        }
+
+    x = _vectorizer().transform(texts).tocsc()
+    features = np.flatnonzero(np.diff(x.indptr)).astype(np.int32)
+    x = x[:, features].tocsr()
+    x.data = 1.0 + np.log(x.data)
+    df = np.bincount(x.indices, minlength=len(features))
+    idf = (np.log((1.0 + n_docs) / (1.0 + df)) + 1.0).astype(np.float32)
+    x = normalize(x.multiply(idf).tocsr())
+
+    dim = max(1, min(DIM, n_docs - 1, len(features) - 1))
+    if dim < 2:
+        # Liian pieni korpus hajotelmalle: käytetään tf-idf-vektoreita sellaisenaan
+        components = np.eye(len(features), dtype=np.float32)
+        vectors = x.toarray()
+    else:
+        svd = TruncatedSVD(n_components=dim, random_state=0)
+        vectors = svd.fit_transform(x)
+        components = svd.components_.T
+    return {
+        "vectors": _normalize_rows(vectors),
+        "vec_features": features,
+        "vec_idf": idf,
+        "vec_components": np.ascontiguousarray(components, dtype=np.float32),
+    }
+
+
+def embed_query(query: str, features: np.ndarray, idf: np.ndarray, components: np.ndarray) -> np.ndarray:
+    """Upottaa kyselyn samaan avaruuteen kuin rivivektorit.
+
+    Vain korpuksessa esiintyvät piirteet otetaan huomioon, joten työ on
+    verrannollinen kyselyn n-grammien määrään eikä piirreavaruuden kokoon.
+
+    Args:
+        query: Kyselyteksti.
+        features: build_vectorsin ``vec_features``.
+        idf: build_vectorsin ``vec_idf``.
+        components: build_vectorsin ``vec_components``.
+
+    Returns:
+        Normalisoitu float32-vektori (dim,) tai nollavektori, jos yksikään
+        kyselyn piirre ei esiinny korpuksessa.
+    """
+    q = _vectorizer().transform([query])
+    dim = components.shape[1]
+    if not q.nnz or not len(features):
+        return np.zeros(dim, dtype=np.float32)
+    pos = np.searchsorted(features, q.indices)
+    pos[pos == len(features)] = 0
+    known = features[pos] == q.indices
+    if not known.any():
+        return np.zeros(dim, dtype=np.float32)
+    pos = pos[known]
+    weights = (1.0 + np.log(q.data[known])) * idf[pos]
+    weights /= np.linalg.norm(weights)
+    vec = weights.astype(np.float32) @ np.asarray(components[pos])
+    norm = np.linalg.norm(vec)
+    return (vec / norm).astype(np.float32) if norm else vec.astype(np.float32)
+
+
+def cosine_scores(vectors: np.ndarray, query_vec: np.ndarray) -> np.ndarray:
+    """Laskee kosinisamankaltaisuudet kaikille riveille yhdellä matriisitulolla."""
+    return np.asarray(vectors) @ query_vec
+
+
+def rrf_fuse(rankings: List[np.ndarray], n_docs: int, k: int = RRF_K) -> np.ndarray:
+    """Yhdistää rankingit Reciprocal Rank Fusionilla.
+
+    Args:
+        rankings: Lista rivi-indeksitaulukoita paremmuusjärjestyksessä.
+        n_docs: Rivien kokonaismäärä.
+        k: RRF-vakio; suurempi arvo tasoittaa kärkisijojen painoa.
+
+    Returns:
+        Taulukko (n_docs,), jossa kunkin rivin yhdistetty pistemäärä
+        (0 riveille, jotka eivät esiinny missään rankingissa).
+    """
+    fused = np.zeros(n_docs, dtype=np.float64)
+    for ranked in rankings:
+        fused[ranked] += 1.0 / (k + 1.0 + np.arange(len(ranked)))
+    return fused
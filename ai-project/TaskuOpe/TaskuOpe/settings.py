@@ -146,13 +146,69 @@ if not DEBUG:
     AWS_DEFAULT_ACL = 'public-read'
     AWS_QUERYSTRING_AUTH = False
     
+    # Julkinen ACL ja Cache-Control asetetaan latauksen yhteydessä (materials.storage)
     STORAGES = {
         "default": {
-            "BACKEND": "storages.backends.s3.S3Storage",
+            "BACKEND": "materials.storage.PublicMediaStorage",
         },
         "staticfiles": {
              "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
         },
     }
     
-    MEDIA_URL = f'{AWS_S3_ENDPOINT_URL}/{AWS_LOCATION}/'
\ No newline at end of file
+    MEDIA_URL = f'{AWS_S3_ENDPOINT_URL}/{AWS_LOCATION}/'
+
+# OpenAI-asiakas (materials.ai_service.get_openai_client)
+OPENAI_BASE_URL = env('OPENAI_BASE_URL', default=None)
+OPENAI_TIMEOUT = env.float('OPENAI_TIMEOUT', default=60.0)
+OPENAI_CONNECT_TIMEOUT = env.float('OPENAI_CONNECT_TIMEOUT', default=5.0)
+OPENAI_MAX_RETRIES = env.int('OPENAI_MAX_RETRIES', default=3)
+OPENAI_MAX_CONNECTIONS = env.int('OPENAI_MAX_CONNECTIONS', default=20)
+
+# OPENAI_STUB=True ohjaa kaikki OpenAI-kutsut paikalliseen korvikepalvelimeen
+# (python manage.py openai_stub); API-avainta ei tarvita.
+OPENAI_STUB = env.bool('OPENAI_STUB', default=False)
+OPENAI_STUB_URL = env('OPENAI_STUB_URL', default='http://127.0.0.1:8765/v1')
+
+# Taustatyöt (materials.jobs, python manage.py run_jobs)
+# JOBS_EAGER=True ajaa työt heti pyynnössä ilman erillistä workeria (kehitys)
+JOBS_EAGER = env.bool('JOBS_EAGER', default=False)
+JOBS_CONCURRENCY = env.int('JOBS_CONCURRENCY', default=4)
+# Käynnissä oleva työ päivittää elonmerkkiä JOBS_HEARTBEAT_SECONDS välein; työ palautetaan
+# jonoon, jos elonmerkkiä ei ole tullut JOBS_STALE_SECONDS sekuntiin
+JOBS_HEARTBEAT_SECONDS = env.int('JOBS_HEARTBEAT_SECONDS', default=60)
+JOBS_STALE_SECONDS = env.int('JOBS_STALE_SECONDS', default=600)
+
+# Tekoälyrajapintojen nopeus- ja rinnakkaisuusrajat (materials.ratelimit)
+# AI_RATE_LIMITS yhdistetään oletuksiin, esim.
+# '{"game": {"TEACHER": {"rate": 3, "per": 60, "burst": 1, "concurrency": 1}}}'
+AI_RATE_LIMITS_ENABLED = env.bool('AI_RATE_LIMITS_ENABLED', default=True)
+AI_RATE_LIMITS = env.json('AI_RATE_LIMITS', default={})
+
+# OpenAI-kutsujen telemetria (materials.telemetry, admin: LLM-kutsut)
+LLM_LOG_ENABLED = env.bool('LLM_LOG_ENABLED', default=True)
+LLM_LOG_BATCH = env.int('LLM_LOG_BATCH', default=50)
+LLM_LOG_FLUSH_SECONDS = env.float('LLM_LOG_FLUSH_SECONDS', default=5.0)
+
+# Identtisten samanaikaisten tekoälypyyntöjen yhdistäminen (materials.singleflight)
+SINGLEFLIGHT_LEASE = env.float('SINGLEFLIGHT_LEASE', default=300.0)
+SINGLEFLIGHT_LINGER = env.float('SINGLEFLIGHT_LINGER', default=10.0)
+
+# Tehtäväkohtaiset mallit (materials.ai_models). Yhdistetään oletuksiin, esim.
+# '{"game_content": {"model": "gpt-4o-mini", "timeout": 30}}'; yksittäisen
+# tehtävän mallin voi vaihtaa myös muuttujalla AI_MODEL_<TEHTÄVÄ>.
+AI_MODELS = env.json('AI_MODELS', default={})
+
+# Pelin sisältö ja metadata generoidaan rinnakkain yhteisellä aikarajalla
+GAME_GENERATION_TIMEOUT = env.float('GAME_GENERATION_TIMEOUT', default=90.0)
+
+# Puheäänen segmentointi ja rinnakkainen generointi (materials.tts).
+# Rajapinnan syöteraja on 4096 merkkiä; lyhyet kappaleet yhdistetään seuraavaan.
+TTS_SEGMENT_CHARS = env.int('TTS_SEGMENT_CHARS', default=4000)
+TTS_MIN_SEGMENT_CHARS = env.int('TTS_MIN_SEGMENT_CHARS', default=200)
+TTS_POOL_SIZE = env.int('TTS_POOL_SIZE', default=4)
+# sweep_tts_audio ei poista tätä tuoreempia (sekunteina) äänitiedostoja
+TTS_SWEEP_MIN_AGE = env.float('TTS_SWEEP_MIN_AGE', default=86400.0)
+
+# Materiaalikuvien pakatut versiot (materials.images); "avif" vaatii Pillow-tuen
+IMAGE_VARIANT_FORMATS = env.list('IMAGE_VARIANT_FORMATS', default=['webp'])
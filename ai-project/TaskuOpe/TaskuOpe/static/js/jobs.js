@@ -0,0 +1,38 @@
+/* Taustatöiden (materials.jobs) tilan seuranta.
+ *
+ * waitForJob(job) palauttaa Promisen, joka ratkeaa työn tulokseen (result),
+ * kun työ on valmis, tai hylätään virheellä, jos työ epäonnistuu.
+ * Tilaa kysytään status_url-osoitteesta kasvavin välein.
+ */
+(function () {
+  const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+  async function pollJob(statusUrl, { interval = 1000, maxInterval = 5000, timeout = 300000 } = {}) {
+    const started = Date.now();
+    let wait = interval;
+    for (;;) {
+      const resp = await fetch(statusUrl, {
+        headers: { 'Accept': 'application/json' },
+        credentials: 'same-origin',
+      });
+      const job = await resp.json().catch(() => null);
+      if (!resp.ok || !job) {
+        throw new Error((job && job.error) || `Palvelin vastasi virheellä ${resp.status}`);
+      }
+      if (job.status === 'DONE') return job.result;
+      if (job.status === 'FAILED') throw new Error(job.error || 'Taustatyö epäonnistui.');
+      if (Date.now() - started > timeout) throw new Error('Taustatyö ei valmistunut ajoissa.');
+      await sleep(wait);
+      wait = Math.min(maxInterval, Math.round(wait * 1.5));
+    }
+  }
+
+  function waitForJob(job, options) {
+    if (job.status === 'DONE') return Promise.resolve(job.result);
+    if (job.status === 'FAILED') return Promise.reject(new Error(job.error || 'Taustatyö epäonnistui.'));
+    return pollJob(job.status_url, options);
+  }
+
+  window.pollJob = pollJob;
+  window.waitForJob = waitForJob;
+})();
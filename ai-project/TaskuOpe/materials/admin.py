@@ -1,13 +1,20 @@
 # materials/admin.py
 from django.contrib import admin
 
+from . import telemetry
 from .models import (
     AIGrade,
     Assignment,
+    BackgroundJob,
+    ImageVariant,
+    LLMCacheEntry,
+    LLMCallLog,
     Material,
     MaterialRevision,
+    OpsChunk,
     PlagiarismReport,
     Prompt,
+    RateLimitBucket,
     Rubric,
     RubricCriterion,
     Submission,
@@ -107,4 +114,87 @@ class AIGradeAdmin(admin.ModelAdmin):
         "rubric__title",
         "submission__student__username",
     )
-    list_filter = ("teacher_confirmed", "model_name", "created_at")
\ No newline at end of file
+    list_filter = ("teacher_confirmed", "model_name", "created_at")
+
+@admin.register(OpsChunk)
+class OpsChunkAdmin(admin.ModelAdmin):
+    """
+    Määrittää OpsChunk-mallin hallintanäkymän.
+    Mahdollistaa koulukohtaisten OPS-lisäysten selaamisen ja muokkaamisen.
+    """
+    list_display = ("external_id", "source", "subject", "grade_context", "content_type")
+    list_filter = ("source", "grade_context", "content_type")
+    search_fields = ("content", "subject", "external_id")
+
+
+@admin.register(LLMCacheEntry)
+class LLMCacheEntryAdmin(admin.ModelAdmin):
+    """
+    Määrittää LLM-vastausvälimuistin hallintanäkymän.
+    Näyttää rivit mallin, osumien, koon ja vanhenemisajan mukaan.
+    """
+    list_display = ("key", "model", "hits", "size", "last_used_at", "expires_at")
+    list_filter = ("model",)
+    search_fields = ("key", "response")
+    readonly_fields = ("key", "created_at", "last_used_at")
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    """
+    Määrittää taustatöiden hallintanäkymän.
+    Näyttää työt tyypin, tilan ja ajoitusten mukaan; virheelliset työt
+    löytyvät tilasuodattimella.
+    """
+    list_display = ("id", "kind", "status", "attempts", "created_by", "created_at", "finished_at")
+    list_filter = ("status", "kind")
+    search_fields = ("id", "ref", "error")
+    readonly_fields = ("created_at", "started_at", "heartbeat_at", "finished_at", "worker")
+
+
+@admin.register(RateLimitBucket)
+class RateLimitBucketAdmin(admin.ModelAdmin):
+    """
+    Määrittää nopeusrajoittimien hallintanäkymän.
+    Rivin poistaminen nollaa käyttäjän tai rajapinnan rajan.
+    """
+    list_display = ("key", "tokens", "updated_at", "cooldown_until")
+    search_fields = ("key",)
+
+
+@admin.register(ImageVariant)
+class ImageVariantAdmin(admin.ModelAdmin):
+    """
+    Määrittää kuvaversioiden hallintanäkymän (materials.images).
+    """
+    list_display = ("source", "format", "width", "height", "size", "created_at")
+    list_filter = ("format",)
+    search_fields = ("source",)
+
+
+@admin.register(LLMCallLog)
+class LLMCallLogAdmin(admin.ModelAdmin):
+    """
+    Määrittää OpenAI-kutsujen telemetrian hallintanäkymän.
+    Listan yläpuolella näytetään viiveen p50/p95 sekä tokenit ja hinta-arvio
+    ominaisuuksittain päivää kohden (telemetry.daily_summary).
+    """
+    list_display = ("created_at", "feature", "model", "latency_ms", "prompt_tokens",
+                    "completion_tokens", "cost_usd", "status", "cache_hit", "user")
+    list_filter = ("feature", "status", "cache_hit", "model")
+    date_hierarchy = "created_at"
+    search_fields = ("feature", "error")
+    list_select_related = ("user",)
+
+    def changelist_view(self, request, extra_context=None):
+        """
+        Lisää listanäkymään päiväkohtaisen koonnin (?days=N, oletus 14).
+        """
+        # days ei ole listan suodatin, joten se poistetaan ennen ChangeListiä
+        request.GET = request.GET.copy()
+        try:
+            days = max(1, min(int(request.GET.pop("days", ["14"])[-1]), 90))
+        except ValueError:
+            days = 14
+        extra_context = {**(extra_context or {}), "summary": telemetry.daily_summary(days), "summary_days": days}
+        return super().changelist_view(request, extra_context=extra_context)
@@ -0,0 +1,61 @@
+# materials/ai_models.py
+"""Tehtäväkohtainen mallivalinta (mallirekisteri).
+
+Jokaiselle tekoälytehtävälle määritetään malli ja parametrit. Pienet
+tehtävät (esim. pelin otsikko ja oppiaine) käyttävät nopeaa ja halpaa
+mallia, sisällön tuotanto vahvempaa. Jos ensisijainen malli aikakatkaistaan,
+chat_completion yrittää kerran varamallilla (fallback).
+
+Oletukset (DEFAULT_MODELS) voi ohittaa ympäristökohtaisesti:
+
+- asetuksella AI_MODELS, joka yhdistetään tehtävittäin, esim.
+  ``{"game_content": {"model": "gpt-4o-mini", "timeout": 30}}``
+- ympäristömuuttujalla AI_MODEL_<TEHTÄVÄ>, joka vaihtaa vain mallin,
+  esim. ``AI_MODEL_GAME_METADATA=gpt-4o-mini``
+"""
+
+import os
+
+from django.conf import settings
+
+DEFAULT_MODELS = {
+    "material_draft": {"model": "gpt-4o", "fallback": "gpt-4o-mini", "temperature": 0.7, "timeout": 60},
+    "game_content": {"model": "gpt-4o", "fallback": "gpt-4o-mini", "timeout": 60},
+    "game_metadata": {"model": "gpt-4o-mini", "fallback": "gpt-4o", "temperature": 0.7, "timeout": 20},
+    "rubric_grading": {"model": "gpt-4o", "fallback": "gpt-4o-mini", "temperature": 0.7, "timeout": 60},
+    "plagiarism": {"model": "gpt-4o", "fallback": "gpt-4o-mini", "temperature": 0, "timeout": 60},
+    "image": {"model": "dall-e-3"},
+    "tts": {"model": "tts-1", "voice": "fable", "speed": 0.95},
+}
+
+
+def get(task: str) -> dict:
+    """
+    Palauttaa tehtävän mallin ja parametrit.
+
+    Args:
+        task (str): Tehtävän nimi, esim. "game_metadata".
+
+    Returns:
+        dict: Vähintään "model"; lisäksi esim. fallback, temperature, timeout,
+        voice ja speed.
+
+    Raises:
+        KeyError: Jos tehtävää ei ole rekisterissä eikä asetuksissa.
+    """
+    overrides = (getattr(settings, "AI_MODELS", {}) or {}).get(task)
+    if task not in DEFAULT_MODELS and overrides is None:
+        raise KeyError(f"Tuntematon tekoälytehtävä: {task}")
+    config = {**DEFAULT_MODELS.get(task, {}), **(overrides or {})}
+    if task == "plagiarism" and os.getenv("OPENAI_MODEL_NAME"):
+        # Aiempi plagiarism.py:n ympäristömuuttuja toimii edelleen
+        config["model"] = os.environ["OPENAI_MODEL_NAME"]
+    env_model = os.getenv(f"AI_MODEL_{task.upper()}")
+    if env_model:
+        config["model"] = env_model
+    return config
+
+
+def model_for(task: str) -> str:
+    """Palauttaa tehtävän ensisijaisen mallin nimen."""
+    return get(task)["model"]
@@ -6,6 +6,7 @@ from typing import Any, Dict, List
 
 from django.utils import timezone
 
+from . import ai_models
 from .ai_service import ask_llm
 from .models import AIGrade, Material, Rubric, RubricCriterion, Submission
 from TaskuOpe.ops_chunks import format_for_llm, retrieve_chunks
@@ -154,7 +155,7 @@ def _extract_json_block(text: str) -> Dict[str, Any]:
             return {}
 
 
-def create_or_update_ai_grade(submission: Submission) -> AIGrade:
+def create_or_update_ai_grade(submission: Submission, *, fresh: bool = False) -> AIGrade:
     """
     Luo tai päivittää tekoälyn antaman arvosanan (AIGrade) annetulle vastaukselle (Submission).
     Funktio:
@@ -166,6 +167,8 @@ def create_or_update_ai_grade(submission: Submission) -> AIGrade:
 
     Args:
         submission (Submission): Oppilaan vastaus, joka arvioidaan.
+        fresh (bool): Ohitetaanko LLM-välimuisti. Kun opettaja pyytää uutta
+            ehdotusta, välimuistista ei palauteta samaa vanhaa arviota.
 
     Returns:
         AIGrade: Luotu tai päivitetty tekoälyarvosana.
@@ -174,7 +177,10 @@ def create_or_update_ai_grade(submission: Submission) -> AIGrade:
     rubric = _ensure_default_rubric(material)
     criteria = list(rubric.criteria.order_by("order", "id"))
     prompt = _build_prompt(material, submission, criteria)
-    llm_text = ask_llm(prompt, user_id=getattr(submission.assignment.assigned_by, "id", 0))
+    # Sama vastaus + rubriikki -> sama prompti; tuplaklikkausta ei lähetetä mallille
+    # uudelleen. Uusi ehdotus (fresh) haetaan aina mallilta.
+    llm_text = ask_llm(prompt, user_id=getattr(submission.assignment.assigned_by, "id", 0), cache=not fresh,
+                       feature="ai_grade", task="rubric_grading")
     data = _extract_json_block(llm_text)
     criteria_out = []
     total = 0.0
@@ -203,6 +209,7 @@ def create_or_update_ai_grade(submission: Submission) -> AIGrade:
     details = {"criteria": criteria_out, "general_feedback": general_feedback, "rubric_title": rubric.title, "generated_at": timezone.now().isoformat()}
     ag, _created = AIGrade.objects.get_or_create(submission=submission)
     ag.rubric = rubric
+    ag.model_name = ai_models.model_for("rubric_grading")
     ag.total_points = float(round(total, 2))
     ag.details = details
     ag.teacher_confirmed = False
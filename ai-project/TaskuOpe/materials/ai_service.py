@@ -1,10 +1,14 @@
 # materials/ai_service.py
 from django.conf import settings
-from openai import OpenAI
-import os, base64
+from openai import APITimeoutError, AsyncOpenAI, OpenAI
+import os, base64, math, threading, time, warnings
+
+import httpx
+
+from . import ai_models, llm_cache, ratelimit, telemetry
 
 #Chunk toiminta kirjastot
-from typing import List, Optional
+from typing import Iterator, List, Optional
 
 SYSTEM_FIN = (
     #Muutin tätä, et sain ops käytön toimii t. Mirka
@@ -16,6 +20,287 @@ SYSTEM_FIN = (
     "Luonnosteksti:\n- <Tähän varsinainen tehtävä tai tehtävät, jotka osoitetaan suoraan oppilaalle. Voit käyttää otsikointia, kuten 'Tehtävä 1:'.>"
 )
 
+# --- Jaettu OpenAI-asiakas ---
+# Yksi asiakas (ja sen httpx-yhteyspooli) per prosessi, jotta TLS-kättely ja
+# TCP-yhteys käytetään uudelleen kutsujen välillä. Asiakas on säieturvallinen.
+# Uudelleenyritykset 408/409/429/5xx-vastauksille ja yhteysvirheille hoitaa
+# SDK eksponentiaalisella viiveellä (max_retries); Retry-After huomioidaan.
+_CLIENTS: dict = {}
+_CLIENT_LOCK = threading.Lock()
+
+
+def _openai_api_key() -> Optional[str]:
+    key = os.getenv("OPENAI_API_KEY") or getattr(settings, "OPENAI_API_KEY", None)
+    if not key and getattr(settings, "OPENAI_STUB", False):
+        # Korvikepalvelin (materials.openai_stub) ei tarkista avainta
+        return "stub"
+    return key
+
+
+def _openai_base_url() -> Optional[str]:
+    if getattr(settings, "OPENAI_STUB", False):
+        return getattr(settings, "OPENAI_STUB_URL", None) or "http://127.0.0.1:8765/v1"
+    return getattr(settings, "OPENAI_BASE_URL", None) or os.getenv("OPENAI_BASE_URL") or None
+
+
+def _client_options() -> dict:
+    """Kokoaa asiakkaan asetukset (aikakatkaisut, poolin koko, uudelleenyritykset)."""
+    timeout = float(getattr(settings, "OPENAI_TIMEOUT", 60.0))
+    max_connections = int(getattr(settings, "OPENAI_MAX_CONNECTIONS", 20))
+    return {
+        "api_key": _openai_api_key(),
+        "base_url": _openai_base_url(),
+        "max_retries": int(getattr(settings, "OPENAI_MAX_RETRIES", 3)),
+        "timeout": httpx.Timeout(timeout, connect=float(getattr(settings, "OPENAI_CONNECT_TIMEOUT", 5.0))),
+        "limits": httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=int(getattr(settings, "OPENAI_MAX_KEEPALIVE", max_connections)),
+            keepalive_expiry=float(getattr(settings, "OPENAI_KEEPALIVE_EXPIRY", 30.0)),
+        ),
+    }
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    """Lukee Retry-After-ajan sekunteina (retry-after-ms tai retry-after)."""
+    try:
+        if response.headers.get("retry-after-ms"):
+            return float(response.headers["retry-after-ms"]) / 1000
+        return float(response.headers.get("retry-after", ""))
+    except ValueError:
+        return None
+
+
+def _cooldown_wait() -> float:
+    """Yhteisen tauon (ratelimit) jäljellä oleva aika, enintään OPENAI_COOLDOWN_MAX_WAIT."""
+    try:
+        wait = ratelimit.upstream_cooldown()
+    except Exception as e:
+        print(f"Rajoittimen tilan luku epäonnistui: {e}")
+        return 0.0
+    return min(wait, float(getattr(settings, "OPENAI_COOLDOWN_MAX_WAIT", 10.0)))
+
+
+def _note_429(response: httpx.Response) -> None:
+    try:
+        ratelimit.note_upstream_limit(_retry_after(response))
+    except Exception as e:
+        print(f"Rajoittimen tauon tallennus epäonnistui: {e}")
+
+
+# Yhteistyöhön perustuva taukoilu: kun OpenAI vastaa 429, tauko tallennetaan
+# kaikkien prosessien nähtäville, ja seuraavat pyynnöt odottavat sen yli
+# ennen lähettämistä sen sijaan, että ne saisivat uuden 429-vastauksen.
+def _on_request(request: httpx.Request) -> None:
+    wait = _cooldown_wait()
+    if wait > 0:
+        time.sleep(wait)
+
+
+def _on_response(response: httpx.Response) -> None:
+    if response.status_code == 429:
+        _note_429(response)
+
+
+async def _on_request_async(request: httpx.Request) -> None:
+    import asyncio
+    from asgiref.sync import sync_to_async
+    wait = await sync_to_async(_cooldown_wait)()
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+
+async def _on_response_async(response: httpx.Response) -> None:
+    if response.status_code == 429:
+        from asgiref.sync import sync_to_async
+        await sync_to_async(_note_429)(response)
+
+
+def get_openai_client() -> OpenAI:
+    """
+    Palauttaa prosessin jaetun OpenAI-asiakkaan.
+
+    Asiakas luodaan ensimmäisellä kutsulla ja sitä käytetään uudelleen, joten
+    yhteydet pysyvät auki (keep-alive). Prosessikohtainen välimuisti estää
+    yhteyspoolin jakamisen fork-rajan yli (esim. gunicorn-workerit).
+
+    Returns:
+        OpenAI: Jaettu asiakas.
+
+    Raises:
+        openai.OpenAIError: Jos API-avainta ei ole asetettu.
+    """
+    key = ("sync", os.getpid())
+    client = _CLIENTS.get(key)
+    if client is not None:
+        return client
+    with _CLIENT_LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            opts = _client_options()
+            client = OpenAI(
+                api_key=opts["api_key"],
+                base_url=opts["base_url"],
+                max_retries=opts["max_retries"],
+                timeout=opts["timeout"],
+                http_client=httpx.Client(
+                    timeout=opts["timeout"], limits=opts["limits"],
+                    event_hooks={"request": [_on_request], "response": [_on_response]},
+                ),
+            )
+            _CLIENTS[key] = client
+    return client
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """
+    Palauttaa jaetun AsyncOpenAI-asiakkaan käynnissä olevalle tapahtumasilmukalle.
+
+    httpx:n asynkroninen yhteyspooli on sidottu silmukkaan, joten asiakas
+    välimuistitetaan prosessin ja silmukan mukaan.
+
+    Returns:
+        AsyncOpenAI: Jaettu asynkroninen asiakas.
+    """
+    import asyncio
+    try:
+        loop_id = id(asyncio.get_running_loop())
+    except RuntimeError:
+        loop_id = None
+    key = ("async", os.getpid(), loop_id)
+    with _CLIENT_LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            # Poistetaan suljettujen silmukoiden asiakkaat, ettei välimuisti kasva
+            for old in [k for k in _CLIENTS if k[0] == "async" and k != key]:
+                _CLIENTS.pop(old, None)
+            opts = _client_options()
+            client = AsyncOpenAI(
+                api_key=opts["api_key"],
+                base_url=opts["base_url"],
+                max_retries=opts["max_retries"],
+                timeout=opts["timeout"],
+                http_client=httpx.AsyncClient(
+                    timeout=opts["timeout"], limits=opts["limits"],
+                    event_hooks={"request": [_on_request_async], "response": [_on_response_async]},
+                ),
+            )
+            _CLIENTS[key] = client
+    return client
+
+
+def reset_openai_clients() -> None:
+    """Sulkee ja unohtaa jaetut asiakkaat (esim. asetusten vaihtuessa testeissä)."""
+    with _CLIENT_LOCK:
+        clients = list(_CLIENTS.items())
+        _CLIENTS.clear()
+    for (kind, *_), client in clients:
+        if kind == "sync":
+            client.close()
+
+
+def _attempt_client(config: dict, model_name: str) -> OpenAI:
+    """
+    Palauttaa asiakkaan yhdelle mallin yritykselle.
+
+    Jos tehtävällä on eri varamalli, ensisijainen malli yritetään ilman SDK:n
+    uusintayrityksiä ja tehtävän aikakatkaisulla. Muuten aikakatkaisu odotettaisiin
+    max_retries-kertaisesti ennen kuin varamalliin päästään.
+    """
+    client = get_openai_client()
+    fallback = config.get("fallback")
+    if not fallback or fallback == model_name:
+        return client
+    options = {"max_retries": 0}
+    if config.get("timeout"):
+        options["timeout"] = float(config["timeout"])
+    return client.with_options(**options)
+
+
+def chat_completion(
+    messages: List[dict],
+    *,
+    task: str = "",
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+    response_format: Optional[dict] = None,
+    cache: Optional[bool] = None,
+    feature: str = "",
+    user_id: Optional[int] = None,
+) -> str:
+    """
+    Tekee Chat Completions -kutsun jaetulla asiakkaalla ja pysyvällä välimuistilla.
+
+    Kun tehtävä (task) annetaan, malli, lämpötila, aikakatkaisu ja varamalli
+    luetaan mallirekisteristä (materials.ai_models). Jos ensisijainen malli
+    aikakatkaistaan, kutsu yritetään kerran varamallilla. Ensisijaista mallia
+    ei tällöin yritetä uudelleen SDK:n sisällä (_attempt_client).
+
+    Deterministiset kutsut (temperature=0) luetaan ja tallennetaan välimuistiin
+    oletuksena. Muut kutsut ohittavat välimuistin, ellei cache=True.
+    cache=False ohittaa luvun, mutta päivittää deterministisen kutsun rivin
+    uudella vastauksella.
+
+    Args:
+        messages (List[dict]): Chat-viestit.
+        task (str): Mallirekisterin tehtävä, esim. "game_metadata".
+        model (Optional[str]): Mallin nimi (ohittaa rekisterin; oletus gpt-4o).
+        temperature (Optional[float]): Lämpötila (None = rekisterin tai mallin oletus).
+        response_format (Optional[dict]): Esim. {"type": "json_object"}.
+        cache (Optional[bool]): Välimuistin käyttö (None = automaattinen).
+        feature (str): Telemetrian ominaisuustunniste (oletus tehtävän nimi).
+        user_id (Optional[int]): Kutsun käyttäjä telemetriaa varten.
+
+    Returns:
+        str: Vastauksen teksti.
+
+    Raises:
+        openai.OpenAIError: Jos API-kutsu epäonnistuu.
+    """
+    config = ai_models.get(task) if task else {}
+    model = model or config.get("model") or "gpt-4o"
+    if temperature is None:
+        temperature = config.get("temperature")
+    feature = feature or task
+    params = {"response_format": response_format} if response_format else {}
+    use_cache = llm_cache.enabled() and (cache if cache is not None else temperature == 0)
+    key = llm_cache.make_key(model, messages, temperature, **params)
+    if use_cache:
+        hit = llm_cache.get(key)
+        if hit is not None:
+            telemetry.record(feature=feature, model=model, cache_hit=True, user_id=user_id)
+            return hit
+    else:
+        llm_cache.record_bypass()
+
+    kwargs = dict(params)
+    if temperature is not None:
+        kwargs["temperature"] = temperature
+    if config.get("timeout"):
+        kwargs["timeout"] = float(config["timeout"])
+
+    def create(model_name: str):
+        with telemetry.track(feature, model_name, user_id=user_id) as call:
+            resp = _attempt_client(config, model_name).chat.completions.create(
+                model=model_name, messages=messages, **kwargs
+            )
+            call["usage"] = getattr(resp, "usage", None)
+        return resp
+
+    try:
+        resp = create(model)
+    except APITimeoutError:
+        fallback = config.get("fallback")
+        if not fallback or fallback == model:
+            raise
+        print(f"{model} aikakatkaistiin ({task}), yritetään mallilla {fallback}")
+        resp = create(fallback)
+    content = resp.choices[0].message.content or ""
+    refresh = cache is False and temperature == 0 and llm_cache.enabled()
+    if content and (use_cache or refresh):
+        llm_cache.put(key, model, content)
+    return content
+
+
 def _demo(prompt: str) -> str:
     """
     Palauttaa demoversion tekoälyvastauksesta, kun API-avainta ei ole saatavilla.
@@ -37,7 +322,8 @@ def _demo(prompt: str) -> str:
         f"Luonnosteksti:\n- {p or 'Kirjoita pyyntö ylle ja lähetä.'}\n"
     )
 
-def ask_llm(prompt: str, *, user_id: int = 0) -> str:
+def ask_llm(prompt: str, *, user_id: int = 0, cache: Optional[bool] = None, feature: str = "",
+            task: str = "material_draft") -> str:
     """
     Kysyy Large Language Modelilta (LLM) vastausta annettuun promptiin.
     Käyttää OpenAI:n API:a. Jos API-avainta ei ole asetettu, palauttaa demovastauksen.
@@ -47,38 +333,120 @@ def ask_llm(prompt: str, *, user_id: int = 0) -> str:
         prompt (str): Kysymys tai ohjeistus LLM:lle.
         user_id (int): Valinnainen käyttäjän ID, jota voidaan käyttää
                        API-kutsujen seurantaan tai personointiin.
+        cache (Optional[bool]): True lukee saman promptin vastauksen
+                       välimuistista, False ohittaa sen. Oletuksena välimuistia
+                       ei käytetä, koska lämpötila on 0.7.
+        feature (str): Telemetrian ominaisuustunniste (oletus ympäröivästä kontekstista).
+        task (str): Mallirekisterin tehtävä (materials.ai_models).
 
     Returns:
         str: LLM:n generoitu vastaus tai demovastaus virheen sattuessa.
     """
-    api_key = os.getenv("OPENAI_API_KEY")
+    api_key = _openai_api_key()
     if not api_key:
         return _demo(prompt)
 
     try:
-        client = OpenAI(api_key=api_key)
-        resp = client.chat.completions.create(  # virallinen Chat Completions -kutsu
-            model="gpt-4o",               # voit vaihtaa esim. "gpt-4o"
-            messages=[
+        out = chat_completion(
+            [
                 {"role": "system", "content": SYSTEM_FIN},
                 {"role": "user", "content": prompt},
             ],
-            temperature=0.7,
-        )
-        out = (resp.choices[0].message.content or "").strip()
-        # Varmistus: jos malli ei seurannut formaattia, tee kevyt fallback
-        if "Otsikkoehdotus:" not in out or "Luonnosteksti:" not in out:
-            out = (
-                "Otsikkoehdotus: Luonnos\n"
-                "Tavoitteet:\n1) ...\n2) ...\n3) ...\n\n"
-                f"Luonnosteksti:\n- {out}"
-            )
-        return out
+            task=task,
+            cache=cache,
+            feature=feature,
+            user_id=user_id or None,
+        ).strip()
+        return apply_format_fallback(out)
     except Exception as e:
         # Älä kaada näkymää; palauta demomuoto virheilmoituksella
         return _demo(f"{prompt}\n\n[HUOM: API-virhe: {e}]")
 
-def generate_image_bytes(prompt: str, size: str = "1024x1024") -> bytes:
+
+def apply_format_fallback(out: str) -> str:
+    """
+    Varmistaa vastauksen muodon: jos malli ei seurannut formaattia
+    (Otsikkoehdotus/Luonnosteksti), kääritään vastaus kevyeen pohjaan.
+
+    Args:
+        out (str): Mallin vastaus.
+
+    Returns:
+        str: Vastaus pyydetyssä muodossa.
+    """
+    out = (out or "").strip()
+    if "Otsikkoehdotus:" not in out or "Luonnosteksti:" not in out:
+        out = (
+            "Otsikkoehdotus: Luonnos\n"
+            "Tavoitteet:\n1) ...\n2) ...\n3) ...\n\n"
+            f"Luonnosteksti:\n- {out}"
+        )
+    return out
+
+
+def stream_llm(prompt: str, *, user_id: int = 0) -> Iterator[str]:
+    """
+    Kysyy LLM:ltä vastausta kuten ask_llm, mutta palauttaa tekstin paloina
+    sitä mukaa kuin malli tuottaa sitä (stream=True).
+
+    Muotoa ei tarkisteta paloittain; kutsuja kokoaa palat ja soveltaa
+    lopuksi apply_format_fallback-funktiota. Jos API-avainta ei ole,
+    palautetaan demovastaus yhtenä palana. API-virhe kesken virran
+    nostetaan kutsujalle.
+
+    Args:
+        prompt (str): Kysymys tai ohjeistus LLM:lle.
+        user_id (int): Valinnainen käyttäjän ID.
+
+    Yields:
+        str: Vastauksen tekstipalat.
+    """
+    if not _openai_api_key():
+        yield _demo(prompt)
+        return
+
+    config = ai_models.get("material_draft")
+    kwargs = {"temperature": config["temperature"]} if config.get("temperature") is not None else {}
+    if config.get("timeout"):
+        kwargs["timeout"] = float(config["timeout"])
+    messages = [
+        {"role": "system", "content": SYSTEM_FIN},
+        {"role": "user", "content": prompt},
+    ]
+
+    def open_stream(model_name: str):
+        return _attempt_client(config, model_name).chat.completions.create(
+            model=model_name,
+            messages=messages,
+            stream=True,
+            # Viimeinen pala sisältää tokenimäärät (telemetria)
+            stream_options={"include_usage": True},
+            **kwargs,
+        )
+
+    with telemetry.track("material_draft_stream", config["model"], user_id=user_id or None) as call:
+        try:
+            stream = open_stream(config["model"])
+        except APITimeoutError:
+            # Aikakatkaisu ennen ensimmäistä palaa -> varamalli
+            if not config.get("fallback"):
+                raise
+            call["model"] = config["fallback"]
+            stream = open_stream(config["fallback"])
+        try:
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    call["usage"] = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        finally:
+            # Katkaistu yhteys (selain suljettu) -> vapautetaan HTTP-yhteys pooliin
+            stream.close()
+
+def generate_image_bytes(prompt: str, size: str = "1024x1024", *, user_id: Optional[int] = None) -> bytes:
     """
     Generoi kuvan DALL·E 3 -tekoälymallilla ja palauttaa sen PNG-muotoisena
     binaaridatana. Jos OpenAI API -avainta ei ole asetettu, palauttaa demokuvan.
@@ -88,6 +456,7 @@ def generate_image_bytes(prompt: str, size: str = "1024x1024") -> bytes:
         prompt (str): Kuvaus siitä, millainen kuva halutaan generoida.
         size (str): Kuvan koko. DALL·E 3 tukee vain seuraavia arvoja:
                     "1024x1024", "1024x1792" ja "1792x1024".
+        user_id (Optional[int]): Kutsun käyttäjä telemetriaa varten.
 
     Returns:
         bytes: Generoitu kuva PNG-binaarimuodossa.
@@ -97,7 +466,7 @@ def generate_image_bytes(prompt: str, size: str = "1024x1024") -> bytes:
         RuntimeError: Jos kuvan generoinnissa tapahtuu virhe tai
                       API-vastaus on epäkelpo.
     """
-    api_key = os.getenv("OPENAI_API_KEY")
+    api_key = _openai_api_key()
     if not api_key:
         # DEMO-kuva
         from PIL import Image, ImageDraw, ImageFont
@@ -117,14 +486,17 @@ def generate_image_bytes(prompt: str, size: str = "1024x1024") -> bytes:
     if size not in {"1024x1024", "1024x1792", "1792x1024"}:
         raise ValueError("DALL·E 3 tukee vain kokoja: 1024x1024, 1024x1792 ja 1792x1024")
 
-    client = OpenAI(api_key=api_key)
+    client = get_openai_client()
     try:
-        resp = client.images.generate(
-            model="dall-e-3",  # Vaihto DALL·E 3:een
-            prompt=prompt,
-            size=size,
-            n=1,
-        )
+        model = ai_models.model_for("image")
+        with telemetry.track("image", model, user_id=user_id) as call:
+            resp = client.images.generate(
+                model=model,  # Oletuksena DALL·E 3 (materials.ai_models)
+                prompt=prompt,
+                size=size,
+                n=1,
+            )
+            call["units"] = 1
         item = resp.data[0]
 
         # 1) Yritä base64
@@ -159,20 +531,25 @@ def generate_speech(text_to_speak: str) -> bytes | None:
     Returns:
         bytes | None: Äänidata MP3-muodossa tai None virheen sattuessa.
     """
-    api_key = os.environ.get("OPENAI_API_KEY") or getattr(settings, "OPENAI_API_KEY", None)
+    api_key = _openai_api_key()
     if not api_key:
         print("Text-to-Speech Error: OPENAI_API_KEY is not set.")
         return None
 
     try:
-        client = OpenAI(api_key=api_key)
-        
-        response = client.audio.speech.create(
-            model="tts-1",       # Voit kokeilla myös mallia "tts-1-hd"
-            voice="fable",       # Voit kokeilla muita ääniä: 'echo', 'fable', 'onyx', 'nova', 'shimmer'
-            input=text_to_speak,
-            speed=0.95           # Säädä puheen nopeutta (0.25 - 4.0)
-        )
+        client = get_openai_client()
+
+        # Malli, ääni ('echo', 'fable', 'onyx', 'nova', 'shimmer') ja nopeus
+        # (0.25 - 4.0) mallirekisteristä (materials.ai_models, tehtävä "tts")
+        config = ai_models.get("tts")
+        with telemetry.track("tts", config["model"]) as call:
+            response = client.audio.speech.create(
+                model=config["model"],
+                voice=config.get("voice", "fable"),
+                input=text_to_speak,
+                speed=float(config.get("speed", 0.95)),
+            )
+            call["units"] = len(text_to_speak)
         
         # Palautetaan raaka äänidata
         return response.content
@@ -185,11 +562,32 @@ def generate_speech(text_to_speak: str) -> bytes | None:
 try:
     # Hakee chunkit JSONista
     from TaskuOpe.ops_chunks import retrieve_chunks, format_for_llm
+    from .context_packer import default_budget, pack_context
     _HAS_OPS = True
 except Exception:
     _HAS_OPS = False
 
 
+def _legacy_budget(max_tokens: Optional[int], max_chars: Optional[int]) -> Optional[int]:
+    """
+    Muuntaa vanhentuneen max_chars-merkkirajan token-budjetiksi (max_tokens voittaa).
+
+    Args:
+        max_tokens (Optional[int]): Token-budjetti.
+        max_chars (Optional[int]): Vanha merkkiraja.
+
+    Returns:
+        Optional[int]: Käytettävä token-budjetti tai None (oletusbudjetti).
+    """
+    if max_chars is None:
+        return max_tokens
+    warnings.warn("max_chars on vanhentunut; käytä max_tokens-parametria.", DeprecationWarning, stacklevel=3)
+    if max_tokens is not None:
+        return max_tokens
+    from .context_packer import CHARS_PER_TOKEN
+    return max(1, math.ceil(max_chars / CHARS_PER_TOKEN))
+
+
 def _build_prompt_with_context(question: str, context_block: str) -> str:
     """
     Rakentaa täydellisen promptin tekoälylle, yhdistäen käyttäjän kysymyksen
@@ -222,7 +620,8 @@ def ask_llm_with_ops(
     ctypes: Optional[List[str]] = None,
     k: int = 6,
     user_id: int = 0,
-    max_chars: int = 8000
+    max_tokens: Optional[int] = None,
+    max_chars: Optional[int] = None
 ) -> dict:
     """
     Kysyy Large Language Modelilta (LLM) vastausta, johon on integroitu
@@ -237,16 +636,59 @@ def ask_llm_with_ops(
         ctypes (Optional[List[str]]): Valinnainen lista sisältötyypeistä.
         k (int): Kuinka monta OPS-chunkia haetaan.
         user_id (int): Valinnainen käyttäjän ID API-kutsuille.
-        max_chars (int): Maksimimerkkimäärä promptille,
-                         jonka jälkeen konteksti katkaistaan.
+        max_tokens (Optional[int]): Promptin token-budjetti (oletus
+                         OPS_CONTEXT_TOKENS). Ohjeet ja pyyntö pidetään aina
+                         mukana; chunkit valitaan budjettiin pisteiden mukaan.
+        max_chars (Optional[int]): Vanhentunut merkkiraja; muunnetaan token-budjetiksi.
 
     Returns:
-        dict: Sanakirja, joka sisältää LLM:n vastauksen ('answer')
-              ja käytetyt OPS-chunkit ('used_chunks').
+        dict: Sanakirja, joka sisältää LLM:n vastauksen ('answer'),
+              käytetyt OPS-chunkit ('used_chunks') ja token-määrät ('tokens',
+              tyhjä, jos kontekstia ei käytetty).
     """
+    max_tokens = _legacy_budget(max_tokens, max_chars)
     if not _HAS_OPS:
-        return {"answer": ask_llm(question, user_id=user_id), "used_chunks": []}
+        return {"answer": ask_llm(question, user_id=user_id), "used_chunks": [], "tokens": {}}
+
+    packed = build_ops_prompt(
+        question, ops_query=ops_query, subjects=subjects, grades=grades,
+        ctypes=ctypes, k=k, max_tokens=max_tokens,
+    )
+    return {
+        "answer": ask_llm(packed["prompt"], user_id=user_id),
+        "used_chunks": packed["used_chunks"],
+        "tokens": packed["tokens"],
+    }
+
+def build_ops_prompt(
+    question: str,
+    *,
+    ops_query: str = "",
+    subjects: Optional[List[str]] = None,
+    grades: Optional[List[str]] = None,
+    ctypes: Optional[List[str]] = None,
+    k: int = 6,
+    max_tokens: Optional[int] = None
+) -> dict:
+    """
+    Hakee OPS-chunkit ja rakentaa niistä token-budjettiin mahtuvan promptin
+    (ask_llm_with_ops ja suoratoisto käyttävät samaa promptia).
 
+    Args:
+        question (str): Käyttäjän kysymys tekoälylle.
+        ops_query (str): Valinnainen hakukysely OPS-chunkeille.
+        subjects (Optional[List[str]]): Valinnainen lista oppiaineista.
+        grades (Optional[List[str]]): Valinnainen lista luokka-asteista.
+        ctypes (Optional[List[str]]): Valinnainen lista sisältötyypeistä.
+        k (int): Kuinka monta OPS-chunkia haetaan.
+        max_tokens (Optional[int]): Promptin token-budjetti.
+
+    Returns:
+        dict: pack_context-funktion tulos (prompt, used_chunks, dropped, tokens).
+              Jos OPS-dataa ei ole saatavilla, prompt on kysymys sellaisenaan.
+    """
+    if not _HAS_OPS:
+        return {"prompt": question, "used_chunks": [], "dropped": 0, "tokens": {}}
     chunks = retrieve_chunks(
         query=ops_query or "",
         k=k,
@@ -254,20 +696,17 @@ def ask_llm_with_ops(
         grades=grades or [],
         ctypes=ctypes or [],
     )
-    context = format_for_llm(chunks)
-    prompt = _build_prompt_with_context(question, context)
-
-    if len(prompt) > max_chars:
-        prompt = prompt[:max_chars] + "\n\n[Katkaistu konteksti]"
-
-    return {"answer": ask_llm(prompt, user_id=user_id), "used_chunks": chunks}
+    return pack_context(
+        question, chunks, _build_prompt_with_context, max_tokens=default_budget(max_tokens)
+    )
 
 def ask_llm_with_given_chunks(
     question: str,
     chunks: List[dict],
     *,
     user_id: int = 0,
-    max_chars: int = 8000
+    max_tokens: Optional[int] = None,
+    max_chars: Optional[int] = None
 ) -> dict:
     """
     Kysyy Large Language Modelilta (LLM) vastausta käyttäen ennalta annettuja
@@ -278,22 +717,25 @@ def ask_llm_with_given_chunks(
         question (str): Käyttäjän kysymys tekoälylle.
         chunks (List[dict]): Lista OPS-chunkeista, jotka annetaan kontekstina.
         user_id (int): Valinnainen käyttäjän ID API-kutsuille.
-        max_chars (int): Maksimimerkkimäärä promptille,
-                         jonka jälkeen konteksti katkaistaan.
+        max_tokens (Optional[int]): Promptin token-budjetti (oletus OPS_CONTEXT_TOKENS).
+        max_chars (Optional[int]): Vanhentunut merkkiraja; muunnetaan token-budjetiksi.
 
     Returns:
-        dict: Sanakirja, joka sisältää LLM:n vastauksen ('answer')
-              ja käytetyt OPS-chunkit ('used_chunks').
+        dict: Sanakirja, joka sisältää LLM:n vastauksen ('answer'),
+              käytetyt OPS-chunkit ('used_chunks') ja token-määrät ('tokens',
+              tyhjä, jos kontekstia ei käytetty).
     """
+    max_tokens = _legacy_budget(max_tokens, max_chars)
     if not chunks:
-        return {"answer": ask_llm(question, user_id=user_id), "used_chunks": []}
+        return {"answer": ask_llm(question, user_id=user_id), "used_chunks": [], "tokens": {}}
 
-    context = format_for_llm(chunks)
-    prompt = _build_prompt_with_context(question, context)
-
-    if len(prompt) > max_chars:
-        prompt = prompt[:max_chars] + "\n\n[Katkaistu konteksti]"
-
-    return {"answer": ask_llm(prompt, user_id=user_id), "used_chunks": chunks}
+    packed = pack_context(
+        question, chunks, _build_prompt_with_context, max_tokens=default_budget(max_tokens)
+    )
+    return {
+        "answer": ask_llm(packed["prompt"], user_id=user_id),
+        "used_chunks": packed["used_chunks"],
+        "tokens": packed["tokens"],
+    }
 
 
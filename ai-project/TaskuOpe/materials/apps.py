@@ -13,4 +13,10 @@ class MaterialsConfig(AppConfig):
     name = "materials"
     verbose_name = _("Materiaalit")
 
-    path = os.path.dirname(os.path.abspath(__file__))
\ No newline at end of file
+    path = os.path.dirname(os.path.abspath(__file__))
+
+    def ready(self):
+        """
+        Rekisteröi taustatöiden käsittelijät (materials.job_handlers).
+        """
+        from . import job_handlers  # noqa: F401
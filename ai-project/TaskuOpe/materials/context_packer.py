@@ -0,0 +1,143 @@
+# materials/context_packer.py
+"""OPS-kontekstin pakkaaminen LLM-promptiin token-budjetin mukaan.
+
+Korvaa aiemman merkkipohjaisen katkaisun (prompt[:max_chars]), joka saattoi
+leikata käyttäjän pyynnön promptin lopusta. Pakkaaja:
+
+- pitää aina mukana ohjeet ja käyttäjän pyynnön
+- täyttää jäljelle jäävän budjetin chunkeilla pisteiden mukaisessa järjestyksessä
+- ohittaa lähes identtiset chunkit (sanakolmikoiden Jaccard-samankaltaisuus)
+- raportoi käytetyt tokenit
+
+Tokenit lasketaan tiktokenilla, jos se on asennettu, muuten arviona
+merkkimäärästä.
+"""
+
+import math
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from django.conf import settings
+
+from TaskuOpe.ops_chunks import format_for_llm
+
+# Suomenkielisessä tekstissä sanat ovat pitkiä; noin 3,5 merkkiä / token
+CHARS_PER_TOKEN = 3.5
+# Sanakolmikoiden Jaccard-raja, jonka ylittävät chunkit tulkitaan kaksoiskappaleiksi
+DEDUPE_THRESHOLD = 0.85
+TIKTOKEN_ENCODING = "o200k_base"
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """Palauttaa tiktoken-enkoodauksen tai None, jos tiktoken ei ole saatavilla."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TIKTOKEN_ENCODING)
+    except Exception:
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Arvioi tekstin token-määrän.
+
+    Args:
+        text (str): Teksti, jonka tokenit lasketaan.
+
+    Returns:
+        int: Token-määrä (tiktoken) tai merkkimäärään perustuva arvio.
+    """
+    if not text:
+        return 0
+    enc = _encoding()
+    if enc is not None:
+        return len(enc.encode(text))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _shingles(text: str) -> Set[Tuple[str, ...]]:
+    """Palauttaa tekstin sanakolmikot (välimerkit ja kirjainkoko ohitetaan)."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < 3:
+        return {tuple(words)}
+    return {tuple(words[i:i + 3]) for i in range(len(words) - 2)}
+
+
+def _is_duplicate(shingles: Set[Tuple[str, ...]], accepted: List[Set[Tuple[str, ...]]], threshold: float) -> bool:
+    for other in accepted:
+        union = len(shingles | other)
+        if union and len(shingles & other) / union >= threshold:
+            return True
+    return False
+
+
+def pack_context(
+    question: str,
+    chunks: List[Dict],
+    build_prompt: Callable[[str, str], str],
+    *,
+    max_tokens: int,
+    dedupe_threshold: float = DEDUPE_THRESHOLD,
+) -> Dict:
+    """
+    Valitsee chunkit token-budjettiin ja rakentaa valmiin promptin.
+
+    Args:
+        question (str): Käyttäjän pyyntö; pidetään aina mukana.
+        chunks (List[Dict]): OPS-chunkit (retrieve_chunks-muodossa). Jos
+            chunkeilla on "score", parhaat valitaan ensin; muuten säilytetään
+            annettu järjestys.
+        build_prompt (Callable[[str, str], str]): Funktio (kysymys, konteksti) -> prompt.
+        max_tokens (int): Koko promptin token-budjetti.
+        dedupe_threshold (float): Samankaltaisuusraja kaksoiskappaleille.
+
+    Returns:
+        Dict: Sanakirja, jossa avaimet:
+            - prompt: valmis prompt
+            - used_chunks: promptiin otetut chunkit
+            - dropped: pois jätettyjen chunkkien määrä
+            - tokens: {"prompt", "context", "budget"}
+    """
+    base_tokens = estimate_tokens(build_prompt(question, ""))
+    remaining = max_tokens - base_tokens
+
+    ranked = sorted(
+        enumerate(chunks),
+        key=lambda item: (-(item[1].get("score") or 0.0), item[0]),
+    )
+    used: List[Dict] = []
+    seen: List[Set[Tuple[str, ...]]] = []
+    for _, chunk in ranked:
+        shingles = _shingles(chunk.get("text", ""))
+        if _is_duplicate(shingles, seen, dedupe_threshold):
+            continue
+        # Chunkin hinta formatoituna (numerointi, metarivi ja erotin mukaan lukien)
+        cost = estimate_tokens(format_for_llm([chunk])) + 2
+        if cost > remaining:
+            # Kokeillaan silti pienempiä chunkkeja (ahne täyttö)
+            continue
+        used.append(chunk)
+        seen.append(shingles)
+        remaining -= cost
+
+    context = format_for_llm(used)
+    prompt = build_prompt(question, context)
+    return {
+        "prompt": prompt,
+        "used_chunks": used,
+        "dropped": len(chunks) - len(used),
+        "tokens": {
+            "prompt": estimate_tokens(prompt),
+            "context": estimate_tokens(context),
+            "budget": max_tokens,
+        },
+    }
+
+
+def default_budget(max_tokens: Optional[int] = None) -> int:
+    """Palauttaa promptin token-budjetin (oletus asetuksesta OPS_CONTEXT_TOKENS tai 3000)."""
+    if max_tokens:
+        return int(max_tokens)
+    return int(getattr(settings, "OPS_CONTEXT_TOKENS", 3000))
@@ -0,0 +1,180 @@
+# materials/images.py
+"""Materiaalikuvien responsiiviset versiot (WebP, valinnaisesti AVIF).
+
+Kun kuva tallennetaan (generate_image_view, add_material_image_view),
+taustatyö "image_variants" luo siitä pakatut versiot kokoluokkien
+size-sm/md/lg leveyksillä (VARIANT_WIDTHS). Versiot tallennetaan polkuun
+``variants/<alkuperäinen ilman päätettä>-<leveys>.<formaatti>`` ja kirjataan
+ImageVariant-malliin. Alkuperäinen kuva säilyy ennallaan latausta varten.
+
+render_material_content_to_html (views.shared) hakee versiot kuvan
+osoitteen perusteella ja tuottaa <picture>-elementin srcset- ja
+sizes-attribuutteineen. Olemassa oleville kuville versiot luodaan
+komennolla ``python manage.py build_image_variants``.
+"""
+
+import io
+import os
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+from .models import ImageVariant, Material
+
+# Kokoluokan leveys pikseleinä (size-sm/md/lg)
+VARIANT_WIDTHS = {"sm": 480, "md": 960, "lg": 1440}
+
+# Kuvan näyttöleveys kokoluokittain (vastaa style.css:n .img-scaled-sääntöjä)
+SIZES = {
+    "size-sm": "(max-width: 767px) 100vw, 30vw",
+    "size-md": "(max-width: 767px) 100vw, 60vw",
+    "size-lg": "(max-width: 767px) 100vw, 90vw",
+}
+
+QUALITY = {"webp": 80, "avif": 55}
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".gif")
+
+
+def formats() -> List[str]:
+    """
+    Palauttaa käytössä olevat versioformaatit (IMAGE_VARIANT_FORMATS).
+
+    AVIF ohitetaan, jos Pillow ei tue sitä tässä ympäristössä.
+    """
+    out = []
+    for fmt in getattr(settings, "IMAGE_VARIANT_FORMATS", ["webp"]):
+        fmt = fmt.lower()
+        if fmt not in QUALITY:
+            continue
+        if fmt == "avif" and not features.check("avif"):
+            print("AVIF-versioita ei luoda: Pillow ei tue AVIF-formaattia.")
+            continue
+        out.append(fmt)
+    return out
+
+
+def source_name(url: str) -> Optional[str]:
+    """
+    Muuntaa Markdownin kuvaosoitteen tallennustilan tiedostonimeksi.
+
+    Args:
+        url (str): Kuvan osoite (fragmentti, esim. #size-md, sallittu).
+
+    Returns:
+        Optional[str]: Tiedostonimi tai None, jos kuva ei ole MEDIA_URL:n alla.
+    """
+    url = url.split("#")[0].split("?")[0]
+    media_url = settings.MEDIA_URL
+    if url.startswith(media_url):
+        return url[len(media_url):] or None
+    media_path = urlparse(media_url).path
+    path = urlparse(url).path
+    if media_path and path.startswith(media_path):
+        return path[len(media_path):] or None
+    return None
+
+
+def variant_path(name: str, width: int, fmt: str) -> str:
+    """Palauttaa version tiedostopolun alkuperäisen nimen perusteella."""
+    return f"variants/{os.path.splitext(name)[0]}-{width}.{fmt}"
+
+
+def _encode(image: Image.Image, fmt: str) -> bytes:
+    buf = io.BytesIO()
+    options = {"quality": QUALITY[fmt]}
+    if fmt == "webp":
+        options["method"] = 6  # hitaampi pakkaus, pienempi tiedosto
+    image.save(buf, format=fmt.upper(), **options)
+    return buf.getvalue()
+
+
+def create_variants(name: str, *, force: bool = False) -> List[ImageVariant]:
+    """
+    Luo kuvasta WebP- (ja valinnaisesti AVIF-) versiot kokoluokkien leveyksillä.
+
+    Alkuperäistä leveämpiä versioita ei luoda; alkuperäistä kapeampi kuva saa
+    yhden version omalla leveydellään. Jo olemassa olevat versiot ohitetaan,
+    ellei force ole asetettu.
+
+    Args:
+        name (str): Alkuperäisen kuvan nimi tallennustilassa.
+        force (bool): Luodaanko olemassa olevat versiot uudelleen.
+
+    Returns:
+        List[ImageVariant]: Kuvan kaikki versiot.
+    """
+    from .storage import save_public
+
+    existing = {(v.format, v.width) for v in ImageVariant.objects.filter(source=name)}
+    with default_storage.open(name, "rb") as fh:
+        image = Image.open(fh)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+
+    widths = sorted({w for w in VARIANT_WIDTHS.values() if w < image.width}) or [image.width]
+    created = False
+    for fmt in formats():
+        for width in widths:
+            if (fmt, width) in existing and not force:
+                continue
+            height = max(1, round(image.height * width / image.width))
+            resized = image if width == image.width else image.resize((width, height), Image.Resampling.LANCZOS)
+            data = _encode(resized, fmt)
+            path = variant_path(name, width, fmt)
+            # Sama nimi korvataan (FileSystemStorage nimeäisi muuten uudelleen)
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            saved, _ = save_public(path, ContentFile(data))
+            ImageVariant.objects.update_or_create(
+                source=name, format=fmt, width=width,
+                defaults={"height": height, "name": saved, "size": len(data)},
+            )
+            created = True
+
+    if created:
+        # Esirenderöity HTML ei vielä sisällä uusia versioita
+        Material.objects.filter(content__contains=name).update(rendered_hash="")
+    return list(ImageVariant.objects.filter(source=name).order_by("format", "width"))
+
+
+def variants_for(names: Iterable[str]) -> Dict[str, Dict[str, List[ImageVariant]]]:
+    """
+    Hakee usean kuvan versiot yhdellä kyselyllä.
+
+    Returns:
+        Dict[str, Dict[str, List[ImageVariant]]]: nimi -> formaatti -> versiot
+        leveysjärjestyksessä.
+    """
+    out: Dict[str, Dict[str, List[ImageVariant]]] = {}
+    names = [n for n in set(names) if n]
+    if not names:
+        return out
+    for variant in ImageVariant.objects.filter(source__in=names).order_by("width"):
+        out.setdefault(variant.source, {}).setdefault(variant.format, []).append(variant)
+    return out
+
+
+def srcset(variants: List[ImageVariant]) -> str:
+    """Muodostaa srcset-attribuutin arvon versioista."""
+    return ", ".join(f"{default_storage.url(v.name)} {v.width}w" for v in variants)
+
+
+def schedule_variants(name: str, *, user=None):
+    """
+    Lisää versioiden luonnin taustatyöjonoon (materials.jobs).
+
+    Args:
+        name (str): Tallennetun kuvan nimi.
+        user: Kuvan tallentanut käyttäjä.
+    """
+    from . import jobs
+
+    if not name or not name.lower().endswith(IMAGE_EXTENSIONS):
+        return None
+    return jobs.enqueue("image_variants", {"name": name}, user=user, ref=f"image:{name}"[:100])
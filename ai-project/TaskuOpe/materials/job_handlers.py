@@ -0,0 +1,187 @@
+# materials/job_handlers.py
+"""Taustatöiden käsittelijät (materials.jobs).
+
+Jokainen käsittelijä saa työn syötteen (payload) ja palauttaa JSON-kelpoisen
+tuloksen, jonka selain hakee tilarajapinnasta. Moduuli ladataan
+MaterialsConfig.ready()-metodissa, jolloin työtyypit ovat rekisteröityinä
+sekä web- että worker-prosessissa.
+
+Pelin ja puheen generointi yhdistetään sisällön mukaan (materials.singleflight):
+samanaikaiset identtiset työt tekevät vain yhden OpenAI-kutsun.
+"""
+
+from contextlib import nullcontext
+
+from . import ratelimit, singleflight
+from .jobs import register
+
+
+@register("material_draft", limit="material_draft")
+def material_draft(payload: dict) -> dict:
+    """
+    Luo materiaaliluonnoksen tekoälyllä (create_material_view, action "ai").
+
+    Payload: prompt, user_id sekä valinnaisesti ops_subject ja ops_grade.
+    """
+    from .ai_service import ask_llm, ask_llm_with_ops
+
+    prompt = payload["prompt"]
+    user_id = payload.get("user_id") or 0
+    if payload.get("ops_subject") and payload.get("ops_grade"):
+        result = ask_llm_with_ops(
+            question=prompt, subjects=[payload["ops_subject"]],
+            grades=[payload["ops_grade"]], user_id=user_id
+        )
+        return {"answer": result.get("answer", "[Virhe haettaessa OPS-dataa]")}
+    return {"answer": ask_llm(prompt, user_id=user_id)}
+
+
+@register("game", limit="game")
+def game(payload: dict) -> dict:
+    """
+    Generoi pelisisällön ja metadatan rinnakkain (generate_game_ajax_view)
+    ja tallentaa pelin välimuistiin.
+
+    Payload: topic, game_type, difficulty ja valinnaisesti regenerate.
+    """
+    from .views.api import cached_game, game_key, generate_game, store_game
+
+    topic, game_type = payload["topic"], payload["game_type"]
+    difficulty = payload.get("difficulty") or "medium"
+    if not payload.get("regenerate"):
+        # Toinen työ ehti jo generoida saman pelin
+        cached = cached_game(topic, game_type, difficulty)
+        if cached:
+            return cached
+
+    def generate():
+        result = generate_game(topic, game_type, difficulty)
+        store_game(topic, game_type, difficulty, result)
+        return result
+
+    return singleflight.do(game_key(topic, game_type, difficulty), generate)
+
+
+@register("ai_grade")
+def ai_grade(payload: dict) -> dict:
+    """
+    Luo AI-arvosanaehdotuksen palautukselle (grade_submission_view, run_ai_grade).
+
+    Payload: submission_id ja valinnaisesti fresh (uusi ehdotus ohi välimuistin).
+    """
+    from .ai_rubric import create_or_update_ai_grade
+    from .models import Submission
+
+    ag = create_or_update_ai_grade(Submission.objects.get(pk=payload["submission_id"]),
+                                   fresh=bool(payload.get("fresh")))
+    return {"total_points": ag.total_points}
+
+
+@register("plagiarism")
+def plagiarism(payload: dict) -> dict:
+    """
+    Luo tai päivittää alkuperäisyysraportin (grade_submission_view, run_plagiarism).
+
+    Payload: submission_id.
+    """
+    from .models import Submission
+    from .plagiarism import build_or_update_report
+
+    report = build_or_update_report(Submission.objects.get(pk=payload["submission_id"]))
+    return {"score": report.score, "suspected": bool(report.suspected_source_id)}
+
+
+@register("tts", limit="tts")
+def tts(payload: dict) -> dict:
+    """
+    Muuntaa tehtävänannon tekstin puheeksi segmentteinä ja tallentaa ne
+    sisältöosoitteiseen välimuistiin (assignment_tts_view, materials.tts).
+
+    Payload: assignment_id ja text (kuvat jo poistettu).
+
+    Returns:
+        dict: "segments" (segmenttien osoitteet soittojärjestyksessä) ja
+        "url" (ensimmäinen segmentti).
+
+    Raises:
+        RuntimeError: Jos äänen generointi epäonnistuu.
+    """
+    from . import tts as tts_cache
+
+    keys = tts_cache.synthesize(payload["text"])
+    if not keys:
+        raise RuntimeError("Ei luettavaa tekstiä.")
+    segments = [tts_cache.audio_url(key) for key in keys]
+    return {"url": segments[0], "segments": segments}
+
+
+@register("warmup")
+def warmup(payload: dict) -> dict:
+    """
+    Valmistelee jaetun materiaalin oppilaita varten (assign_material_view):
+    renderöity HTML, kuvien esikatselukuvat ja puheääni. Näin tehtävän
+    avaaminen on pelkkä välimuistiluku.
+
+    Vaiheet ajetaan toisistaan riippumatta; jos jokin epäonnistuu, muut
+    tehdään silti ja työ merkitään lopuksi epäonnistuneeksi (opettaja näkee
+    virheen materiaalin sivulla). TTS-rinnakkaisuuspaikka ('tts') varataan
+    vain puheäänen generoinnin ajaksi; jos paikkoja ei ole, työ palautetaan
+    jonoon (ratelimit.RateLimited) ja valmiit vaiheet ovat seuraavalla
+    kerralla välimuistissa.
+
+    Payload: material_id.
+
+    Returns:
+        dict: html, thumbnails (luotujen määrä) ja tts_segments.
+
+    Raises:
+        RuntimeError: Jos jokin vaihe epäonnistui.
+    """
+    from . import tts as tts_cache
+    from .models import Material
+    from .views.shared import cached_material_html
+
+    material = Material.objects.get(pk=payload["material_id"])
+    result = {"html": False, "thumbnails": 0, "tts_segments": 0}
+    errors = []
+
+    try:
+        cached_material_html(material)
+        result["html"] = True
+    except Exception as e:
+        errors.append(f"HTML: {e}")
+
+    for image in material.images.all():
+        try:
+            image.thumbnail.generate()
+            result["thumbnails"] += 1
+        except Exception as e:
+            errors.append(f"esikatselukuva {image.pk}: {e}")
+
+    # Pelit avataan pelinäkymässä, jossa ei ole kuuntelua
+    text = tts_cache.clean_text(material.content)
+    if material.material_type != Material.MaterialType.GAME and text.strip():
+        try:
+            with ratelimit.slots("tts", scope="job") if ratelimit.enabled() else nullcontext():
+                result["tts_segments"] = len(tts_cache.synthesize(text))
+        except ratelimit.RateLimited:
+            raise
+        except Exception as e:
+            errors.append(f"puheääni: {e}")
+
+    if errors:
+        raise RuntimeError("Valmistelu epäonnistui osittain: " + "; ".join(errors))
+    return result
+
+
+@register("image_variants")
+def image_variants(payload: dict) -> dict:
+    """
+    Luo tallennetusta kuvasta WebP/AVIF-versiot (materials.images).
+
+    Payload: name (kuvan nimi tallennustilassa).
+    """
+    from .images import create_variants
+
+    variants = create_variants(payload["name"])
+    return {"variants": [{"format": v.format, "width": v.width, "size": v.size} for v in variants]}
@@ -0,0 +1,323 @@
+# materials/jobs.py
+"""Tietokantapohjainen taustatyöjono pitkille tekoälykutsuille.
+
+Näkymä lisää työn jonoon (enqueue) ja palauttaa heti työn tunnisteen.
+Erillinen worker-prosessi (``python manage.py run_jobs``) suorittaa työt,
+ja selain kysyy tilaa status-rajapinnasta. Viestinvälittäjää ei tarvita:
+
+- työ varataan ehdollisella päivityksellä (status QUEUED -> RUNNING), joten
+  useat workerit ja säikeet eivät koskaan aja samaa työtä
+- jumiin jääneet työt (worker kaatui) palautetaan jonoon, kunnes
+  JOBS_MAX_ATTEMPTS täyttyy
+- asetuksella JOBS_EAGER = True työ ajetaan heti enqueue-kutsussa
+  (testit ja kehitys ilman workeria)
+
+Työtyypit rekisteröidään register-dekoraattorilla (materials.job_handlers).
+Käsittelijä saa syötteen (payload) ja palauttaa JSON-kelpoisen tuloksen.
+Tekoälytöiden yhteinen rinnakkaisuus rajataan materials.ratelimit-rajoilla:
+jos paikkoja ei ole tai OpenAI on pyytänyt taukoa, työ palautetaan jonoon
+odotusajan päähän (run_after).
+"""
+
+import os
+import socket
+import threading
+import traceback
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+from typing import Callable, Dict, Iterator, Optional
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.urls import reverse
+from django.utils import timezone
+
+from . import ratelimit, telemetry
+from .models import BackgroundJob
+
+_HANDLERS: Dict[str, Callable[[dict], dict]] = {}
+_LIMITS: Dict[str, str] = {}
+
+
+def register(kind: str, *, limit: Optional[str] = None):
+    """
+    Dekoraattori, joka rekisteröi funktion työtyypin käsittelijäksi.
+
+    Args:
+        kind (str): Työtyypin nimi (BackgroundJob.kind).
+        limit (Optional[str]): AI_RATE_LIMITS-rajapinta, jonka yhteinen
+            rinnakkaisuusraja koskee myös tätä työtyyppiä.
+    """
+    def decorator(func: Callable[[dict], dict]):
+        _HANDLERS[kind] = func
+        if limit:
+            _LIMITS[kind] = limit
+        return func
+    return decorator
+
+
+def worker_name() -> str:
+    """Palauttaa tämän prosessin tunnisteen (isäntä:pid)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue(kind: str, payload: Optional[dict] = None, *, user=None, ref: str = "") -> BackgroundJob:
+    """
+    Lisää työn jonoon.
+
+    Jos samalle kohteelle (ref) on jo keskeneräinen saman tyypin työ,
+    palautetaan se uuden sijaan.
+
+    Args:
+        kind (str): Rekisteröity työtyyppi.
+        payload (Optional[dict]): JSON-kelpoinen syöte käsittelijälle.
+        user: Työn luonut käyttäjä (oikeustarkistuksia varten).
+        ref (str): Valinnainen kohdetunniste, esim. "submission:<id>".
+
+    Returns:
+        BackgroundJob: Jonoon lisätty (tai jo olemassa oleva) työ.
+
+    Raises:
+        ValueError: Jos työtyyppiä ei ole rekisteröity.
+    """
+    if kind not in _HANDLERS:
+        raise ValueError(f"Tuntematon työtyyppi: {kind}")
+    if ref:
+        active = (
+            BackgroundJob.objects
+            .filter(kind=kind, ref=ref, status__in=[BackgroundJob.Status.QUEUED, BackgroundJob.Status.RUNNING])
+            .first()
+        )
+        if active:
+            return active
+    job = BackgroundJob.objects.create(kind=kind, ref=ref, payload=payload or {}, created_by=user)
+    if getattr(settings, "JOBS_EAGER", False):
+        if _claim(job.pk, "eager"):
+            job.refresh_from_db()
+            run_job(job)
+    return job
+
+
+def record_result(kind: str, payload: Optional[dict], result: dict, *, user=None, ref: str = "",
+                  started_at=None) -> BackgroundJob:
+    """
+    Tallentaa pyynnössä jo suoritetun työn valmiina työnä (esim. suoratoistettu
+    LLM-vastaus), jolloin tulos on haettavissa samasta tilarajapinnasta.
+
+    Args:
+        kind (str): Työtyyppi.
+        payload (Optional[dict]): Työn syöte.
+        result (dict): JSON-kelpoinen tulos.
+        user: Työn luonut käyttäjä.
+        ref (str): Valinnainen kohdetunniste.
+        started_at: Suorituksen alkuhetki (oletus nyt).
+
+    Returns:
+        BackgroundJob: DONE-tilainen työ.
+    """
+    now = timezone.now()
+    return BackgroundJob.objects.create(
+        kind=kind, ref=ref, payload=payload or {}, result=result, created_by=user,
+        status=BackgroundJob.Status.DONE, attempts=1, worker="request",
+        started_at=started_at or now, finished_at=now,
+    )
+
+
+def _claim(job_id, worker: str) -> bool:
+    """Varaa työn ehdollisella päivityksellä; palauttaa True, jos varaus onnistui."""
+    now = timezone.now()
+    return bool(
+        BackgroundJob.objects
+        .filter(pk=job_id, status=BackgroundJob.Status.QUEUED)
+        .update(status=BackgroundJob.Status.RUNNING, worker=worker, started_at=now, heartbeat_at=now,
+                attempts=F("attempts") + 1)
+    )
+
+
+def claim_next(worker: str) -> Optional[BackgroundJob]:
+    """
+    Varaa vanhimman suoritusvalmiin (run_after ohitettu) jonossa olevan työn.
+
+    Args:
+        worker (str): Varaajan tunniste.
+
+    Returns:
+        Optional[BackgroundJob]: Varattu työ tai None, jos jono on tyhjä.
+    """
+    # Muutama yritys, jos toinen worker ehtii varata saman rivin ensin
+    for _ in range(5):
+        job_id = (
+            BackgroundJob.objects
+            .filter(status=BackgroundJob.Status.QUEUED, run_after__lte=timezone.now())
+            .order_by("run_after", "created_at")
+            .values_list("pk", flat=True)
+            .first()
+        )
+        if job_id is None:
+            return None
+        if _claim(job_id, worker):
+            return BackgroundJob.objects.select_related("created_by").get(pk=job_id)
+    return None
+
+
+def _mine(job: BackgroundJob):
+    """Rajaa kyselyn työhön vain, jos se on yhä tämän varauksen käynnissä (ei palautettu jonoon)."""
+    return BackgroundJob.objects.filter(
+        pk=job.pk, status=BackgroundJob.Status.RUNNING, worker=job.worker, started_at=job.started_at
+    )
+
+
+@contextmanager
+def _heartbeat(job: BackgroundJob) -> Iterator[None]:
+    """
+    Päivittää työn heartbeat_at-kenttää taustasäikeessä käsittelijän ajon ajan
+    (JOBS_HEARTBEAT_SECONDS), jotta requeue_stale palauttaa jonoon vain
+    pysähtyneiden workerien työt eikä hitaita käynnissä olevia.
+    """
+    interval = float(getattr(settings, "JOBS_HEARTBEAT_SECONDS", 60))
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                _mine(job).update(heartbeat_at=timezone.now())
+        except Exception as e:
+            print(f"Taustatyön {job.pk} elonmerkin päivitys epäonnistui: {e}")
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _defer(job: BackgroundJob, retry_after: float) -> None:
+    """
+    Palauttaa varatun työn jonoon kuluttamatta yritystä.
+
+    Työ siirretään jonossa retry_after sekunnin päähän (run_after), jotta
+    muut workerit eivät varaa samaa rajoitettua työtä heti uudelleen.
+    """
+    run_after = timezone.now() + timedelta(seconds=retry_after)
+    _mine(job).update(
+        status=BackgroundJob.Status.QUEUED, worker="", started_at=None, heartbeat_at=None,
+        attempts=F("attempts") - 1, run_after=run_after,
+    )
+    job.status = BackgroundJob.Status.QUEUED
+    job.run_after = run_after
+
+
+def run_job(job: BackgroundJob, *, throttle: bool = False) -> BackgroundJob:
+    """
+    Suorittaa varatun työn ja tallentaa tuloksen tai virheen.
+
+    Args:
+        job (BackgroundJob): RUNNING-tilassa oleva työ.
+        throttle (bool): Noudatetaanko työtyypin yhteistä ja työn luojan
+            rinnakkaisuusrajaa sekä OpenAI-taukoa. Jos raja on täynnä (tai
+            käsittelijä nostaa ratelimit.RateLimited), työ palautetaan jonoon
+            (status QUEUED) ja job.retry_after kertoo odotusajan.
+
+    Returns:
+        BackgroundJob: Päivitetty työ.
+    """
+    handler = _HANDLERS.get(job.kind)
+    with ExitStack() as stack:
+        endpoint = _LIMITS.get(job.kind)
+        if throttle and endpoint and ratelimit.enabled():
+            try:
+                cooldown = ratelimit.upstream_cooldown()
+                if cooldown > 0:
+                    raise ratelimit.RateLimited(cooldown, "openai")
+                stack.enter_context(ratelimit.slots(endpoint, job.created_by, scope="job"))
+            except ratelimit.RateLimited as exc:
+                _defer(job, exc.retry_after)
+                job.retry_after = exc.retry_after
+                return job
+        try:
+            if handler is None:
+                raise ValueError(f"Tuntematon työtyyppi: {job.kind}")
+            # Työn tekoälykutsut kirjataan työn tyypillä ja luojalla
+            with telemetry.context(feature=job.kind, user_id=job.created_by_id), _heartbeat(job):
+                job.result = handler(job.payload)
+            job.status = BackgroundJob.Status.DONE
+            job.error = ""
+        except ratelimit.RateLimited as exc:
+            if throttle:
+                # Käsittelijä varasi itse rajoitetun vaiheen paikan, eikä sitä ollut
+                _defer(job, exc.retry_after)
+                job.retry_after = exc.retry_after
+                return job
+            job.status = BackgroundJob.Status.FAILED
+            job.error = str(exc)
+        except Exception as e:
+            print(f"Taustatyö {job.pk} ({job.kind}) epäonnistui: {e}\n{traceback.format_exc()}")
+            job.status = BackgroundJob.Status.FAILED
+            job.error = str(e) or e.__class__.__name__
+    job.finished_at = timezone.now()
+    # Ehdollinen tallennus: jos työ ehdittiin palauttaa jonoon ja toinen worker
+    # ajaa sitä, tämän ajon tulos ei korvaa sen tulosta
+    saved = _mine(job).update(status=job.status, result=job.result, error=job.error,
+                              finished_at=job.finished_at)
+    if not saved:
+        print(f"Taustatyö {job.pk} ({job.kind}) ei ole enää tämän workerin; tulosta ei tallenneta.")
+        job.refresh_from_db()
+    telemetry.flush_due()
+    return job
+
+
+def requeue_stale() -> int:
+    """
+    Palauttaa jonoon työt, joiden worker ei ole antanut elonmerkkiä
+    (heartbeat_at) JOBS_STALE_SECONDS sekuntiin, tai merkitsee ne epäonnistuneiksi, jos
+    yrityksiä on jo JOBS_MAX_ATTEMPTS.
+
+    Returns:
+        int: Käsiteltyjen töiden määrä.
+    """
+    limit = timezone.now() - timedelta(seconds=int(getattr(settings, "JOBS_STALE_SECONDS", 600)))
+    max_attempts = int(getattr(settings, "JOBS_MAX_ATTEMPTS", 3))
+    stale = BackgroundJob.objects.filter(
+        Q(heartbeat_at__lt=limit) | Q(heartbeat_at__isnull=True, started_at__lt=limit),
+        status=BackgroundJob.Status.RUNNING,
+    )
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status=BackgroundJob.Status.FAILED, error="Työ keskeytyi (worker pysähtyi).", finished_at=timezone.now()
+    )
+    requeued = stale.update(status=BackgroundJob.Status.QUEUED, worker="", started_at=None, heartbeat_at=None)
+    return failed + requeued
+
+
+def status_url(job: BackgroundJob) -> str:
+    """Palauttaa työn tilarajapinnan URL-osoitteen."""
+    return reverse("job_status", args=[job.pk])
+
+
+def to_dict(job: BackgroundJob, *, with_result: bool = True) -> dict:
+    """
+    Muuntaa työn JSON-vastaukseksi.
+
+    Args:
+        job (BackgroundJob): Työ.
+        with_result (bool): Sisällytetäänkö tulos (vain valmiille työlle).
+
+    Returns:
+        dict: id, kind, status, finished, error, status_url ja tarvittaessa result.
+    """
+    out = {
+        "id": str(job.pk),
+        "kind": job.kind,
+        "status": job.status,
+        "finished": job.is_finished,
+        "error": job.error or None,
+        "status_url": status_url(job),
+        "result_url": reverse("job_result", args=[job.pk]),
+    }
+    if with_result and job.status == BackgroundJob.Status.DONE:
+        out["result"] = job.result
+    return out
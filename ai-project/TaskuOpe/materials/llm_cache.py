@@ -0,0 +1,189 @@
+# materials/llm_cache.py
+"""Pysyvä välimuisti LLM-vastauksille.
+
+Opettajat generoivat samoja pyyntöjä uudelleen, ja AI-arviointi lähettää
+saman promptin, jos painiketta painetaan kahdesti. Välimuisti tallentaa
+vastaukset tietokantaan (LLMCacheEntry):
+
+- avain on SHA-256-tiiviste mallista, viesteistä, lämpötilasta ja muista
+  vastaukseen vaikuttavista parametreista
+- rivit vanhenevat (LLM_CACHE_TTL sekunteina, oletus 7 vrk)
+- karsinta poistaa vanhentuneet ja sen jälkeen vähiten viimeksi käytetyt
+  rivit, kunnes rivimäärä (LLM_CACHE_MAX_ENTRIES) ja yhteiskoko
+  (LLM_CACHE_MAX_BYTES) mahtuvat rajoihin
+- osumat, hudit ja ohitukset lasketaan prosessikohtaisesti (cache_stats)
+
+Välimuistin käytöstä päättää kutsuja (ai_service.chat_completion).
+Tietokantavirheet eivät koskaan kaada LLM-kutsua.
+"""
+
+import hashlib
+import json
+import threading
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+# Karsitaan joka N:nnen tallennuksen yhteydessä
+PRUNE_EVERY = 50
+
+_STATS_LOCK = threading.Lock()
+_STATS = {"hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "evictions": 0}
+
+
+def _model():
+    from .models import LLMCacheEntry
+    return LLMCacheEntry
+
+
+def _count(name: str, n: int = 1) -> None:
+    with _STATS_LOCK:
+        _STATS[name] += n
+
+
+def enabled() -> bool:
+    """Palauttaa True, jos välimuisti on käytössä (asetus LLM_CACHE_ENABLED)."""
+    return bool(getattr(settings, "LLM_CACHE_ENABLED", True))
+
+
+def make_key(model: str, messages: List[Dict], temperature: Optional[float], **params) -> str:
+    """
+    Laskee välimuistiavaimen kutsun parametreista.
+
+    Args:
+        model (str): Mallin nimi.
+        messages (List[Dict]): Chat-viestit.
+        temperature (Optional[float]): Lämpötila.
+        **params: Muut vastaukseen vaikuttavat parametrit (esim. response_format).
+
+    Returns:
+        str: 64-merkkinen heksadesimaalitiiviste.
+    """
+    payload = {"model": model, "messages": messages, "temperature": temperature, "params": params}
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def record_bypass() -> None:
+    """Kirjaa kutsun, joka ohitti välimuistin (laskuri ``bypassed``)."""
+    _count("bypassed")
+
+
+def get(key: str) -> Optional[str]:
+    """
+    Hakee vastauksen välimuistista.
+
+    Args:
+        key (str): make_key-funktion palauttama avain.
+
+    Returns:
+        Optional[str]: Tallennettu vastaus tai None (ei löydy tai vanhentunut).
+    """
+    Entry = _model()
+    now = timezone.now()
+    try:
+        entry = Entry.objects.filter(key=key).only("pk", "response", "expires_at").first()
+        if entry is None or (entry.expires_at and entry.expires_at <= now):
+            _count("misses")
+            return None
+        Entry.objects.filter(pk=entry.pk).update(hits=F("hits") + 1, last_used_at=now)
+    except Exception as e:
+        print(f"LLM-välimuistin luku epäonnistui: {e}")
+        _count("misses")
+        return None
+    _count("hits")
+    return entry.response
+
+
+def put(key: str, model: str, response: str) -> None:
+    """
+    Tallentaa vastauksen välimuistiin ja karsii välimuistia ajoittain.
+
+    Args:
+        key (str): make_key-funktion palauttama avain.
+        model (str): Mallin nimi (näytetään ylläpidossa).
+        response (str): Tallennettava vastaus.
+    """
+    Entry = _model()
+    ttl = int(getattr(settings, "LLM_CACHE_TTL", 7 * 24 * 3600))
+    now = timezone.now()
+    try:
+        Entry.objects.update_or_create(
+            key=key,
+            defaults={
+                "model": model,
+                "response": response,
+                "size": len(response.encode("utf-8")),
+                "last_used_at": now,
+                "expires_at": now + timedelta(seconds=ttl) if ttl > 0 else None,
+            },
+        )
+    except Exception as e:
+        print(f"LLM-välimuistin kirjoitus epäonnistui: {e}")
+        return
+    with _STATS_LOCK:
+        _STATS["stores"] += 1
+        due = _STATS["stores"] % PRUNE_EVERY == 0
+    if due:
+        prune()
+
+
+def prune() -> int:
+    """
+    Poistaa vanhentuneet rivit ja karsii vähiten käytetyt rivit rajoihin.
+
+    Returns:
+        int: Poistettujen rivien määrä.
+    """
+    Entry = _model()
+    max_entries = int(getattr(settings, "LLM_CACHE_MAX_ENTRIES", 5000))
+    max_bytes = int(getattr(settings, "LLM_CACHE_MAX_BYTES", 50 * 1024 * 1024))
+    removed, _ = Entry.objects.filter(expires_at__lte=timezone.now()).delete()
+
+    # Vanhimmasta käytöstä alkaen, kunnes sekä määrä että koko mahtuvat rajoihin
+    count = Entry.objects.count()
+    total = Entry.objects.aggregate(total=Sum("size"))["total"] or 0
+    doomed = []
+    if count > max_entries or total > max_bytes:
+        for pk, size in Entry.objects.order_by("last_used_at", "pk").values_list("pk", "size").iterator():
+            if count <= max_entries and total <= max_bytes:
+                break
+            doomed.append(pk)
+            count -= 1
+            total -= size
+    for i in range(0, len(doomed), 500):
+        removed += Entry.objects.filter(pk__in=doomed[i:i + 500]).delete()[0]
+    if removed:
+        _count("evictions", removed)
+    return removed
+
+
+def clear() -> None:
+    """Tyhjentää välimuistin ja nollaa laskurit."""
+    _model().objects.all().delete()
+    with _STATS_LOCK:
+        for name in _STATS:
+            _STATS[name] = 0
+
+
+def cache_stats() -> Dict:
+    """
+    Palauttaa välimuistin laskurit (tämä prosessi) ja koon (tietokanta).
+
+    Returns:
+        Dict: hits, misses, bypassed, stores, evictions, hit_rate, entries, bytes.
+    """
+    with _STATS_LOCK:
+        stats = dict(_STATS)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+    try:
+        agg = _model().objects.aggregate(total=Sum("size"))
+        stats["entries"] = _model().objects.count()
+        stats["bytes"] = agg["total"] or 0
+    except Exception:
+        stats["entries"] = stats["bytes"] = None
+    return stats
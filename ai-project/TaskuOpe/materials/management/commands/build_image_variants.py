@@ -0,0 +1,52 @@
+# materials/management/commands/build_image_variants.py
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from materials import images
+from materials.models import ImageVariant
+
+
+class Command(BaseCommand):
+    """Luo WebP/AVIF-versiot jo tallennetuille materiaalikuville.
+
+    Uusille kuville versiot luodaan tallennuksen yhteydessä (taustatyö
+    "image_variants"); tämä komento käsittelee vanhat kuvat kerralla.
+    """
+
+    help = "Luo pakatut kuvaversiot (materials.images) olemassa oleville kuville."
+
+    def add_arguments(self, parser):
+        parser.add_argument("dirs", nargs="*", default=["ai_images", "uploaded_images", "materials"],
+                            help="Käsiteltävät hakemistot tallennustilassa")
+        parser.add_argument("--force", action="store_true", help="Luo myös olemassa olevat versiot uudelleen")
+
+    def _walk(self, path):
+        try:
+            dirs, files = default_storage.listdir(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        for name in files:
+            yield f"{path}/{name}"
+        for sub in dirs:
+            yield from self._walk(f"{path}/{sub}")
+
+    def handle(self, *args, **options):
+        done = skipped = failed = 0
+        before = sum(ImageVariant.objects.values_list("size", flat=True))
+        for path in options["dirs"]:
+            for name in self._walk(path.strip("/")):
+                if not name.lower().endswith(images.IMAGE_EXTENSIONS):
+                    continue
+                if not options["force"] and ImageVariant.objects.filter(source=name).exists():
+                    skipped += 1
+                    continue
+                try:
+                    images.create_variants(name, force=options["force"])
+                    done += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"{name}: {e}")
+        added = sum(ImageVariant.objects.values_list("size", flat=True)) - before
+        self.stdout.write(self.style.SUCCESS(
+            f"Kuvaversiot luotu {done} kuvalle ({added / 1e6:.1f} Mt), ohitettu {skipped}, epäonnistui {failed}"
+        ))
@@ -0,0 +1,24 @@
+# materials/management/commands/build_ops_index.py
+from django.core.management.base import BaseCommand
+
+from TaskuOpe import ops_chunks
+
+
+class Command(BaseCommand):
+    """Kääntää OPS-JSONin muistikartoitettavaksi binääri-indeksiksi.
+
+    Ajetaan buildin yhteydessä (ks. spec.yaml), jolloin gunicorn-workerit
+    jakavat saman indeksin käyttöjärjestelmän sivuvälimuistin kautta.
+    """
+
+    help = "Rakentaa OPS-hakuindeksin (ops_data/ops_index) JSON-datasta."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--out", help="Kohdehakemisto (oletus OPS_INDEX_DIR tai ops_data/ops_index)")
+        parser.add_argument("--source", help="Lähde-JSON (oletus ops_data/opetussuunnitelma_1-6_API_data.json)")
+
+    def handle(self, *args, **options):
+        meta = ops_chunks.write_index(out_dir=options.get("out"), source_path=options.get("source"))
+        self.stdout.write(self.style.SUCCESS(
+            f"OPS-indeksi rakennettu: {meta['n_docs']} riviä, {len(meta['terms'])} termiä, versio {meta['version']}"
+        ))
@@ -0,0 +1,55 @@
+# materials/management/commands/load_ops_chunks.py
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from materials.models import OpsChunk
+from TaskuOpe import ops_chunks
+
+
+class Command(BaseCommand):
+    """Lataa OPS-JSONin OpsChunk-tauluun tietokantapohjaista hakua varten.
+
+    Saman lähteen (--source) vanhat rivit korvataan yhdessä transaktiossa,
+    joten muiden opetussuunnitelmien ja koulukohtaisten lisäysten rivit säilyvät.
+    Rivien tunnisteet (ops-N) vastaavat muistiin ladattavan indeksin tunnisteita.
+    """
+
+    help = "Lataa OPS-datan JSON-tiedostosta OpsChunk-tauluun."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--file", help="Lähde-JSON (oletus ops_data/opetussuunnitelma_1-6_API_data.json)")
+        parser.add_argument("--source", help="Lähteen nimi; oletuksena rivien oma source-kenttä tai POPS_2014")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        path = options.get("file") or ops_chunks._json_path()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"OPS-datan luku epäonnistui ({path}): {e}")
+
+        objs = []
+        for i, r in enumerate(raw):
+            txt = (r.get("content") or "").strip()
+            if not txt:
+                continue
+            objs.append(OpsChunk(
+                source=options.get("source") or (r.get("source") or "POPS_2014").strip(),
+                external_id=f"ops-{i}",
+                subject=(r.get("subject") or "").strip(),
+                grade_context=(r.get("grade_context") or "").strip(),
+                content_type=(r.get("content_type") or "").strip(),
+                content=txt,
+            ))
+
+        sources = {o.source for o in objs}
+        with transaction.atomic():
+            deleted, _ = OpsChunk.objects.filter(source__in=sources).delete()
+            OpsChunk.objects.bulk_create(objs, batch_size=options["batch_size"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Ladattiin {len(objs)} OPS-riviä ({', '.join(sorted(sources)) or '-'}), poistettiin {deleted} vanhaa."
+        ))
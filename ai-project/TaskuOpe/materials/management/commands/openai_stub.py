@@ -0,0 +1,50 @@
+# materials/management/commands/openai_stub.py
+from django.core.management.base import BaseCommand, CommandError
+
+from materials.openai_stub import StubConfig, make_server
+
+
+class Command(BaseCommand):
+    """Käynnistää OpenAI-yhteensopivan korvikepalvelimen (materials.openai_stub).
+
+    Sovellus ohjataan palvelimelle asetuksella OPENAI_STUB=True (oletusosoite
+    http://127.0.0.1:8765/v1, muutettavissa OPENAI_STUB_URL-asetuksella).
+    Viivejakaumat: 0, fixed:S, uniform:A,B, normal:KA,SD, lognormal:MEDIAANI,SIGMA.
+    """
+
+    help = "Käynnistää paikallisen OpenAI-korvikepalvelimen kuormitustestausta varten."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency", default="lognormal:0.8,0.5",
+                            help="Vastauksen viivejakauma sekunteina (oletus lognormal:0.8,0.5)")
+        parser.add_argument("--token-latency", default="fixed:0.02",
+                            help="Viive suoratoiston palojen välillä (oletus fixed:0.02)")
+        parser.add_argument("--error-rate", type=float, default=0.0,
+                            help="Virhevastausten osuus 0.0–1.0")
+        parser.add_argument("--error-codes", default="429,500",
+                            help="Pilkuin eroteltu lista virhekoodeista (oletus 429,500)")
+        parser.add_argument("--seed", type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            config = StubConfig(
+                latency=options["latency"],
+                token_latency=options["token_latency"],
+                error_rate=options["error_rate"],
+                error_codes=[int(c) for c in options["error_codes"].split(",") if c.strip()],
+                seed=options["seed"],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        server = make_server(options["host"], options["port"], config)
+        host, port = server.server_address[:2]
+        self.stdout.write(self.style.SUCCESS(f"OpenAI-korvike kuuntelee: http://{host}:{port}/v1"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Pyynnöt: {config.stats}")
@@ -0,0 +1,95 @@
+# materials/management/commands/run_jobs.py
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from materials import jobs
+
+
+class Command(BaseCommand):
+    """Suorittaa taustatöitä (BackgroundJob) tietokantajonosta.
+
+    Jokainen säie varaa vanhimman jonossa olevan työn, suorittaa sen ja
+    hakee seuraavan. Tyhjällä jonolla säie odottaa --poll-interval sekuntia.
+    Useita worker-prosesseja voi ajaa rinnakkain; varaus on atominen.
+    SIGTERM/SIGINT lopettaa uusien töiden varaamisen ja odottaa käynnissä
+    olevat loppuun. Tekoälytöiden yhteinen rinnakkaisuusraja
+    (materials.ratelimit) koskee kaikkia workereita yhdessä.
+    """
+
+    help = "Suorittaa jonossa olevat taustatyöt (tekoälykutsut)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=None,
+                            help="Rinnakkaisten säikeiden määrä (oletus JOBS_CONCURRENCY tai 4)")
+        parser.add_argument("--poll-interval", type=float, default=None,
+                            help="Odotus sekunteina tyhjällä jonolla (oletus JOBS_POLL_INTERVAL tai 1.0)")
+        parser.add_argument("--once", action="store_true",
+                            help="Tyhjennä jono ja lopeta (esim. cron tai testit)")
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options["concurrency"] or int(getattr(settings, "JOBS_CONCURRENCY", 4)))
+        poll = options["poll_interval"] or float(getattr(settings, "JOBS_POLL_INTERVAL", 1.0))
+        once = options["once"]
+        stop = threading.Event()
+        counts = {"done": 0, "failed": 0}
+        lock = threading.Lock()
+        worker = jobs.worker_name()
+
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(sig, lambda *_: stop.set())
+
+        requeued = jobs.requeue_stale()
+        if requeued:
+            self.stdout.write(f"Palautettiin {requeued} keskeytynyttä työtä.")
+
+        def loop(n):
+            name = f"{worker}/{n}"
+            checked = time.monotonic()
+            try:
+                while not stop.is_set():
+                    close_old_connections()
+                    if n == 0 and time.monotonic() - checked > 60:
+                        # Kaatuneiden workerien työt takaisin jonoon
+                        jobs.requeue_stale()
+                        checked = time.monotonic()
+                    job = jobs.claim_next(name)
+                    if job is None:
+                        if once:
+                            return
+                        stop.wait(poll)
+                        continue
+                    job = jobs.run_job(job, throttle=True)
+                    if job.status == job.Status.QUEUED:
+                        # Rinnakkaisuusraja täynnä tai OpenAI pyysi taukoa
+                        stop.wait(min(job.retry_after, 30))
+                        continue
+                    with lock:
+                        counts["done" if job.status == job.Status.DONE else "failed"] += 1
+                    self.stdout.write(f"[{name}] {job.kind} {job.pk}: {job.status}")
+            finally:
+                connection.close()
+
+        self.stdout.write(f"Worker {worker} käynnissä ({concurrency} säiettä).")
+        if concurrency == 1 and once:
+            # Ajetaan pääsäikeessä (sama tietokantayhteys, esim. testit)
+            while (job := jobs.claim_next(worker)) is not None:
+                job = jobs.run_job(job, throttle=True)
+                if job.status == job.Status.QUEUED:
+                    time.sleep(min(job.retry_after, 30))
+                    continue
+                counts["done" if job.status == job.Status.DONE else "failed"] += 1
+        else:
+            threads = [threading.Thread(target=loop, args=(n,), daemon=True) for n in range(concurrency)]
+            for t in threads:
+                t.start()
+            while any(t.is_alive() for t in threads):
+                time.sleep(0.2)
+        self.stdout.write(self.style.SUCCESS(
+            f"Valmis: {counts['done']} onnistui, {counts['failed']} epäonnistui."
+        ))
@@ -0,0 +1,25 @@
+# materials/management/commands/sweep_tts_audio.py
+from django.core.management.base import BaseCommand
+
+from materials import tts
+
+
+class Command(BaseCommand):
+    """Poistaa puheäänisegmentit, joita mikään materiaali ei enää käytä.
+
+    Segmentit ovat sisältöosoitteisia ja jaettuja materiaalien, kopioiden ja
+    versioiden kesken, joten niitä ei poisteta materiaalin tallennuksen
+    yhteydessä. Komento ajetaan ajastetusti (esim. kerran vuorokaudessa).
+    """
+
+    help = "Poistaa käyttämättömät TTS-äänitiedostot (materials.tts)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--min-age", type=float, default=None,
+                            help="Tuoreempia tiedostoja (sekunteina) ei poisteta (oletus TTS_SWEEP_MIN_AGE)")
+        parser.add_argument("--dry-run", action="store_true", help="Näytä vain poistettavien määrä")
+
+    def handle(self, *args, **options):
+        count = tts.sweep_unused_audio(min_age=options["min_age"], dry_run=options["dry_run"])
+        verb = "Poistettavia" if options["dry_run"] else "Poistettu"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {count} käyttämätöntä äänitiedostoa"))
@@ -0,0 +1,93 @@
+# Generated by Django 5.2.6 on 2026-10-17 06:05
+
+from django.db import migrations, models
+
+# Kokotekstihaun rakenteet riippuvat tietokannasta (ks. TaskuOpe/ops_db.py)
+PG_FORWARD = [
+    """
+    ALTER TABLE materials_opschunk ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('finnish', coalesce(subject, '')), 'B') ||
+        setweight(to_tsvector('finnish', coalesce(content, '')), 'A')
+    ) STORED
+    """,
+    "CREATE INDEX materials_opschunk_search_gin ON materials_opschunk USING GIN (search_vector)",
+]
+PG_BACKWARD = [
+    "DROP INDEX IF EXISTS materials_opschunk_search_gin",
+    "ALTER TABLE materials_opschunk DROP COLUMN IF EXISTS search_vector",
+]
+
+# FTS5 external content -taulu, jota triggerit pitävät ajan tasalla
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE materials_opschunk_fts USING fts5(
+        content, subject,
+        content='materials_opschunk', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 0'
+    )
+    """,
+    """
+    CREATE TRIGGER materials_opschunk_fts_ai AFTER INSERT ON materials_opschunk BEGIN
+        INSERT INTO materials_opschunk_fts(rowid, content, subject) VALUES (new.id, new.content, new.subject);
+    END
+    """,
+    """
+    CREATE TRIGGER materials_opschunk_fts_ad AFTER DELETE ON materials_opschunk BEGIN
+        INSERT INTO materials_opschunk_fts(materials_opschunk_fts, rowid, content, subject)
+        VALUES ('delete', old.id, old.content, old.subject);
+    END
+    """,
+    """
+    CREATE TRIGGER materials_opschunk_fts_au AFTER UPDATE ON materials_opschunk BEGIN
+        INSERT INTO materials_opschunk_fts(materials_opschunk_fts, rowid, content, subject)
+        VALUES ('delete', old.id, old.content, old.subject);
+        INSERT INTO materials_opschunk_fts(rowid, content, subject) VALUES (new.id, new.content, new.subject);
+    END
+    """,
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS materials_opschunk_fts_au",
+    "DROP TRIGGER IF EXISTS materials_opschunk_fts_ad",
+    "DROP TRIGGER IF EXISTS materials_opschunk_fts_ai",
+    "DROP TABLE IF EXISTS materials_opschunk_fts",
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for sql in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpsChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(db_index=True, default='POPS_2014', max_length=64, verbose_name='Lähde')),
+                ('external_id', models.CharField(max_length=64, verbose_name='Tunniste')),
+                ('subject', models.CharField(db_index=True, max_length=200, verbose_name='Oppiaine')),
+                ('grade_context', models.CharField(db_index=True, max_length=20, verbose_name='Luokka-aste')),
+                ('content_type', models.CharField(db_index=True, max_length=50, verbose_name='Sisältötyyppi')),
+                ('content', models.TextField(verbose_name='Sisältö')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Päivitetty')),
+            ],
+            options={
+                'verbose_name': 'OPS-tekstiosa',
+                'verbose_name_plural': 'OPS-tekstiosat',
+                'constraints': [models.UniqueConstraint(fields=('source', 'external_id'), name='uniq_opschunk_source_external_id')],
+            },
+        ),
+        migrations.RunPython(
+            _run({"postgresql": PG_FORWARD, "sqlite": SQLITE_FORWARD}),
+            _run({"postgresql": PG_BACKWARD, "sqlite": SQLITE_BACKWARD}),
+        ),
+    ]
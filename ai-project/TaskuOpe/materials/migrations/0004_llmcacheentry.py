@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-17 06:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0003_opschunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True, verbose_name='Avain')),
+                ('model', models.CharField(max_length=100, verbose_name='Malli')),
+                ('response', models.TextField(verbose_name='Vastaus')),
+                ('size', models.PositiveIntegerField(default=0, verbose_name='Koko (tavua)')),
+                ('hits', models.PositiveIntegerField(default=0, verbose_name='Osumat')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Luotu')),
+                ('last_used_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Viimeksi käytetty')),
+                ('expires_at', models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Vanhenee')),
+            ],
+            options={
+                'verbose_name': 'LLM-välimuistirivi',
+                'verbose_name_plural': 'LLM-välimuistirivit',
+            },
+        ),
+    ]
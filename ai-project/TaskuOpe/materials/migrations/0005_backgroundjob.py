@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-17 06:10
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0004_llmcacheentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackgroundJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(max_length=50, verbose_name='Tyyppi')),
+                ('ref', models.CharField(blank=True, db_index=True, help_text="Esim. 'submission:<id>'; estää saman työn kaksoisajon.", max_length=100, verbose_name='Kohde')),
+                ('status', models.CharField(choices=[('QUEUED', 'Jonossa'), ('RUNNING', 'Käynnissä'), ('DONE', 'Valmis'), ('FAILED', 'Epäonnistui')], default='QUEUED', max_length=10, verbose_name='Tila')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='Syöte')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='Tulos')),
+                ('error', models.TextField(blank=True, verbose_name='Virhe')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Yritykset')),
+                ('worker', models.CharField(blank=True, max_length=100, verbose_name='Suorittaja')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Luotu')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Aloitettu')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Valmistunut')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='background_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Luoja')),
+            ],
+            options={
+                'verbose_name': 'Taustatyö',
+                'verbose_name_plural': 'Taustatyöt',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='bgjob_status_created_idx')],
+            },
+        ),
+    ]
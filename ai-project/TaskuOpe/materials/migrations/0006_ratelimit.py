@@ -0,0 +1,39 @@
+# Generated by Django 5.2.6 on 2026-10-17 06:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0005_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True, verbose_name='Avain')),
+                ('tokens', models.FloatField(default=0, verbose_name='Tokenit')),
+                ('updated_at', models.DateTimeField(verbose_name='Päivitetty')),
+                ('cooldown_until', models.DateTimeField(blank=True, help_text='Asetetaan, kun OpenAI palauttaa 429-vastauksen.', null=True, verbose_name='Tauko päättyy')),
+            ],
+            options={
+                'verbose_name': 'Nopeusrajoitin',
+                'verbose_name_plural': 'Nopeusrajoittimet',
+            },
+        ),
+        migrations.CreateModel(
+            name='RateLimitLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(db_index=True, max_length=100, verbose_name='Avain')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='Vanhenee')),
+            ],
+            options={
+                'verbose_name': 'Rinnakkaisuusvaraus',
+                'verbose_name_plural': 'Rinnakkaisuusvaraukset',
+            },
+        ),
+    ]
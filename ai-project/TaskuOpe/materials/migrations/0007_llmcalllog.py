@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-17 06:22
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0006_ratelimit'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMCallLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feature', models.CharField(max_length=50, verbose_name='Ominaisuus')),
+                ('model', models.CharField(blank=True, max_length=100, verbose_name='Malli')),
+                ('prompt_tokens', models.PositiveIntegerField(default=0, verbose_name='Syötetokenit')),
+                ('completion_tokens', models.PositiveIntegerField(default=0, verbose_name='Vastaustokenit')),
+                ('latency_ms', models.PositiveIntegerField(default=0, verbose_name='Kesto (ms)')),
+                ('status', models.CharField(choices=[('ok', 'Onnistui'), ('error', 'Virhe')], default='ok', max_length=10, verbose_name='Tila')),
+                ('error', models.CharField(blank=True, max_length=200, verbose_name='Virhe')),
+                ('cache_hit', models.BooleanField(default=False, verbose_name='Välimuistista')),
+                ('cost_usd', models.FloatField(default=0, verbose_name='Hinta-arvio (USD)')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Aika')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='llm_calls', to=settings.AUTH_USER_MODEL, verbose_name='Käyttäjä')),
+            ],
+            options={
+                'verbose_name': 'LLM-kutsu',
+                'verbose_name_plural': 'LLM-kutsut',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['feature', 'created_at'], name='llmcall_feature_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-17 06:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0007_llmcalllog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SingleFlight',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True, verbose_name='Avain')),
+                ('status', models.CharField(choices=[('RUNNING', 'Käynnissä'), ('DONE', 'Valmis'), ('FAILED', 'Epäonnistui')], default='RUNNING', max_length=10, verbose_name='Tila')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='Tulos')),
+                ('error', models.TextField(blank=True, verbose_name='Virhe')),
+                ('owner', models.CharField(blank=True, max_length=100, verbose_name='Johtaja')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Luotu')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='Vanhenee')),
+            ],
+            options={
+                'verbose_name': 'Yhdistetty kutsu',
+                'verbose_name_plural': 'Yhdistetyt kutsut',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0008_singleflight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='material',
+            name='rendered_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='material',
+            name='rendered_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-17 06:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0009_material_rendered_html'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(db_index=True, max_length=500, verbose_name='Alkuperäinen')),
+                ('format', models.CharField(choices=[('webp', 'WebP'), ('avif', 'AVIF')], max_length=4, verbose_name='Formaatti')),
+                ('width', models.PositiveIntegerField(verbose_name='Leveys')),
+                ('height', models.PositiveIntegerField(verbose_name='Korkeus')),
+                ('name', models.CharField(max_length=500, verbose_name='Tiedosto')),
+                ('size', models.PositiveIntegerField(default=0, verbose_name='Koko (tavua)')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Luotu')),
+            ],
+            options={
+                'verbose_name': 'Kuvaversio',
+                'verbose_name_plural': 'Kuvaversiot',
+                'constraints': [models.UniqueConstraint(fields=('source', 'format', 'width'), name='uniq_imagevariant_source_format_width')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-17 07:00
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0010_imagevariant'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='backgroundjob',
+            name='bgjob_status_created_idx',
+        ),
+        migrations.AddField(
+            model_name='backgroundjob',
+            name='run_after',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='Rajoitettu työ siirretään jonossa odotusajan yli.', verbose_name='Suoritetaan aikaisintaan'),
+        ),
+        migrations.AddIndex(
+            model_name='backgroundjob',
+            index=models.Index(fields=['status', 'run_after'], name='bgjob_status_run_after_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 07:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0011_backgroundjob_run_after'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backgroundjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, help_text='Worker päivittää tätä työn ollessa käynnissä.', null=True, verbose_name='Viimeisin elonmerkki'),
+        ),
+    ]
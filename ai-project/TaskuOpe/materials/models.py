@@ -7,6 +7,7 @@ from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.db.models.signals import post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from imagekit.models import ImageSpecField
 from imagekit.processors import ResizeToFill
@@ -138,6 +139,10 @@ class Material(models.Model):
         related_name='versions',
         verbose_name=_("Edellinen versio"),
     )
+    # Esirenderöity sisältö (views.shared.cached_material_html); hash kertoo,
+    # mistä sisällön versiosta HTML on tehty
+    rendered_html = models.TextField(blank=True, default="", editable=False)
+    rendered_hash = models.CharField(max_length=64, blank=True, default="", editable=False)
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Luotu"))
     updated_at = models.DateTimeField(auto_now=True, verbose_name=_("Päivitetty"))
 
@@ -491,3 +496,291 @@ def delete_image_file(sender, instance, **kwargs):
     """
     if instance.image:
         instance.image.delete(save=False)
+
+
+class OpsChunk(models.Model):
+    """
+    Malli opetussuunnitelman (OPS) tekstiosille tietokantapohjaista hakua varten.
+
+    Rivit ladataan komennolla ``python manage.py load_ops_chunks``. Samaan
+    tauluun voi tallentaa useita opetussuunnitelmia (``source``) sekä
+    koulukohtaisia lisäyksiä. Kokotekstihaun rakenteet (PostgreSQL:n
+    tsvector + GIN, SQLiten FTS5) luodaan migraatiossa tietokannan mukaan.
+    """
+    source = models.CharField(max_length=64, default="POPS_2014", db_index=True, verbose_name=_("Lähde"))
+    external_id = models.CharField(max_length=64, verbose_name=_("Tunniste"))
+    subject = models.CharField(max_length=200, db_index=True, verbose_name=_("Oppiaine"))
+    grade_context = models.CharField(max_length=20, db_index=True, verbose_name=_("Luokka-aste"))
+    content_type = models.CharField(max_length=50, db_index=True, verbose_name=_("Sisältötyyppi"))
+    content = models.TextField(verbose_name=_("Sisältö"))
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_("Päivitetty"))
+
+    class Meta:
+        """
+        Metatiedot OpsChunk-mallille.
+        """
+        verbose_name = _("OPS-tekstiosa")
+        verbose_name_plural = _("OPS-tekstiosat")
+        constraints = [
+            models.UniqueConstraint(fields=["source", "external_id"], name="uniq_opschunk_source_external_id"),
+        ]
+
+    def __str__(self):
+        """
+        Palauttaa tekstiosan luettavan esitysmuodon.
+        """
+        return f"{self.subject} {self.grade_context} – {self.content_type} ({self.external_id})"
+
+
+class LLMCacheEntry(models.Model):
+    """
+    Malli tallennetuille LLM-vastauksille (materials.llm_cache).
+
+    Avain on SHA-256-tiiviste mallista, viesteistä ja kutsun parametreista.
+    Vanhentuneet ja vähiten käytetyt rivit karsitaan koon ja määrän mukaan.
+    """
+    key = models.CharField(max_length=64, unique=True, verbose_name=_("Avain"))
+    model = models.CharField(max_length=100, verbose_name=_("Malli"))
+    response = models.TextField(verbose_name=_("Vastaus"))
+    size = models.PositiveIntegerField(default=0, verbose_name=_("Koko (tavua)"))
+    hits = models.PositiveIntegerField(default=0, verbose_name=_("Osumat"))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Luotu"))
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name=_("Viimeksi käytetty"))
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True, verbose_name=_("Vanhenee"))
+
+    class Meta:
+        """
+        Metatiedot LLMCacheEntry-mallille.
+        """
+        verbose_name = _("LLM-välimuistirivi")
+        verbose_name_plural = _("LLM-välimuistirivit")
+
+    def __str__(self):
+        """
+        Palauttaa rivin luettavan esitysmuodon.
+        """
+        return f"{self.model} {self.key[:12]} ({self.hits} osumaa)"
+
+
+class BackgroundJob(models.Model):
+    """
+    Malli taustatöille (materials.jobs), joita `run_jobs`-komento suorittaa.
+
+    Pitkät tekoälykutsut ajetaan erillisessä prosessissa, jotta web-workerit
+    vapautuvat heti. Jono on pelkkä tietokantataulu, joten erillistä
+    viestinvälittäjää ei tarvita.
+    """
+    class Status(models.TextChoices):
+        """Taustatyön tilaa kuvaavat valinnat."""
+        QUEUED = 'QUEUED', _('Jonossa')
+        RUNNING = 'RUNNING', _('Käynnissä')
+        DONE = 'DONE', _('Valmis')
+        FAILED = 'FAILED', _('Epäonnistui')
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=50, verbose_name=_("Tyyppi"))
+    ref = models.CharField(max_length=100, blank=True, db_index=True, verbose_name=_("Kohde"),
+                           help_text=_("Esim. 'submission:<id>'; estää saman työn kaksoisajon."))
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED, verbose_name=_("Tila"))
+    payload = models.JSONField(default=dict, blank=True, verbose_name=_("Syöte"))
+    result = models.JSONField(null=True, blank=True, verbose_name=_("Tulos"))
+    error = models.TextField(blank=True, verbose_name=_("Virhe"))
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name=_("Yritykset"))
+    worker = models.CharField(max_length=100, blank=True, verbose_name=_("Suorittaja"))
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL,
+                                   related_name='background_jobs', verbose_name=_("Luoja"))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Luotu"))
+    run_after = models.DateTimeField(default=timezone.now, verbose_name=_("Suoritetaan aikaisintaan"),
+                                     help_text=_("Rajoitettu työ siirretään jonossa odotusajan yli."))
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name=_("Aloitettu"))
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name=_("Viimeisin elonmerkki"),
+                                        help_text=_("Worker päivittää tätä työn ollessa käynnissä."))
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name=_("Valmistunut"))
+
+    class Meta:
+        """
+        Metatiedot BackgroundJob-mallille.
+        """
+        verbose_name = _("Taustatyö")
+        verbose_name_plural = _("Taustatyöt")
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'run_after'], name='bgjob_status_run_after_idx')]
+
+    def __str__(self):
+        """
+        Palauttaa taustatyön luettavan esitysmuodon.
+        """
+        return f"{self.kind} ({self.get_status_display()})"
+
+    @property
+    def is_finished(self):
+        """
+        Tarkistaa, onko työ päättynyt (valmis tai epäonnistunut).
+        """
+        return self.status in (self.Status.DONE, self.Status.FAILED)
+
+
+class RateLimitBucket(models.Model):
+    """
+    Tokenikori tekoälyrajapintojen nopeusrajoitukselle (materials.ratelimit).
+
+    Avain on muotoa "<endpoint>:user:<id>" tai "<endpoint>:global". Tila on
+    tietokannassa, jotta raja on yhteinen kaikille web- ja worker-prosesseille.
+    """
+    key = models.CharField(max_length=100, unique=True, verbose_name=_("Avain"))
+    tokens = models.FloatField(default=0, verbose_name=_("Tokenit"))
+    updated_at = models.DateTimeField(verbose_name=_("Päivitetty"))
+    cooldown_until = models.DateTimeField(null=True, blank=True, verbose_name=_("Tauko päättyy"),
+                                          help_text=_("Asetetaan, kun OpenAI palauttaa 429-vastauksen."))
+
+    class Meta:
+        """
+        Metatiedot RateLimitBucket-mallille.
+        """
+        verbose_name = _("Nopeusrajoitin")
+        verbose_name_plural = _("Nopeusrajoittimet")
+
+    def __str__(self):
+        """
+        Palauttaa rajoittimen luettavan esitysmuodon.
+        """
+        return f"{self.key} ({self.tokens:.1f})"
+
+
+class RateLimitLease(models.Model):
+    """
+    Käynnissä olevan tekoälypyynnön varaus (rinnakkaisuusraja).
+
+    Varaus poistetaan pyynnön päättyessä; vanhentunut varaus (kaatunut
+    prosessi) ei enää lasketa mukaan.
+    """
+    key = models.CharField(max_length=100, db_index=True, verbose_name=_("Avain"))
+    expires_at = models.DateTimeField(db_index=True, verbose_name=_("Vanhenee"))
+
+    class Meta:
+        """
+        Metatiedot RateLimitLease-mallille.
+        """
+        verbose_name = _("Rinnakkaisuusvaraus")
+        verbose_name_plural = _("Rinnakkaisuusvaraukset")
+
+    def __str__(self):
+        """
+        Palauttaa varauksen luettavan esitysmuodon.
+        """
+        return f"{self.key} → {self.expires_at:%H:%M:%S}"
+
+
+class LLMCallLog(models.Model):
+    """
+    Yksittäisen OpenAI-kutsun telemetriarivi (materials.telemetry).
+
+    Rivit kirjataan puskuroituna erissä; hallintanäkymä koostaa niistä
+    viiveen p50/p95-arvot ja tokenit ominaisuuksittain päivää kohden.
+    """
+    class Status(models.TextChoices):
+        """Kutsun lopputulos."""
+        OK = 'ok', _('Onnistui')
+        ERROR = 'error', _('Virhe')
+
+    feature = models.CharField(max_length=50, verbose_name=_("Ominaisuus"))
+    model = models.CharField(max_length=100, blank=True, verbose_name=_("Malli"))
+    prompt_tokens = models.PositiveIntegerField(default=0, verbose_name=_("Syötetokenit"))
+    completion_tokens = models.PositiveIntegerField(default=0, verbose_name=_("Vastaustokenit"))
+    latency_ms = models.PositiveIntegerField(default=0, verbose_name=_("Kesto (ms)"))
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.OK, verbose_name=_("Tila"))
+    error = models.CharField(max_length=200, blank=True, verbose_name=_("Virhe"))
+    cache_hit = models.BooleanField(default=False, verbose_name=_("Välimuistista"))
+    cost_usd = models.FloatField(default=0, verbose_name=_("Hinta-arvio (USD)"))
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL,
+                             related_name='llm_calls', verbose_name=_("Käyttäjä"))
+    created_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name=_("Aika"))
+
+    class Meta:
+        """
+        Metatiedot LLMCallLog-mallille.
+        """
+        verbose_name = _("LLM-kutsu")
+        verbose_name_plural = _("LLM-kutsut")
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['feature', 'created_at'], name='llmcall_feature_created_idx')]
+
+    def __str__(self):
+        """
+        Palauttaa kutsun luettavan esitysmuodon.
+        """
+        return f"{self.feature} {self.model} {self.latency_ms} ms"
+
+
+class SingleFlight(models.Model):
+    """
+    Prosessien välinen lukko ja tulos samanaikaisille identtisille
+    tekoälypyynnöille (materials.singleflight).
+
+    Ensimmäinen pyyntö (johtaja) tekee kutsun ja tallentaa tuloksen; muut
+    saman avaimen pyynnöt odottavat ja käyttävät samaa tulosta.
+    """
+    class Status(models.TextChoices):
+        """Kutsun tila."""
+        RUNNING = 'RUNNING', _('Käynnissä')
+        DONE = 'DONE', _('Valmis')
+        FAILED = 'FAILED', _('Epäonnistui')
+
+    key = models.CharField(max_length=64, unique=True, verbose_name=_("Avain"))
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.RUNNING, verbose_name=_("Tila"))
+    result = models.JSONField(null=True, blank=True, verbose_name=_("Tulos"))
+    error = models.TextField(blank=True, verbose_name=_("Virhe"))
+    owner = models.CharField(max_length=100, blank=True, verbose_name=_("Johtaja"))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Luotu"))
+    expires_at = models.DateTimeField(db_index=True, verbose_name=_("Vanhenee"))
+
+    class Meta:
+        """
+        Metatiedot SingleFlight-mallille.
+        """
+        verbose_name = _("Yhdistetty kutsu")
+        verbose_name_plural = _("Yhdistetyt kutsut")
+
+    def __str__(self):
+        """
+        Palauttaa rivin luettavan esitysmuodon.
+        """
+        return f"{self.key[:12]} ({self.get_status_display()})"
+
+
+class ImageVariant(models.Model):
+    """
+    Pakattu, pienennetty versio materiaalin kuvasta (materials.images).
+
+    Alkuperäinen kuva säilyy ennallaan latausta varten; renderöinti käyttää
+    näitä versioita srcset-attribuutissa.
+    """
+    class Format(models.TextChoices):
+        """Kuvaformaatti."""
+        WEBP = 'webp', 'WebP'
+        AVIF = 'avif', 'AVIF'
+
+    source = models.CharField(max_length=500, db_index=True, verbose_name=_("Alkuperäinen"))
+    format = models.CharField(max_length=4, choices=Format.choices, verbose_name=_("Formaatti"))
+    width = models.PositiveIntegerField(verbose_name=_("Leveys"))
+    height = models.PositiveIntegerField(verbose_name=_("Korkeus"))
+    name = models.CharField(max_length=500, verbose_name=_("Tiedosto"))
+    size = models.PositiveIntegerField(default=0, verbose_name=_("Koko (tavua)"))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Luotu"))
+
+    class Meta:
+        """
+        Metatiedot ImageVariant-mallille.
+        """
+        verbose_name = _("Kuvaversio")
+        verbose_name_plural = _("Kuvaversiot")
+        constraints = [
+            models.UniqueConstraint(fields=["source", "format", "width"], name="uniq_imagevariant_source_format_width"),
+        ]
+
+    def __str__(self):
+        """
+        Palauttaa rivin luettavan esitysmuodon.
+        """
+        return f"{self.source} ({self.format} {self.width}px)"
+
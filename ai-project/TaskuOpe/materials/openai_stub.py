@@ -0,0 +1,353 @@
+# materials/openai_stub.py
+"""Paikallinen OpenAI-yhteensopiva korvikepalvelin kuormitustestaukseen.
+
+Palvelin puhuu OpenAI:n HTTP-rajapinnan muotoa niille kutsuille, joita
+TaskuOpe käyttää, joten kaikki tekoälypolut (materiaaliluonnos, suoratoisto,
+pelit, rubriikkiarviointi, alkuperäisyysraportti, kuvat ja puhe) toimivat
+ilman oikeaa API-avainta:
+
+- POST /v1/chat/completions: tavallinen, JSON-tila ja suoratoisto (SSE)
+- POST /v1/images/generations: PNG base64-muodossa (b64_json)
+- POST /v1/audio/speech: hiljainen MP3, pituus tekstin mukaan
+- GET /v1/models ja GET /stats (pyyntö- ja virhelaskurit)
+
+Vastaukset ovat valmiita pohjia, jotka vastaavat sovelluksen odottamaa
+JSON-rakennetta (visa, mysteerisana, muistipeli, pelin metadata, rubriikki,
+alkuperäisyysraportti). Viive arvotaan valitusta jakaumasta, ja osa
+pyynnöistä voidaan vastata virheellä (esim. 429 tai 500), jotta
+uudelleenyritykset ja rajoittimet tulevat mitatuiksi.
+
+Käynnistys: ``python manage.py openai_stub --port 8765``. Sovellus ohjataan
+palvelimelle asetuksella ``OPENAI_STUB=True`` (tai ``OPENAI_BASE_URL``).
+"""
+
+import base64
+import io
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+# Yksi hiljainen MPEG-1 Layer III -kehys (128 kbit/s, 44,1 kHz, 417 tavua ≈ 26 ms)
+_MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+_MP3_FRAMES_PER_SECOND = 38
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Jäsentää viivejakauman kuvauksen.
+
+    Tuetut muodot (sekunteina):
+    - ``0`` tai ``fixed:0.3``
+    - ``uniform:0.1,0.8``
+    - ``normal:0.5,0.1`` (keskiarvo, keskihajonta; negatiiviset -> 0)
+    - ``lognormal:0.5,0.6`` (mediaani, lognormaalin sigma; pitkä häntä)
+
+    Args:
+        spec (str): Jakauman kuvaus.
+
+    Returns:
+        Callable[[random.Random], float]: Funktio, joka arpoo viiveen.
+
+    Raises:
+        ValueError: Jos kuvausta ei tunnisteta.
+    """
+    spec = (spec or "0").strip()
+    kind, _, args = spec.partition(":")
+    if not args:
+        value = float(kind)
+        return lambda rng: value
+    params = [float(a) for a in args.split(",")]
+    if kind == "fixed" and len(params) == 1:
+        return lambda rng: params[0]
+    if kind == "uniform" and len(params) == 2:
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == "normal" and len(params) == 2:
+        return lambda rng: max(0.0, rng.gauss(params[0], params[1]))
+    if kind == "lognormal" and len(params) == 2:
+        mu = math.log(params[0]) if params[0] > 0 else 0.0
+        return lambda rng: rng.lognormvariate(mu, params[1])
+    raise ValueError(f"Tuntematon viivejakauma: {spec}")
+
+
+class StubConfig:
+    """
+    Korvikepalvelimen asetukset.
+
+    Args:
+        latency (str): Vastauksen viivejakauma (parse_latency).
+        token_latency (str): Viive suoratoiston palojen välillä.
+        error_rate (float): Virhevastausten osuus 0.0–1.0.
+        error_codes (List[int]): Virhekoodit, joista arvotaan (esim. [429, 500]).
+        seed (Optional[int]): Satunnaislukujen siemen toistettavia ajoja varten.
+    """
+
+    def __init__(self, latency: str = "0", token_latency: str = "0", error_rate: float = 0.0,
+                 error_codes: Optional[List[int]] = None, seed: Optional[int] = None):
+        self.latency = parse_latency(latency)
+        self.token_latency = parse_latency(token_latency)
+        self.error_rate = float(error_rate)
+        self.error_codes = list(error_codes or [429, 500])
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats: Dict[str, int] = {}
+
+    def draw(self, fn: Callable[[random.Random], float]) -> float:
+        with self.lock:
+            return fn(self.rng)
+
+    def injected_error(self) -> Optional[int]:
+        with self.lock:
+            if self.error_rate and self.rng.random() < self.error_rate:
+                return self.rng.choice(self.error_codes)
+        return None
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+
+# --- Valmiit vastaukset ---
+
+def _quiz(text: str) -> dict:
+    m = re.search(r"TARKALLEEN\s+(\d+)", text)
+    n = int(m.group(1)) if m else 10
+    d = re.search(r'"difficulty"\s*:\s*"(\w+)"', text)
+    levels = [
+        {
+            "question": f"Kysymys {i}: mikä vaihtoehdoista on oikein?",
+            "choices": [f"Vaihtoehto {c}" for c in "ABCD"],
+            "correct": i % 4,
+        }
+        for i in range(1, n + 1)
+    ]
+    return {"difficulty": d.group(1) if d else "medium", "levels": levels}
+
+
+def _rubric(text: str) -> dict:
+    criteria = re.findall(r'^- "([^"]+)" \(max (\d+) p\)', text, flags=re.M)
+    return {
+        "criteria": [
+            {"name": name, "points": max(0, int(mx) - 1), "max": int(mx),
+             "feedback": "Hyvä vastaus, pieniä puutteita."}
+            for name, mx in criteria
+        ],
+        "general_feedback": "Vastaus käsittelee tehtävän keskeiset asiat. Tarkenna perusteluja.",
+    }
+
+
+def _plagiarism(text: str) -> dict:
+    return {
+        "ai_generated_likelihood": 0.2,
+        "plagiarism_risk": 0.1,
+        "suspected_sources": [],
+        "summary_fi": "Ei merkittäviä viitteitä plagioinnista tai tekoälyn käytöstä.",
+        "evidence_highlights": [],
+    }
+
+
+def canned_chat(messages: List[dict], json_mode: bool) -> str:
+    """
+    Valitsee pyynnön sisällön perusteella sovelluksen odottaman muotoisen vastauksen.
+
+    Args:
+        messages (List[dict]): Chat-viestit.
+        json_mode (bool): Pyydettiinkö response_format json_object.
+
+    Returns:
+        str: Vastausteksti.
+    """
+    text = "\n".join(
+        m["content"] if isinstance(m.get("content"), str) else json.dumps(m.get("content"), ensure_ascii=False)
+        for m in messages
+    )
+    if "originality_and_ai_use_assessment" in text:
+        return json.dumps(_plagiarism(text), ensure_ascii=False)
+    if '"pairs"' in text:
+        pairs = [{"question": f"Kysymys {i}", "answer": f"Vastaus {i}"} for i in range(1, 11)]
+        return json.dumps({"pairs": pairs}, ensure_ascii=False)
+    if '"words"' in text:
+        words = ["OMENA", "PÄÄRYNÄ", "KIRJASTO", "KOULU", "METSÄ", "JOKI"] * 5
+        return json.dumps({"topic": "stub", "words": words}, ensure_ascii=False)
+    if '"levels"' in text:
+        return json.dumps(_quiz(text), ensure_ascii=False)
+    if '"title"' in text and '"subject"' in text:
+        return json.dumps({"title": "Hauska oppimispeli", "subject": "Ympäristöoppi"}, ensure_ascii=False)
+    if '"criteria"' in text:
+        return json.dumps(_rubric(text), ensure_ascii=False)
+    if json_mode:
+        return json.dumps({"ok": True}, ensure_ascii=False)
+    return (
+        "Otsikkoehdotus: Harjoitustehtävä\n"
+        "Tavoitteet:\n1) Ymmärtää aiheen peruskäsitteet\n2) Harjoitella taitoja\n3) Soveltaa opittua\n\n"
+        "Luonnosteksti:\n- Tehtävä 1: Lue teksti ja vastaa kysymyksiin omin sanoin.\n"
+        "- Tehtävä 2: Keksi kolme omaa esimerkkiä aiheesta."
+    )
+
+
+def _png(size: str) -> bytes:
+    try:
+        w, h = (int(v) for v in size.lower().split("x"))
+    except ValueError:
+        w = h = 1024
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGB", (w, h), (120, 144, 156)).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _silent_mp3(text: str, speed: float = 1.0) -> bytes:
+    # Noin 15 merkkiä sekunnissa normaalilla puhenopeudella
+    seconds = max(1.0, len(text) / 15.0 / max(speed, 0.25))
+    return _MP3_FRAME * int(seconds * _MP3_FRAMES_PER_SECOND)
+
+
+def _tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / 4))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "OpenAIStub/1.0"
+    config: StubConfig = None  # asetetaan make_serverissä
+
+    def log_message(self, fmt, *args):
+        # Hiljainen oletuksena; kuormitusajossa loki hidastaisi palvelinta
+        pass
+
+    # --- apurit ---
+    def _send(self, status: int, body: bytes, content_type: str = "application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status: int, data: dict, headers=None):
+        self._send(status, json.dumps(data, ensure_ascii=False).encode("utf-8"), headers=headers)
+
+    def _error(self, status: int):
+        self.config.count(f"error_{status}")
+        kind = "rate_limit_exceeded" if status == 429 else "server_error"
+        headers = {"Retry-After": "1"} if status == 429 else None
+        self._json(status, {"error": {"message": f"Stub error {status}", "type": kind, "code": kind}}, headers)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b"{}"
+        try:
+            return json.loads(raw or b"{}")
+        except ValueError:
+            return {}
+
+    # --- reititys ---
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            return self._json(200, {"object": "list", "data": [
+                {"id": m, "object": "model", "owned_by": "stub"} for m in ("gpt-4o", "gpt-4o-mini", "dall-e-3", "tts-1")
+            ]})
+        if self.path.rstrip("/") in ("/stats", "/v1/stats"):
+            with self.config.lock:
+                return self._json(200, dict(self.config.stats))
+        self._json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        body = self._read_json()
+        route = self.path.split("?")[0].rstrip("/")
+        handlers = {
+            "/v1/chat/completions": self._chat,
+            "/v1/images/generations": self._image,
+            "/v1/audio/speech": self._speech,
+        }
+        handler = handlers.get(route)
+        if handler is None:
+            return self._json(404, {"error": {"message": f"Unknown route {route}"}})
+        self.config.count(route)
+        time.sleep(self.config.draw(self.config.latency))
+        status = self.config.injected_error()
+        if status:
+            return self._error(status)
+        handler(body)
+
+    def _chat(self, body: dict):
+        model = body.get("model") or "gpt-4o"
+        json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        content = canned_chat(body.get("messages") or [], json_mode)
+        cid = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        prompt_tokens = _tokens(json.dumps(body.get("messages") or [], ensure_ascii=False))
+        completion_tokens = _tokens(content)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        if body.get("stream"):
+            include_usage = (body.get("stream_options") or {}).get("include_usage")
+            return self._stream_chat(cid, created, model, content, usage if include_usage else None)
+        self._json(200, {
+            "id": cid, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": usage,
+        })
+
+    def _stream_chat(self, cid: str, created: int, model: str, content: str, usage: Optional[dict] = None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(delta: dict, finish=None):
+            data = {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+            self._write_chunk(f"data: {json.dumps(data, ensure_ascii=False)}\n\n")
+
+        chunk({"role": "assistant", "content": ""})
+        for piece in re.findall(r"\S+\s*|\s+", content):
+            time.sleep(self.config.draw(self.config.token_latency))
+            chunk({"content": piece})
+        chunk({}, finish="stop")
+        if usage:
+            # stream_options.include_usage: viimeinen pala ilman choices-kenttää
+            data = {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [], "usage": usage}
+            self._write_chunk(f"data: {json.dumps(data)}\n\n")
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text: str):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _image(self, body: dict):
+        b64 = base64.b64encode(_png(body.get("size") or "1024x1024")).decode("ascii")
+        self._json(200, {"created": int(time.time()),
+                         "data": [{"b64_json": b64, "revised_prompt": body.get("prompt", "")}]})
+
+    def _speech(self, body: dict):
+        self._send(200, _silent_mp3(body.get("input") or "", float(body.get("speed") or 1.0)),
+                   content_type="audio/mpeg")
+
+
+def make_server(host: str = "127.0.0.1", port: int = 8765, config: Optional[StubConfig] = None) -> ThreadingHTTPServer:
+    """
+    Luo korvikepalvelimen (ei vielä käynnissä; kutsu serve_forever()).
+
+    Args:
+        host (str): Kuunneltava osoite.
+        port (int): Portti (0 = vapaa portti).
+        config (Optional[StubConfig]): Viive- ja virheasetukset.
+
+    Returns:
+        ThreadingHTTPServer: Palvelin, jonka jokainen yhteys käsitellään omassa säikeessään.
+    """
+    handler = type("StubHandler", (_Handler,), {"config": config or StubConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
@@ -9,19 +9,12 @@ from __future__ import annotations
 
 import html
 import json
-import os
 import re
 from typing import Dict, List, Tuple
 
 from django.db import transaction
 from django.utils import timezone
 
-# --- OpenAI SDK (v1.x) ---
-try:
-    from openai import OpenAI
-except ImportError as e:
-    raise ImportError("Asenna OpenAI-kirjasto: pip install openai>=1.0.0") from e
-
 # --- Kevyt TF-IDF vain verrokkien hakuun (retrieval). Varsinaisen arvion tekee LLM. ---
 try:
     from sklearn.feature_extraction.text import TfidfVectorizer
@@ -29,12 +22,9 @@ try:
 except ImportError as e:
     raise ImportError("Asenna scikit-learn: pip install scikit-learn") from e
 
+from .ai_service import chat_completion
 from .models import PlagiarismReport, Submission
 
-# Alusta OpenAI-asiakas
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-MODEL_NAME = os.getenv("OPENAI_MODEL_NAME", "gpt-4o")
-
 # Kuinka monta sisäistä verrokkia annetaan mallille luettavaksi
 TOP_K = 3
 # TF-IDF minimiraja verrokeille; alle tämän ei tarjota LLM:lle melun vähentämiseksi
@@ -133,16 +123,15 @@ def _call_openai(payload: dict) -> dict:
         "Ole varovainen: yksittäinen heuristiikka ei riitä. "
         "Palauta täsmälleen JSON-objekti ilman vapaata tekstiä ympärillä."
     )
-    resp = client.chat.completions.create(
-        model=MODEL_NAME,
-        temperature=0,
-        response_format={"type": "json_object"},
-        messages=[
+    # Tehtävän lämpötila on 0 (ai_models) -> sama payload luetaan välimuistista (llm_cache)
+    content = chat_completion(
+        [
             {"role": "system", "content": system},
             {"role": "user", "content": json.dumps(payload, ensure_ascii=False)}
         ],
+        task="plagiarism",
+        response_format={"type": "json_object"},
     )
-    content = resp.choices[0].message.content
     try:
         return json.loads(content)
     except json.JSONDecodeError:
@@ -0,0 +1,366 @@
+# materials/ratelimit.py
+"""Tekoälyrajapintojen nopeus- ja rinnakkaisuusrajoitin.
+
+Rajat ovat tietokannassa (RateLimitBucket, RateLimitLease), joten ne ovat
+yhteiset kaikille web- ja worker-prosesseille ilman erillistä välimuistia.
+
+- Tokenikori: jokainen pyyntö kuluttaa tokenin; tokeneita kertyy ``rate``
+  kappaletta ``per`` sekunnissa, enintään ``burst``.
+- Rinnakkaisuus: enintään ``concurrency`` käynnissä olevaa pyyntöä; varaus
+  vanhenee ``lease`` sekunnissa, jos prosessi kaatuu kesken.
+- Yhteinen tauko: kun OpenAI palauttaa 429-vastauksen, Retry-After tallennetaan
+  ja sekä näkymät että taustatyöt odottavat sen yli (materials.ai_service).
+
+Rajat määritetään rajapinnoittain ja rooleittain asetuksella AI_RATE_LIMITS,
+joka yhdistetään oletuksiin (DEFAULT_LIMITS). Avain "global" on kaikkien
+käyttäjien yhteinen raja; "default" koskee rooleja, joilla ei ole omaa riviä.
+"""
+
+import math
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+from functools import wraps
+from typing import Iterator, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import RateLimitBucket, RateLimitLease
+
+DEFAULT_LIMITS = {
+    "material_draft": {
+        "TEACHER": {"rate": 10, "per": 60, "burst": 5, "concurrency": 2},
+        "global": {"rate": 120, "per": 60, "burst": 30, "concurrency": 20},
+    },
+    "game": {
+        "TEACHER": {"rate": 6, "per": 60, "burst": 3, "concurrency": 2},
+        "global": {"rate": 60, "per": 60, "burst": 20, "concurrency": 10},
+    },
+    "image": {
+        "TEACHER": {"rate": 5, "per": 60, "burst": 2, "concurrency": 1},
+        "global": {"rate": 30, "per": 60, "burst": 10, "concurrency": 5},
+    },
+    "tts": {
+        "TEACHER": {"rate": 10, "per": 60, "burst": 5, "concurrency": 2},
+        "STUDENT": {"rate": 4, "per": 60, "burst": 2, "concurrency": 1},
+        "global": {"rate": 120, "per": 60, "burst": 40, "concurrency": 20},
+    },
+}
+
+UPSTREAM_KEY = "openai:upstream"
+
+# Yhteisen tauon prosessikohtainen välimuisti, ettei jokainen OpenAI-kutsu lue kantaa
+_COOLDOWN = {"until": 0.0, "checked": 0.0}
+_COOLDOWN_LOCK = threading.Lock()
+
+
+class RateLimited(Exception):
+    """Raja ylittyi; retry_after kertoo, monenko sekunnin päästä voi yrittää uudelleen."""
+
+    def __init__(self, retry_after: float, scope: str = ""):
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.scope = scope
+        super().__init__(f"Rajoitettu ({scope}), yritä uudelleen {self.retry_after} s kuluttua")
+
+
+def enabled() -> bool:
+    """Palauttaa True, jos rajoitin on käytössä (AI_RATE_LIMITS_ENABLED)."""
+    return bool(getattr(settings, "AI_RATE_LIMITS_ENABLED", True))
+
+
+def get_limits(endpoint: str) -> dict:
+    """
+    Palauttaa rajapinnan rajat roolin mukaan (oletukset + AI_RATE_LIMITS).
+
+    Args:
+        endpoint (str): Rajapinnan nimi, esim. "game".
+
+    Returns:
+        dict: Rooli (tai "global"/"default") -> {rate, per, burst, concurrency}.
+    """
+    limits = {role: dict(rule) for role, rule in DEFAULT_LIMITS.get(endpoint, {}).items()}
+    for role, rule in (getattr(settings, "AI_RATE_LIMITS", {}) or {}).get(endpoint, {}).items():
+        if rule is None:
+            limits.pop(role, None)
+        else:
+            limits[role] = {**limits.get(role, {}), **rule}
+    return limits
+
+
+def rule_for(endpoint: str, user) -> tuple:
+    """
+    Valitsee käyttäjän roolin mukaisen ja yhteisen rajan.
+
+    Returns:
+        tuple: (käyttäjän raja tai None, yhteinen raja tai None).
+    """
+    limits = get_limits(endpoint)
+    role = getattr(user, "role", None)
+    return limits.get(role) or limits.get("default"), limits.get("global")
+
+
+def _refill(bucket: RateLimitBucket, rule: dict, now) -> None:
+    rate = float(rule.get("rate", 0)) / max(float(rule.get("per", 60)), 1e-6)
+    burst = float(rule.get("burst") or rule.get("rate") or 1)
+    elapsed = max((now - bucket.updated_at).total_seconds(), 0.0)
+    bucket.tokens = min(burst, bucket.tokens + elapsed * rate)
+    bucket.updated_at = now
+
+
+def take(key: str, rule: dict) -> float:
+    """
+    Kuluttaa tokenin korista.
+
+    Args:
+        key (str): Korin avain.
+        rule (dict): Raja (rate, per, burst).
+
+    Returns:
+        float: 0, jos token saatiin, muuten sekunnit seuraavaan tokeniin.
+    """
+    if not rule or not rule.get("rate"):
+        return 0.0
+    now = timezone.now()
+    burst = float(rule.get("burst") or rule["rate"])
+    with transaction.atomic():
+        bucket, _ = (
+            RateLimitBucket.objects.select_for_update()
+            .get_or_create(key=key, defaults={"tokens": burst, "updated_at": now})
+        )
+        _refill(bucket, rule, now)
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            wait = 0.0
+        else:
+            rate = float(rule["rate"]) / max(float(rule.get("per", 60)), 1e-6)
+            wait = (1 - bucket.tokens) / rate
+        bucket.save(update_fields=["tokens", "updated_at"])
+    return wait
+
+
+def refund(key: str, rule: dict) -> None:
+    """Palauttaa take-kutsulla kulutetun tokenin koriin (enintään burst)."""
+    if not rule or not rule.get("rate"):
+        return
+    burst = float(rule.get("burst") or rule["rate"])
+    with transaction.atomic():
+        bucket = RateLimitBucket.objects.select_for_update().filter(key=key).first()
+        if bucket is not None:
+            bucket.tokens = min(burst, bucket.tokens + 1)
+            bucket.save(update_fields=["tokens"])
+
+
+def acquire(key: str, limit: Optional[int], *, lease_seconds: Optional[float] = None) -> Optional[int]:
+    """
+    Varaa rinnakkaisuuspaikan.
+
+    Args:
+        key (str): Varauksen avain.
+        limit (Optional[int]): Samanaikaisten varausten enimmäismäärä (None = ei rajaa).
+        lease_seconds (Optional[float]): Varauksen voimassaolo (oletus AI_RATE_LIMIT_LEASE_SECONDS).
+
+    Returns:
+        Optional[int]: Varauksen id, 0 jos rajaa ei ole, tai None jos paikkoja ei ole.
+    """
+    if not limit:
+        return 0
+    now = timezone.now()
+    ttl = lease_seconds or float(getattr(settings, "AI_RATE_LIMIT_LEASE_SECONDS", 300))
+    with transaction.atomic():
+        # Koririvi toimii lukkona, jotta laskenta ja lisäys ovat yhtenäisiä
+        RateLimitBucket.objects.select_for_update().get_or_create(
+            key=key, defaults={"tokens": 0, "updated_at": now}
+        )
+        RateLimitLease.objects.filter(key=key, expires_at__lte=now).delete()
+        if RateLimitLease.objects.filter(key=key).count() >= int(limit):
+            return None
+        return RateLimitLease.objects.create(key=key, expires_at=now + timedelta(seconds=ttl)).pk
+
+
+def release(lease_id: Optional[int]) -> None:
+    """Vapauttaa acquire-kutsulla saadun varauksen."""
+    if lease_id:
+        RateLimitLease.objects.filter(pk=lease_id).delete()
+
+
+def upstream_cooldown() -> float:
+    """
+    Palauttaa jäljellä olevan yhteisen tauon sekunteina (OpenAI 429).
+
+    Arvo luetaan kannasta enintään kerran sekunnissa prosessia kohden.
+    """
+    now = time.time()
+    with _COOLDOWN_LOCK:
+        if now - _COOLDOWN["checked"] >= 1.0:
+            until = (
+                RateLimitBucket.objects.filter(key=UPSTREAM_KEY)
+                .values_list("cooldown_until", flat=True).first()
+            )
+            _COOLDOWN["until"] = max(_COOLDOWN["until"], until.timestamp() if until else 0.0)
+            _COOLDOWN["checked"] = now
+        return max(0.0, _COOLDOWN["until"] - now)
+
+
+def note_upstream_limit(retry_after: Optional[float]) -> None:
+    """
+    Tallentaa OpenAI:n 429-vastauksen yhteiseksi tauoksi, jotta muut prosessit
+    eivät jatka kutsuja ennen Retry-After-ajan umpeutumista.
+
+    Args:
+        retry_after (Optional[float]): Retry-After sekunteina (oletus AI_UPSTREAM_COOLDOWN).
+    """
+    seconds = min(
+        float(retry_after or getattr(settings, "AI_UPSTREAM_COOLDOWN", 5)),
+        float(getattr(settings, "AI_UPSTREAM_COOLDOWN_MAX", 60)),
+    )
+    until = timezone.now() + timedelta(seconds=seconds)
+    with _COOLDOWN_LOCK:
+        _COOLDOWN["until"] = max(_COOLDOWN["until"], until.timestamp())
+    bucket, created = RateLimitBucket.objects.get_or_create(
+        key=UPSTREAM_KEY, defaults={"tokens": 0, "updated_at": timezone.now(), "cooldown_until": until}
+    )
+    if not created and (bucket.cooldown_until is None or bucket.cooldown_until < until):
+        RateLimitBucket.objects.filter(pk=bucket.pk).update(cooldown_until=until)
+    print(f"OpenAI 429: yhteinen tauko {seconds:.0f} s")
+
+
+def check(endpoint: str, user) -> None:
+    """
+    Tarkistaa yhteisen tauon ja kuluttaa tokenit käyttäjän ja yhteisestä korista.
+
+    Jos yhteinen kori hylkää pyynnön, käyttäjän jo kulutettu token palautetaan,
+    jotta hylätty pyyntö ei vie käyttäjän omaa kiintiötä.
+
+    Raises:
+        RateLimited: Jos jokin raja ylittyy.
+    """
+    cooldown = upstream_cooldown()
+    if cooldown > 0:
+        raise RateLimited(cooldown, "openai")
+    user_rule, global_rule = rule_for(endpoint, user)
+    user_key = f"{endpoint}:user:{user.pk}" if user_rule and getattr(user, "pk", None) else None
+    if user_key:
+        wait = take(user_key, user_rule)
+        if wait:
+            raise RateLimited(wait, "user")
+    if global_rule:
+        wait = take(f"{endpoint}:global", global_rule)
+        if wait:
+            if user_key:
+                refund(user_key, user_rule)
+            raise RateLimited(wait, "global")
+
+
+def refund_check(endpoint: str, user) -> None:
+    """Palauttaa check-kutsun kuluttamat tokenit (pyyntö hylättiin myöhemmin)."""
+    user_rule, global_rule = rule_for(endpoint, user)
+    if user_rule and getattr(user, "pk", None):
+        refund(f"{endpoint}:user:{user.pk}", user_rule)
+    if global_rule:
+        refund(f"{endpoint}:global", global_rule)
+
+
+@contextmanager
+def slots(endpoint: str, user=None, *, scope: str = "request") -> Iterator[None]:
+    """
+    Pitää käyttäjän ja yhteisen rinnakkaisuuspaikan lohkon ajan.
+
+    Args:
+        endpoint (str): Rajapinnan nimi.
+        user: Käyttäjä (None = vain yhteinen raja).
+        scope (str): Avaimen tarkenne, esim. "request" tai "job".
+
+    Raises:
+        RateLimited: Jos vapaita paikkoja ei ole.
+    """
+    user_rule, global_rule = rule_for(endpoint, user)
+    held = []
+    try:
+        if user_rule and getattr(user, "pk", None):
+            lease = acquire(f"{endpoint}:{scope}:user:{user.pk}", user_rule.get("concurrency"))
+            if lease is None:
+                raise RateLimited(float(getattr(settings, "AI_RATE_LIMIT_BUSY_RETRY", 2)), "user")
+            held.append(lease)
+        if global_rule:
+            lease = acquire(f"{endpoint}:{scope}:global", global_rule.get("concurrency"))
+            if lease is None:
+                raise RateLimited(float(getattr(settings, "AI_RATE_LIMIT_BUSY_RETRY", 2)), "global")
+            held.append(lease)
+        yield
+    finally:
+        for lease in held:
+            release(lease)
+
+
+def too_many_requests(request, exc: RateLimited) -> HttpResponse:
+    """
+    Rakentaa 429-vastauksen Retry-After-otsakkeella.
+
+    JSON-pyynnöille (fetch) palautetaan JSON, lomakkeille lyhyt teksti.
+    """
+    message = f"Liian monta tekoälypyyntöä. Yritä uudelleen {exc.retry_after} sekunnin kuluttua."
+    wants_json = (
+        "application/json" in request.headers.get("Accept", "")
+        or request.headers.get("X-Requested-With") == "XMLHttpRequest"
+        or request.content_type == "application/json"
+    )
+    if wants_json:
+        resp = JsonResponse({"success": False, "error": message, "retry_after": exc.retry_after}, status=429)
+    else:
+        resp = HttpResponse(message, status=429, content_type="text/plain; charset=utf-8")
+    resp["Retry-After"] = str(exc.retry_after)
+    return resp
+
+
+def _release_after(content, leases) -> Iterator:
+    try:
+        yield from content
+    finally:
+        leases.close()
+
+
+def rate_limited(endpoint: str, *, when=None):
+    """
+    Näkymädekoraattori, joka rajoittaa tekoälyrajapinnan käyttöä.
+
+    Tokenit kulutetaan ennen näkymää ja rinnakkaisuuspaikat pidetään näkymän
+    ajan (suoratoistossa vastauksen loppuun asti). Ylitys palauttaa heti
+    429-vastauksen ilman tekoälykutsua.
+
+    Args:
+        endpoint (str): Rajapinnan nimi AI_RATE_LIMITS-asetuksessa.
+        when: Valinnainen ehto f(request) -> bool; False ohittaa rajoituksen
+            (esim. lomakkeen tallennus samassa näkymässä).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not enabled() or (when is not None and not when(request)):
+                return view(request, *args, **kwargs)
+            leases = ExitStack()
+            try:
+                check(endpoint, request.user)
+            except RateLimited as exc:
+                return too_many_requests(request, exc)
+            try:
+                leases.enter_context(slots(endpoint, request.user))
+            except RateLimited as exc:
+                # Kaikki paikat varattuja: hylätty pyyntö ei kuluta nopeuskiintiötä
+                refund_check(endpoint, request.user)
+                return too_many_requests(request, exc)
+            try:
+                response = view(request, *args, **kwargs)
+            except BaseException:
+                leases.close()
+                raise
+            if getattr(response, "streaming", False):
+                response.streaming_content = _release_after(response.streaming_content, leases)
+            else:
+                leases.close()
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,193 @@
+# materials/singleflight.py
+"""Samanaikaisten identtisten tekoälypyyntöjen yhdistäminen (single-flight).
+
+Kun useampi oppilas painaa "kuuntele" samaan aikaan tai opettaja
+tuplaklikkaa "Generoi peli", vain ensimmäinen pyyntö (johtaja) kutsuu
+OpenAI:ta; muut saman avaimen pyynnöt odottavat ja saavat saman tuloksen.
+
+- Prosessin sisällä odottajat jäävät johtajan Futureen (ei tietokantaa).
+- Prosessien välillä lukkona toimii SingleFlight-rivin uniikki avain.
+  Johtaja tallentaa JSON-kelpoisen tuloksen riville, ja muut workerit
+  lukevat sen. Valmis tulos on jaettavissa vielä SINGLEFLIGHT_LINGER
+  sekuntia, joten hieman myöhässä tulevat pyynnöt eivät tee uutta kutsua.
+- Jos johtaja kaatuu, rivi vanhenee (SINGLEFLIGHT_LEASE) ja seuraava
+  odottaja ottaa johtajuuden.
+
+Avain lasketaan pyynnön sisällöstä (make_key).
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from datetime import timedelta
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import SingleFlight
+
+_INFLIGHT: Dict[str, Future] = {}
+_LOCK = threading.Lock()
+
+
+class SingleFlightError(RuntimeError):
+    """Toisen prosessin johtajan kutsu epäonnistui."""
+
+
+def make_key(kind: str, *parts: Any) -> str:
+    """
+    Laskee pyynnön sisältöön perustuvan avaimen.
+
+    Args:
+        kind (str): Pyynnön tyyppi, esim. "tts".
+        *parts: JSON-kelpoiset osat, jotka määräävät tuloksen.
+
+    Returns:
+        str: SHA-256-tiiviste heksamuodossa.
+    """
+    raw = json.dumps([kind, *parts], ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _setting(name: str, default: float) -> float:
+    return float(getattr(settings, name, default))
+
+
+def do(key: str, fn: Callable[[], Any], *, timeout: Optional[float] = None) -> Any:
+    """
+    Suorittaa fn:n kerran samanaikaisille saman avaimen kutsuille.
+
+    Args:
+        key (str): Pyynnön avain (make_key).
+        fn (Callable[[], Any]): Kutsu, jonka tuloksen on oltava JSON-kelpoinen.
+        timeout (Optional[float]): Odotuksen enimmäisaika (oletus SINGLEFLIGHT_LEASE).
+
+    Returns:
+        Any: Johtajan kutsun tulos.
+
+    Raises:
+        SingleFlightError: Jos toisen prosessin johtaja epäonnistui.
+        TimeoutError: Jos tulosta ei saatu ajoissa.
+    """
+    timeout = timeout or _setting("SINGLEFLIGHT_LEASE", 300)
+    with _LOCK:
+        future = _INFLIGHT.get(key)
+        leader = future is None
+        if leader:
+            future = _INFLIGHT[key] = Future()
+    if not leader:
+        # Saman prosessin johtaja hoitaa kutsun; virhe välittyy myös tänne
+        return future.result(timeout=timeout)
+    try:
+        result = _across_processes(key, fn, timeout)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _LOCK:
+            _INFLIGHT.pop(key, None)
+
+
+def _owner() -> str:
+    return f"{os.getpid()}:{threading.get_ident()}"
+
+
+def _try_lead(key: str, owner: str):
+    """
+    Yrittää ottaa johtajuuden.
+
+    Returns:
+        tuple: (True, None) johtajalle, (False, rivi) odottajalle tai
+        (False, None), jos tila muuttui kesken ja kannattaa yrittää uudelleen.
+    """
+    now = timezone.now()
+    lease = timedelta(seconds=_setting("SINGLEFLIGHT_LEASE", 300))
+    try:
+        with transaction.atomic():
+            SingleFlight.objects.create(key=key, owner=owner, expires_at=now + lease)
+        return True, None
+    except IntegrityError:
+        pass
+    row = SingleFlight.objects.filter(key=key).first()
+    if row is None:
+        return False, None
+    if row.expires_at <= now:
+        # Vanha tulos tai kaatunut johtaja -> johtajuus ehdollisella päivityksellä
+        took = SingleFlight.objects.filter(pk=row.pk, expires_at=row.expires_at).update(
+            status=SingleFlight.Status.RUNNING, owner=owner, result=None, error="", expires_at=now + lease
+        )
+        return bool(took), None
+    return False, row
+
+
+def _across_processes(key: str, fn: Callable[[], Any], timeout: float) -> Any:
+    owner = _owner()
+    deadline = time.monotonic() + timeout
+    poll = _setting("SINGLEFLIGHT_POLL_INTERVAL", 0.2)
+    while True:
+        lead, row = _try_lead(key, owner)
+        if lead:
+            break
+        if row is not None and row.status == SingleFlight.Status.DONE:
+            return row.result
+        if row is not None and row.status == SingleFlight.Status.FAILED:
+            raise SingleFlightError(row.error or "Yhdistetty kutsu epäonnistui.")
+        if time.monotonic() > deadline:
+            raise TimeoutError("Samanlaisen pyynnön tulosta ei saatu ajoissa.")
+        time.sleep(poll)
+
+    try:
+        result = fn()
+    except Exception as e:
+        complete(key, error=e, owner=owner)
+        raise
+    complete(key, result, owner=owner)
+    return result
+
+
+def claim(key: str) -> bool:
+    """
+    Yrittää ottaa avaimen johtajuuden odottamatta (prosessien välinen lukko).
+
+    Kutsujan on päätettävä johtajuus complete-funktiolla samasta säikeestä.
+    Näin kutsuja voi ajaa varsinaisen työn (esim. HTTP-kutsun) toisessa
+    säikeessä ilman, että se säie kirjoittaa tietokantaan.
+
+    Returns:
+        bool: True, jos kutsuja on johtaja; False, jos toinen tekee työtä
+        (tai tulos on jo valmis) ja tulos kannattaa hakea do-funktiolla.
+    """
+    lead, _ = _try_lead(key, _owner())
+    return lead
+
+
+def complete(key: str, result: Any = None, *, error: Optional[BaseException] = None,
+             owner: Optional[str] = None) -> None:
+    """
+    Päättää johtajuuden: tallentaa tuloksen odottajille tai virheen hetkeksi.
+
+    Args:
+        key (str): Avain.
+        result (Any): JSON-kelpoinen tulos (kun error on None).
+        error (Optional[BaseException]): Johtajan kutsun virhe.
+        owner (Optional[str]): Johtajan tunniste (oletus kutsuva säie).
+    """
+    mine = SingleFlight.objects.filter(key=key, owner=owner or _owner())
+    now = timezone.now()
+    if error is not None:
+        # Virhe näytetään hetken odottajille; sen jälkeen uusi yritys on mahdollinen
+        mine.update(status=SingleFlight.Status.FAILED, error=str(error) or error.__class__.__name__,
+                    expires_at=now + timedelta(seconds=1))
+        return
+    mine.update(status=SingleFlight.Status.DONE, result=result,
+                expires_at=now + timedelta(seconds=_setting("SINGLEFLIGHT_LINGER", 10)))
+    # Siivotaan vanhat rivit, ettei taulu kasva
+    SingleFlight.objects.filter(expires_at__lt=now - timedelta(hours=1)).delete()
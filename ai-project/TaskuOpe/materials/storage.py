@@ -0,0 +1,65 @@
+# materials/storage.py
+"""Mediatiedostojen tallennus (kuvat ja puheääni).
+
+Tuotannossa default_storage on PublicMediaStorage (DigitalOcean Spaces, S3).
+Tiedosto tallennetaan julkisena yhdellä PUT-pyynnöllä: ACL ja Cache-Control
+lähetetään latauksen mukana, joten erillistä put_object_acl-kutsua ei tarvita.
+Storage on prosessin yhteinen olio, joka luo S3-yhteyden kerran säiettä
+kohden, joten jokainen tallennus ei rakenna uutta boto3-asiakasta.
+
+Kehityksessä (DEBUG) default_storage on paikallinen tiedostojärjestelmä;
+save_public toimii molemmissa.
+"""
+
+from django.core.files.storage import default_storage
+from storages.backends.s3 import S3Storage
+
+# Nimet ovat yksilöllisiä (uuid tai sisällön tiiviste), joten sisältö ei muutu
+IMMUTABLE_PREFIXES = ("ai_images/", "uploaded_images/", "materials/", "tts/", "variants/")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class PublicMediaStorage(S3Storage):
+    """
+    Julkinen mediatallennus Spacesiin.
+
+    ACL asetetaan latauksen yhteydessä (default_acl), ja yksilöllisesti
+    nimetyt tiedostot saavat pitkän välimuistiajan. Muut asetukset
+    (bucket, endpoint, AWS_LOCATION, AWS_S3_OBJECT_PARAMETERS) tulevat
+    settings.py:stä.
+    """
+
+    default_acl = "public-read"
+    querystring_auth = False
+
+    def get_object_parameters(self, name):
+        """
+        Palauttaa latauksen parametrit (mm. Cache-Control) tiedostolle.
+
+        Args:
+            name (str): Tiedoston avain (sisältää AWS_LOCATION-etuliitteen).
+
+        Returns:
+            dict: upload_fileobj-kutsun ExtraArgs (ACL lisätään erikseen).
+        """
+        params = super().get_object_parameters(name)
+        location = (self.location or "").strip("/")
+        relative = name[len(location) + 1:] if location and name.startswith(location + "/") else name
+        if relative.startswith(IMMUTABLE_PREFIXES):
+            params["CacheControl"] = IMMUTABLE_CACHE_CONTROL
+        return params
+
+
+def save_public(name: str, content) -> tuple[str, str]:
+    """
+    Tallentaa tiedoston julkisesti saatavaksi ja palauttaa sen pysyvän osoitteen.
+
+    Args:
+        name (str): Tavoitepolku, esim. "ai_images/<uuid>.png".
+        content: Tallennettava tiedosto (File/ContentFile).
+
+    Returns:
+        tuple[str, str]: Tallennettu nimi ja julkinen URL.
+    """
+    saved = default_storage.save(name, content)
+    return saved, default_storage.url(saved)
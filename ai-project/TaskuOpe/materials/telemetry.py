@@ -0,0 +1,250 @@
+# materials/telemetry.py
+"""OpenAI-kutsujen telemetria (LLMCallLog).
+
+Jokaisesta ai_service-moduulin kautta tehdystä kutsusta kirjataan ominaisuus
+(feature), malli, tokenit, kesto, tila, välimuistiosuma, arvioitu hinta ja
+käyttäjä. Rivit puskuroidaan muistiin ja tallennetaan bulk_create-kutsulla,
+kun puskurissa on LLM_LOG_BATCH riviä tai vanhin rivi on LLM_LOG_FLUSH_SECONDS
+vanha. Web-prosessissa tallennus tehdään request_finished-signaalissa, eli
+vasta kun vastaus on lähetetty, joten kirjaus ei lisää pyynnön viivettä;
+worker tallentaa töiden välissä (flush_due).
+
+Ominaisuus ja käyttäjä voidaan antaa kutsussa tai ympäröivällä context()-
+lohkolla (esim. taustatyö asettaa työn tyypin ja luojan).
+"""
+
+import atexit
+import contextvars
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Iterator, List, Optional
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import LLMCallLog
+
+# USD / 1M tokenia (input, output); puhe USD / 1M merkkiä, kuvat USD / kuva
+DEFAULT_PRICES = {
+    "gpt-4o": {"input": 2.50, "output": 10.00},
+    "gpt-4o-mini": {"input": 0.15, "output": 0.60},
+    "tts-1": {"per_million_units": 15.00},
+    "tts-1-hd": {"per_million_units": 30.00},
+    "dall-e-3": {"per_unit": 0.04},
+}
+
+_BUFFER: List[LLMCallLog] = []
+_LOCK = threading.Lock()
+_OLDEST = {"at": 0.0}
+_CONTEXT = contextvars.ContextVar("llm_call_context", default={})
+
+
+def enabled() -> bool:
+    """Palauttaa True, jos kutsut kirjataan (LLM_LOG_ENABLED)."""
+    return bool(getattr(settings, "LLM_LOG_ENABLED", True))
+
+
+@contextmanager
+def context(*, feature: str = "", user_id: Optional[int] = None) -> Iterator[None]:
+    """
+    Asettaa lohkon sisällä tehtävien kutsujen oletusominaisuuden ja -käyttäjän.
+
+    Args:
+        feature (str): Ominaisuuden tunniste, esim. "game".
+        user_id (Optional[int]): Käyttäjän ID.
+    """
+    current = dict(_CONTEXT.get())
+    if feature:
+        current["feature"] = feature
+    if user_id:
+        current["user_id"] = user_id
+    token = _CONTEXT.set(current)
+    try:
+        yield
+    finally:
+        _CONTEXT.reset(token)
+
+
+def estimate_cost(model: str, prompt_tokens: int = 0, completion_tokens: int = 0, units: int = 0) -> float:
+    """
+    Arvioi kutsun hinnan (USD) hintataulukosta (DEFAULT_PRICES + LLM_PRICES).
+
+    Args:
+        model (str): Mallin nimi.
+        prompt_tokens (int): Syötetokenit.
+        completion_tokens (int): Vastaustokenit.
+        units (int): Muut laskutusyksiköt (puheen merkit, kuvien määrä).
+
+    Returns:
+        float: Arvioitu hinta; 0, jos mallia ei ole taulukossa.
+    """
+    prices = {**DEFAULT_PRICES, **(getattr(settings, "LLM_PRICES", {}) or {})}.get(model)
+    if not prices:
+        return 0.0
+    cost = (prompt_tokens * prices.get("input", 0) + completion_tokens * prices.get("output", 0)) / 1_000_000
+    cost += units * prices.get("per_million_units", 0) / 1_000_000
+    cost += units * prices.get("per_unit", 0)
+    return round(cost, 6)
+
+
+def record(*, feature: str = "", model: str = "", prompt_tokens: int = 0, completion_tokens: int = 0,
+           latency_ms: int = 0, status: str = LLMCallLog.Status.OK, error: str = "",
+           cache_hit: bool = False, user_id: Optional[int] = None, units: int = 0) -> None:
+    """
+    Lisää kutsun puskuriin; tallennus tapahtuu erässä (flush).
+
+    Ominaisuus ja käyttäjä otetaan ympäröivästä context()-lohkosta, jos niitä
+    ei anneta.
+    """
+    if not enabled():
+        return
+    ctx = _CONTEXT.get()
+    row = LLMCallLog(
+        feature=(feature or ctx.get("feature") or "other")[:50],
+        model=model[:100],
+        prompt_tokens=prompt_tokens or 0,
+        completion_tokens=completion_tokens or 0,
+        latency_ms=max(int(latency_ms), 0),
+        status=status,
+        error=(error or "")[:200],
+        cache_hit=cache_hit,
+        cost_usd=0.0 if cache_hit else estimate_cost(model, prompt_tokens or 0, completion_tokens or 0, units),
+        user_id=user_id or ctx.get("user_id") or None,
+        created_at=timezone.now(),
+    )
+    batch = int(getattr(settings, "LLM_LOG_BATCH", 50))
+    with _LOCK:
+        if not _BUFFER:
+            _OLDEST["at"] = time.monotonic()
+        _BUFFER.append(row)
+        full = len(_BUFFER) >= batch
+    if full:
+        flush()
+
+
+@contextmanager
+def track(feature: str, model: str, *, user_id: Optional[int] = None) -> Iterator[dict]:
+    """
+    Mittaa lohkon keston ja kirjaa kutsun; poikkeus kirjataan virheenä.
+
+    Lohko voi asettaa palautettuun sanakirjaan "usage" (OpenAI-vastauksen
+    usage), "units" (laskutusyksiköt hinta-arviota varten) tai "model"
+    (esim. varamalli, jos ensisijainen vaihtui).
+    """
+    call: dict = {}
+    started = time.perf_counter()
+    try:
+        yield call
+    except Exception as e:
+        record(feature=feature, model=call.get("model", model), user_id=user_id, status=LLMCallLog.Status.ERROR,
+               error=f"{e.__class__.__name__}: {e}", latency_ms=(time.perf_counter() - started) * 1000)
+        raise
+    usage = call.get("usage")
+    record(
+        feature=feature, model=call.get("model", model), user_id=user_id,
+        prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+        completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        units=call.get("units", 0),
+        latency_ms=(time.perf_counter() - started) * 1000,
+    )
+
+
+def flush() -> int:
+    """
+    Tallentaa puskuroidut rivit yhdellä bulk_create-kutsulla.
+
+    Returns:
+        int: Tallennettujen rivien määrä (0 virheen sattuessa; rivit hylätään).
+    """
+    with _LOCK:
+        rows = _BUFFER[:]
+        _BUFFER.clear()
+    if not rows:
+        return 0
+    try:
+        LLMCallLog.objects.bulk_create(rows, batch_size=500)
+    except Exception as e:
+        print(f"LLM-kutsulokin tallennus epäonnistui ({len(rows)} riviä): {e}")
+        return 0
+    return len(rows)
+
+
+def flush_due() -> int:
+    """
+    Tallentaa puskurin, jos vanhin rivi on vanhempi kuin LLM_LOG_FLUSH_SECONDS.
+
+    Returns:
+        int: Tallennettujen rivien määrä.
+    """
+    with _LOCK:
+        due = bool(_BUFFER) and (
+            time.monotonic() - _OLDEST["at"] >= float(getattr(settings, "LLM_LOG_FLUSH_SECONDS", 5.0))
+        )
+    return flush() if due else 0
+
+
+@receiver(request_finished, dispatch_uid="materials_telemetry_flush")
+def _flush_after_request(sender, **kwargs):
+    flush_due()
+
+
+atexit.register(flush)
+
+
+def _percentile(values: List[int], q: float) -> int:
+    """Palauttaa lähimmän sijan persentiilin (values järjestettynä)."""
+    if not values:
+        return 0
+    return values[max(0, min(len(values), math.ceil(q * len(values))) - 1)]
+
+
+def daily_summary(days: int = 14) -> List[dict]:
+    """
+    Kokoaa kutsut ominaisuuden ja päivän mukaan.
+
+    Persentiilit lasketaan Pythonissa, jotta koonti toimii myös SQLitessä.
+
+    Args:
+        days (int): Montako päivää taaksepäin.
+
+    Returns:
+        List[dict]: day, feature, calls, errors, cache_hits, p50_ms, p95_ms,
+        prompt_tokens, completion_tokens ja cost_usd, uusin päivä ensin.
+    """
+    # Tämän prosessin puskuroidut rivit mukaan koontiin
+    flush()
+    since = timezone.now() - timedelta(days=days)
+    groups = defaultdict(list)
+    rows = (
+        LLMCallLog.objects.filter(created_at__gte=since)
+        .values_list("created_at", "feature", "latency_ms", "status", "cache_hit",
+                     "prompt_tokens", "completion_tokens", "cost_usd")
+        .iterator()
+    )
+    for created_at, *rest in rows:
+        day = timezone.localtime(created_at).date()
+        groups[(day, rest[0])].append(rest[1:])
+    summary = []
+    for (day, feature), items in groups.items():
+        # Välimuistiosumat vääristäisivät viivejakaumaa
+        latencies = sorted(latency for latency, status, hit, *_ in items if not hit)
+        summary.append({
+            "day": day,
+            "feature": feature,
+            "calls": len(items),
+            "errors": sum(1 for _, status, *_ in items if status == LLMCallLog.Status.ERROR),
+            "cache_hits": sum(1 for _, _, hit, *_ in items if hit),
+            "p50_ms": _percentile(latencies, 0.50),
+            "p95_ms": _percentile(latencies, 0.95),
+            "prompt_tokens": sum(item[3] for item in items),
+            "completion_tokens": sum(item[4] for item in items),
+            "cost_usd": round(sum(item[5] for item in items), 4),
+        })
+    summary.sort(key=lambda row: (-row["day"].toordinal(), row["feature"]))
+    return summary
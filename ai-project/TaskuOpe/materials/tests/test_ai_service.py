@@ -0,0 +1,81 @@
+import json
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from materials import ai_models, ai_service
+
+
+def test_openai_client_is_shared_and_configured(settings):
+    settings.OPENAI_API_KEY = "sk-test"
+    settings.OPENAI_BASE_URL = "http://127.0.0.1:9/v1"
+    settings.OPENAI_MAX_RETRIES = 5
+    ai_service.reset_openai_clients()
+    try:
+        client = ai_service.get_openai_client()
+        assert ai_service.get_openai_client() is client
+        assert client.max_retries == 5
+        assert str(client.base_url).startswith("http://127.0.0.1:9/v1")
+    finally:
+        ai_service.reset_openai_clients()
+    assert ai_service.get_openai_client() is not client
+    ai_service.reset_openai_clients()
+
+
+@pytest.mark.django_db
+def test_task_models_override_and_fall_back_on_timeout(settings, monkeypatch):
+    settings.AI_MODELS = {"game_metadata": {"timeout": 5}}
+    monkeypatch.setenv("AI_MODEL_GAME_CONTENT", "gpt-4o-2024-08-06")
+    assert ai_models.get("game_metadata")["model"] == "gpt-4o-mini"
+    assert ai_models.model_for("game_content") == "gpt-4o-2024-08-06"
+    with pytest.raises(KeyError):
+        ai_models.get("tuntematon")
+
+    calls = []
+
+    def create(**kwargs):
+        calls.append((kwargs["model"], kwargs.get("timeout")))
+        if len(calls) == 1:
+            raise openai.APITimeoutError(request=httpx.Request("POST", "http://stub/v1/chat/completions"))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="{}"))])
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    client.with_options = lambda **options: client
+    monkeypatch.setattr(ai_service, "get_openai_client", lambda: client)
+    assert ai_service.chat_completion([{"role": "user", "content": "x"}], task="game_metadata") == "{}"
+    assert calls == [("gpt-4o-mini", 5.0), ("gpt-4o", 5.0)]
+
+
+@pytest.mark.django_db
+def test_primary_model_is_tried_once_before_fallback(settings, monkeypatch):
+    settings.AI_MODELS = {"game_metadata": {"timeout": 5}}
+    calls = []
+
+    def handler(request):
+        model = json.loads(request.content)["model"]
+        calls.append((model, request.extensions["timeout"]["read"]))
+        if model == "gpt-4o-mini" and len(calls) == 1 or model == "gpt-4o" and len(calls) == 3:
+            raise httpx.ReadTimeout("hidas", request=request)
+        if json.loads(request.content).get("stream"):
+            chunk = {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": "virta"}, "finish_reason": None}]}
+            body = f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n"
+            return httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json={
+            "id": "c", "object": "chat.completion", "created": 0, "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "{}"}}],
+        })
+
+    # Oikea asiakas, jolla SDK tekisi muuten kolme uusintayritystä
+    client = openai.OpenAI(api_key="sk-test", base_url="http://stub/v1", max_retries=3,
+                           http_client=httpx.Client(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(ai_service, "get_openai_client", lambda: client)
+    monkeypatch.setattr(ai_service, "_openai_api_key", lambda: "sk-test")
+
+    assert ai_service.chat_completion([{"role": "user", "content": "x"}], task="game_metadata") == "{}"
+    assert calls == [("gpt-4o-mini", 5.0), ("gpt-4o", 5.0)]
+
+    assert "".join(ai_service.stream_llm("kerro")) == "virta"
+    assert [model for model, _ in calls[2:]] == ["gpt-4o", "gpt-4o-mini"]
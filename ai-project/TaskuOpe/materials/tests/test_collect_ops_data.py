@@ -0,0 +1,115 @@
+import hashlib
+import importlib.util
+import json
+import shutil
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+FIXTURES = Path(__file__).parent / "fixtures" / "eperusteet"
+SCRIPT = Path(__file__).resolve().parents[2] / "ops_data" / "collect_ops_data_API_toimiva.py"
+
+
+def _load_collector():
+    spec = importlib.util.spec_from_file_location("collect_ops_data", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class ReplayHandler(SimpleHTTPRequestHandler):
+    """Toistaa tallennetut ePerusteet-vastaukset ETag-tuella (/oppiaineet/101 -> oppiaineet/101.json)."""
+
+    requests_seen = []
+
+    def do_GET(self):
+        path = Path(self.directory) / (self.path.strip("/") + ".json")
+        if not path.is_file():
+            self.send_error(404)
+            return
+        body = path.read_bytes()
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            self.requests_seen.append((self.path, 304))
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.requests_seen.append((self.path, 200))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def eperusteet(tmp_path):
+    root = tmp_path / "server"
+    shutil.copytree(FIXTURES, root)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(ReplayHandler, directory=str(root)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    ReplayHandler.requests_seen = []
+    yield root, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_incremental_collect_with_http_cache(eperusteet, tmp_path):
+    root, base_url = eperusteet
+    collector = _load_collector()
+    output = tmp_path / "ops.json"
+    args = ["--base-url", base_url, "--output", str(output),
+            "--cache-dir", str(tmp_path / "cache"), "--incremental", "--workers", "4"]
+
+    first = collector.main(args)
+    rows = json.loads(output.read_text(encoding="utf-8"))
+    assert first["rows"] == len(rows) == 5
+    assert {r["subject"] for r in rows} == {"Matematiikka", "Musiikki"}
+    assert {r["grade_context"] for r in rows} == {"1-2", "3-6"}
+    assert sorted(first["changed_subjects"]) == ["Matematiikka", "Musiikki"]
+
+    # Toinen ajo: kaikki vastaukset 304, ei muuttuneita oppiaineita eikä diffiä
+    ReplayHandler.requests_seen = []
+    second = collector.main(args + ["--diff", str(tmp_path / "diff.json")])
+    assert {status for _, status in ReplayHandler.requests_seen} == {304}
+    assert second["changed_subjects"] == [] and second["added"] == second["removed"] == []
+    assert json.loads(output.read_text(encoding="utf-8")) == rows
+
+    # Muutettu oppiaine käsitellään uudelleen ja muutos näkyy diffissä
+    detail = root / "oppiaineet" / "102.json"
+    data = json.loads(detail.read_text(encoding="utf-8"))
+    data["vuosiluokkakokonaisuudet"][0]["tavoitteet"] = [{"tavoite": {"fi": "T2 rohkaista oppilasta soittamaan"}}]
+    detail.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    third = collector.main(args + ["--diff", str(tmp_path / "diff.json")])
+    assert third["changed_subjects"] == ["Musiikki"]
+    assert [r["content"] for r in third["added"]] == ["T2 rohkaista oppilasta soittamaan"]
+    assert [r["content"] for r in third["removed"]] == ["T1 ohjata oppilasta laulamaan yhdessä muiden kanssa"]
+    assert json.loads((tmp_path / "diff.json").read_text(encoding="utf-8"))["changed_subjects"] == ["Musiikki"]
+
+
+def test_incremental_state_is_per_output_with_shared_cache(eperusteet, tmp_path):
+    root, base_url = eperusteet
+    collector = _load_collector()
+    common = ["--base-url", base_url, "--cache-dir", str(tmp_path / "cache"), "--incremental"]
+    first = ["--output", str(tmp_path / "a.json")] + common
+    second = ["--output", str(tmp_path / "b.json")] + common
+    collector.main(first)
+
+    detail = root / "oppiaineet" / "102.json"
+    data = json.loads(detail.read_text(encoding="utf-8"))
+    data["vuosiluokkakokonaisuudet"][0]["tavoitteet"] = [{"tavoite": {"fi": "T2 rohkaista oppilasta soittamaan"}}]
+    detail.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+    # Toinen tulostiedosto päivittää jaetun välimuistin ensin
+    collector.main(second)
+    result = collector.main(first)
+    assert result["changed_subjects"] == ["Musiikki"]
+    assert [r["content"] for r in result["added"]] == ["T2 rohkaista oppilasta soittamaan"]
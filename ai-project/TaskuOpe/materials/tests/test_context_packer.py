@@ -0,0 +1,50 @@
+import pytest
+
+from materials import ai_service, context_packer
+from materials.context_packer import estimate_tokens, pack_context
+
+
+def _prompt(question, context):
+    return f"OHJE: käytä kontekstia.\n{context}\nPYYNTÖ: {question}"
+
+
+def _chunk(i, text, score):
+    return {"id": f"ops-{i}", "text": text, "subject": "Matematiikka",
+            "grade_context": "3-6", "content_type": "Tavoite", "score": score}
+
+
+def test_pack_keeps_question_dedupes_and_respects_budget(monkeypatch):
+    monkeypatch.setattr(context_packer, "_encoding", lambda: None)
+    long_text = "murtoluvut ja desimaaliluvut lukusuoralla " * 40
+    chunks = [
+        _chunk(0, "T1 ohjata oppilasta harjoittelemaan yhteenlaskua ja vähennyslaskua", 1.0),
+        _chunk(1, "T1 ohjata oppilasta harjoittelemaan yhteenlaskua ja vähennyslaskua.", 0.9),
+        _chunk(2, long_text, 2.0),
+        _chunk(3, "T4 kannustaa oppilasta esittämään ratkaisujaan", 0.5),
+    ]
+    question = "Tee tehtävä murtoluvuista " * 5
+    packed = pack_context(question, chunks, _prompt, max_tokens=150)
+
+    assert packed["prompt"].endswith(f"PYYNTÖ: {question}")
+    assert [c["id"] for c in packed["used_chunks"]] == ["ops-0", "ops-3"]
+    assert packed["dropped"] == 2
+    assert packed["tokens"]["prompt"] == estimate_tokens(packed["prompt"]) <= 150
+
+
+def test_question_kept_even_when_over_budget():
+    packed = pack_context("pitkä pyyntö " * 100, [_chunk(0, "teksti", 1.0)], _prompt, max_tokens=10)
+    assert packed["used_chunks"] == []
+    assert "pitkä pyyntö" in packed["prompt"]
+
+
+def test_given_chunks_result_shape_and_max_chars_alias(monkeypatch):
+    monkeypatch.setattr(ai_service, "ask_llm", lambda prompt, user_id=0: "vastaus")
+    monkeypatch.setattr(context_packer, "_encoding", lambda: None)
+    empty = ai_service.ask_llm_with_given_chunks("kysymys", [])
+    assert empty == {"answer": "vastaus", "used_chunks": [], "tokens": {}}
+
+    chunks = [_chunk(i, f"tavoite {i} " + "sana " * 60, 1.0 - i / 10) for i in range(5)]
+    with pytest.deprecated_call():
+        old = ai_service.ask_llm_with_given_chunks("kysymys", chunks, max_chars=1400)
+    new = ai_service.ask_llm_with_given_chunks("kysymys", chunks, max_tokens=400)
+    assert old["used_chunks"] == new["used_chunks"] and 0 < len(new["used_chunks"]) < 5
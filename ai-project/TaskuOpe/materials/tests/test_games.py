@@ -0,0 +1,72 @@
+import json
+import time
+
+import pytest
+from django.urls import reverse
+
+from materials import llm_cache
+from materials.views import api
+from users.models import CustomUser
+
+
+@pytest.fixture
+def slow_generators(monkeypatch):
+    def content(topic, game_type, difficulty="medium"):
+        time.sleep(0.3)
+        return {"levels": [topic], "difficulty": difficulty}
+
+    def metadata(game_name, topic):
+        time.sleep(0.3)
+        if topic == "rikki":
+            raise RuntimeError("metadata epäonnistui")
+        return {"title": "Avaruusvisa", "subject": "Fysiikka"}
+
+    monkeypatch.setattr(api, "generate_game_content", content)
+    monkeypatch.setattr(api, "generate_game_metadata", metadata)
+
+
+def test_content_and_metadata_run_concurrently(slow_generators):
+    started = time.monotonic()
+    game = api.generate_game("Avaruus", "quiz", "easy")
+    assert time.monotonic() - started < 0.55
+    assert game == {"game_data": {"levels": ["Avaruus"], "difficulty": "easy"},
+                    "metadata": {"title": "Avaruusvisa", "subject": "Fysiikka"}}
+
+    # Metadatan virhe -> oletusmetadata, sisältö säilyy
+    game = api.generate_game("rikki", "quiz")
+    assert game["metadata"]["subject"] == "Ympäristöoppi" and game["game_data"]["levels"] == ["rikki"]
+
+
+def test_failed_metadata_falls_back_to_game_type_and_topic(monkeypatch):
+    monkeypatch.setattr(api, "generate_game_content", lambda topic, game_type, difficulty="medium": {"levels": []})
+    seen = []
+
+    def metadata(game_name, topic):
+        seen.append((game_name, topic))
+        raise RuntimeError("metadata epäonnistui")
+
+    monkeypatch.setattr(api, "generate_game_metadata", metadata)
+    game = api.generate_game("Avaruus ja planeetat", "quiz")
+    assert seen == [("quiz", "Avaruus ja planeetat")]
+    assert game["metadata"] == {"title": "Quiz: Avaruus ja planeetat", "subject": "Ympäristöoppi"}
+
+
+@pytest.mark.django_db
+def test_repeated_game_request_is_served_from_cache(slow_generators, client, settings):
+    settings.JOBS_EAGER = True
+    llm_cache.clear()
+    teacher = CustomUser.objects.create_user(username="ope", password="x", role="TEACHER")
+    client.force_login(teacher)
+    url = reverse("generate_game_ajax")
+
+    first = client.post(url, {"topic": "Avaruus", "game_type": "quiz"}, content_type="application/json")
+    assert first.status_code == 202 and first.json()["job"]["status"] == "DONE"
+
+    started = time.monotonic()
+    body = {"topic": "  avaruus ", "game_type": "quiz", "difficulty": "medium"}
+    again = client.post(url, body, content_type="application/json")
+    assert time.monotonic() - started < 0.25
+    data = again.json()
+    assert again.status_code == 200 and data["cached"]
+    assert data["job"]["result"] == first.json()["job"]["result"]
+    assert json.loads(llm_cache._model().objects.get(model="game").response)["metadata"]["subject"] == "Fysiikka"
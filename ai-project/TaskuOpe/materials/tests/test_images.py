@@ -0,0 +1,59 @@
+import io
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.urls import reverse
+from PIL import Image
+
+from materials.models import ImageVariant
+from materials.views.shared import render_material_content_to_html
+from users.models import CustomUser
+
+
+def _png(width, height) -> bytes:
+    buf = io.BytesIO()
+    Image.linear_gradient("L").resize((width, height)).convert("RGB").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def media(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    settings.JOBS_EAGER = True
+    return tmp_path
+
+
+@pytest.mark.django_db
+def test_saved_image_gets_webp_variants_and_srcset(client, media):
+    teacher = CustomUser.objects.create_user(username="ope", password="x", role="TEACHER")
+    client.force_login(teacher)
+    upload = SimpleUploadedFile("kuva.png", _png(1792, 1024), content_type="image/png")
+    url = client.post(reverse("generate_image"), {"image_upload": upload}).json()["image_url"]
+
+    name = url[len("/media/"):]
+    variants = list(ImageVariant.objects.filter(source=name).order_by("width"))
+    assert [(v.format, v.width, v.height) for v in variants] == [
+        ("webp", 480, 274), ("webp", 960, 549), ("webp", 1440, 823)]
+    assert all(default_storage.exists(v.name) for v in variants)
+
+    html = render_material_content_to_html(f"![Kuva]({url}#size-sm-align-left)")
+    assert url not in html
+    assert f'srcset="/media/{variants[0].name} 480w, /media/{variants[1].name} 960w' in html
+    assert 'sizes="(max-width: 767px) 100vw, 30vw"' in html
+    assert 'loading="lazy" decoding="async"' in html and "align-left" in html
+
+
+@pytest.mark.django_db
+def test_backfill_command_and_external_images(media):
+    default_storage.save("ai_images/vanha.png", ContentFile(_png(600, 400)))
+    call_command("build_image_variants", stdout=io.StringIO())
+    assert list(ImageVariant.objects.values_list("width", flat=True)) == [480]
+    out = io.StringIO()
+    call_command("build_image_variants", stdout=out)
+    assert "ohitettu 1" in out.getvalue()
+
+    html = render_material_content_to_html("![Ulkoinen](https://example.com/a.png)")
+    assert 'src="https://example.com/a.png"' in html and 'loading="lazy"' in html and "srcset" not in html
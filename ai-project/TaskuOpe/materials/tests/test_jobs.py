@@ -0,0 +1,133 @@
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+
+from materials import jobs
+from materials.models import BackgroundJob
+from users.models import CustomUser
+
+
+@pytest.fixture
+def echo_job():
+    @jobs.register("test_echo")
+    def echo(payload):
+        if payload.get("fail"):
+            raise RuntimeError("rikki")
+        return {"echo": payload["value"]}
+
+    yield
+    jobs._HANDLERS.pop("test_echo", None)
+
+
+@pytest.mark.django_db
+def test_worker_runs_queued_jobs_and_status_endpoint(echo_job, client):
+    teacher = CustomUser.objects.create_user(username="ope", password="x", role="TEACHER")
+    ok = jobs.enqueue("test_echo", {"value": 1}, user=teacher, ref="x:1")
+    assert jobs.enqueue("test_echo", {"value": 2}, user=teacher, ref="x:1").pk == ok.pk
+    bad = jobs.enqueue("test_echo", {"fail": True}, user=teacher)
+    assert ok.status == BackgroundJob.Status.QUEUED
+
+    client.force_login(teacher)
+    assert client.get(reverse("job_result", args=[ok.pk])).status_code == 202
+
+    call_command("run_jobs", "--once", "--concurrency", "1")
+    ok.refresh_from_db()
+    bad.refresh_from_db()
+    assert (ok.status, ok.result, ok.attempts) == ("DONE", {"echo": 1}, 1)
+    assert (bad.status, bad.error) == ("FAILED", "rikki")
+
+    data = client.get(reverse("job_status", args=[ok.pk])).json()
+    assert data["finished"] and data["result"] == {"echo": 1}
+    assert client.get(reverse("job_result", args=[bad.pk])).status_code == 500
+
+    other = CustomUser.objects.create_user(username="toinen", password="x", role="TEACHER")
+    client.force_login(other)
+    assert client.get(reverse("job_status", args=[ok.pk])).status_code == 403
+
+
+@pytest.mark.django_db
+def test_eager_mode_and_stale_requeue(echo_job, settings):
+    settings.JOBS_EAGER = True
+    assert jobs.enqueue("test_echo", {"value": 3}).result == {"echo": 3}
+
+    settings.JOBS_EAGER = False
+    job = jobs.enqueue("test_echo", {"value": 4})
+    assert jobs.claim_next("w1").pk == job.pk
+    assert jobs.claim_next("w2") is None
+    settings.JOBS_STALE_SECONDS = -1
+    assert jobs.requeue_stale() == 1
+    job.refresh_from_db()
+    assert job.status == BackgroundJob.Status.QUEUED
+    with pytest.raises(ValueError):
+        jobs.enqueue("tuntematon")
+
+
+@pytest.mark.django_db
+def test_requeued_job_result_is_not_overwritten_by_old_worker(settings):
+    from datetime import timedelta
+
+    from django.utils import timezone
+
+    runs = []
+
+    @jobs.register("test_slow")
+    def slow(payload):
+        runs.append(1)
+        if len(runs) == 1:
+            # Hidas ajo: työ palautetaan jonoon ja toinen worker ajaa sen loppuun ensin
+            settings.JOBS_STALE_SECONDS = -1
+            assert jobs.requeue_stale() == 1
+            jobs.run_job(jobs.claim_next("w2"))
+        return {"runs": len(runs)}
+
+    try:
+        job = jobs.enqueue("test_slow")
+        jobs.run_job(jobs.claim_next("w1"))
+    finally:
+        jobs._HANDLERS.pop("test_slow", None)
+    job.refresh_from_db()
+    assert (job.status, job.worker, job.result) == ("DONE", "w2", {"runs": 2})
+
+    # Tuore elonmerkki pitää vanhankin käynnissä olevan työn workerillaan
+    settings.JOBS_STALE_SECONDS = 300
+    old = timezone.now() - timedelta(hours=1)
+    BackgroundJob.objects.filter(pk=job.pk).update(status="RUNNING", started_at=old, heartbeat_at=timezone.now())
+    assert jobs.requeue_stale() == 0
+    BackgroundJob.objects.filter(pk=job.pk).update(heartbeat_at=old)
+    assert jobs.requeue_stale() == 1
+
+
+@pytest.mark.django_db
+def test_create_material_ai_action_returns_job(client, settings, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    teacher = CustomUser.objects.create_user(username="ope", password="x", role="TEACHER")
+    client.force_login(teacher)
+    body = {"action": "ai", "ai_prompt": "Murtoluvut"}
+
+    resp = client.post(reverse("create_material"), body)
+    job = BackgroundJob.objects.get(kind="material_draft")
+    assert job.payload["prompt"] == "Murtoluvut"
+    assert reverse("job_status", args=[job.pk]) in resp.content.decode()
+
+    settings.JOBS_EAGER = True
+    resp = client.post(reverse("create_material"), body)
+    assert "[DEMO]" in resp.content.decode()
+
+
+@pytest.mark.django_db
+def test_create_material_stream_sends_sse_and_persists(client, monkeypatch):
+    from materials.views import teacher
+
+    monkeypatch.setattr(teacher, "stream_llm", lambda prompt, user_id=0: iter(["Hei ", "maailma"]))
+    user = CustomUser.objects.create_user(username="ope", password="x", role="TEACHER")
+    client.force_login(user)
+    resp = client.post(reverse("create_material_stream"), {"ai_prompt": "Tervehdys"})
+    assert resp["Content-Type"] == "text/event-stream"
+    body = b"".join(resp.streaming_content).decode()
+    assert 'data: {"delta": "Hei "}' in body
+    assert "event: done" in body
+
+    job = BackgroundJob.objects.get(kind="material_draft")
+    assert job.status == BackgroundJob.Status.DONE
+    assert job.result["answer"].startswith("Otsikkoehdotus: Luonnos")
+    assert "Hei maailma" in job.result["answer"]
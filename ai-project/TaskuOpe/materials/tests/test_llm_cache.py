@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+
+from materials import ai_service, llm_cache, telemetry
+from materials.models import AIGrade, Assignment, LLMCacheEntry, Material, Submission
+from users.models import CustomUser
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        message = SimpleNamespace(content=f"vastaus {self.calls}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    completions = FakeCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    monkeypatch.setattr(ai_service, "get_openai_client", lambda: client)
+    llm_cache.clear()
+    return completions
+
+
+@pytest.mark.django_db
+def test_deterministic_calls_hit_cache(fake_openai):
+    messages = [{"role": "user", "content": "Arvioi vastaus"}]
+    first = ai_service.chat_completion(messages, temperature=0)
+    assert ai_service.chat_completion(messages, temperature=0) == first
+    assert fake_openai.calls == 1
+
+    # Eri parametrit -> eri avain; lämpötila 0.7 ohittaa oletuksena
+    ai_service.chat_completion(messages, temperature=0, response_format={"type": "json_object"})
+    ai_service.chat_completion(messages, temperature=0.7)
+    ai_service.chat_completion(messages, temperature=0.7)
+    assert fake_openai.calls == 4
+
+    # cache=False hakee uuden vastauksen ja päivittää rivin
+    fresh = ai_service.chat_completion(messages, temperature=0, cache=False)
+    assert fresh != first
+    assert ai_service.chat_completion(messages, temperature=0) == fresh
+
+    stats = llm_cache.cache_stats()
+    assert (stats["hits"], stats["bypassed"], stats["entries"]) == (2, 3, 2)
+
+
+@pytest.mark.django_db
+def test_prune_evicts_expired_and_least_recently_used(settings):
+    llm_cache.clear()
+    settings.LLM_CACHE_MAX_ENTRIES = 2
+    for n in range(3):
+        llm_cache.put(f"k{n}", "gpt-4o", "x" * 10)
+    assert llm_cache.get("k0") is not None  # k0 on nyt tuorein
+    assert llm_cache.prune() == 1
+    assert set(LLMCacheEntry.objects.values_list("key", flat=True)) == {"k0", "k2"}
+
+    settings.LLM_CACHE_MAX_BYTES = 15
+    assert llm_cache.prune() == 1
+    assert llm_cache.get("k2") is None
+
+
+@pytest.mark.django_db
+def test_new_grade_request_skips_cached_suggestion(fake_openai, client, settings, monkeypatch):
+    settings.JOBS_EAGER = True
+    monkeypatch.setattr(ai_service, "_openai_api_key", lambda: "sk-test")
+    openai_client = ai_service.get_openai_client()
+    openai_client.with_options = lambda **options: openai_client
+    teacher = CustomUser.objects.create_user(username="ope", password="x", role="TEACHER")
+    student = CustomUser.objects.create_user(username="oppilas", password="x", role="STUDENT")
+    material = Material.objects.create(title="Essee", content="Kirjoita essee", author=teacher)
+    assignment = Assignment.objects.create(material=material, student=student, assigned_by=teacher,
+                                           due_at=timezone.now())
+    submission = Submission.objects.create(assignment=assignment, student=student, response="Vastaukseni")
+
+    client.force_login(teacher)
+    url = reverse("grade_submission", args=[submission.pk])
+    client.post(url, {"run_ai_grade": "1"})
+    assert fake_openai.calls == 1 and AIGrade.objects.filter(submission=submission).exists()
+    # Opettaja pyytää uutta ehdotusta -> mallilta, ei välimuistista
+    client.post(url, {"run_ai_grade": "1"})
+    assert fake_openai.calls == 2
+    telemetry._BUFFER.clear()
@@ -0,0 +1,55 @@
+import threading
+
+import openai
+import pytest
+
+from materials import ai_service, openai_stub, ratelimit
+from materials.views.api import generate_game_content
+
+
+@pytest.fixture
+def stub(settings, db):
+    config = openai_stub.StubConfig(seed=1)
+    server = openai_stub.make_server("127.0.0.1", 0, config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    settings.OPENAI_STUB = True
+    settings.OPENAI_STUB_URL = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    settings.LLM_CACHE_ENABLED = False
+    ai_service.reset_openai_clients()
+    yield config
+    ai_service.reset_openai_clients()
+    ratelimit._COOLDOWN.update(until=0.0, checked=0.0)
+    server.shutdown()
+    server.server_close()
+
+
+def test_stub_serves_app_shaped_payloads(stub, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    quiz = generate_game_content("Avaruus", "quiz", "easy")
+    assert len(quiz["levels"]) == 5 and quiz["difficulty"] == "easy"
+    assert len(generate_game_content("Eläimet", "memory")["pairs"]) == 10
+
+    draft = "".join(ai_service.stream_llm("Murtoluvut"))
+    assert draft.startswith("Otsikkoehdotus:")
+    assert ai_service.generate_speech("Hei kaikki")[:2] == b"\xff\xfb"
+    assert ai_service.generate_image_bytes("kissa")[:4] == b"\x89PNG"
+    assert stub.stats["/v1/chat/completions"] == 3
+
+
+def test_stub_injects_errors(stub, settings):
+    settings.OPENAI_MAX_RETRIES = 0
+    ai_service.reset_openai_clients()
+    stub.error_rate, stub.error_codes = 1.0, [429]
+    with pytest.raises(openai.RateLimitError):
+        ai_service.chat_completion([{"role": "user", "content": "x"}])
+    assert stub.stats["error_429"] == 1
+    # 429 tallentuu yhteiseksi tauoksi (Retry-After: 1)
+    assert 0 < ratelimit.upstream_cooldown() <= 1
+
+
+def test_parse_latency():
+    rng = openai_stub.random.Random(0)
+    assert openai_stub.parse_latency("fixed:0.25")(rng) == 0.25
+    assert 0.1 <= openai_stub.parse_latency("uniform:0.1,0.2")(rng) <= 0.2
+    with pytest.raises(ValueError):
+        openai_stub.parse_latency("poisson:1")
@@ -0,0 +1,28 @@
+import pytest
+
+from TaskuOpe.ops_analyzer import Analyzer, FinnishAnalyzer, get_analyzer, stem_fi
+
+
+def test_inflections_share_a_stem():
+    assert {stem_fi(w) for w in ("murtoluvut", "murtolukujen", "murtoluvuilla", "murtoluku")} == {"murtoluk"}
+    assert stem_fi("arvioinnin") == stem_fi("arviointia")
+    assert stem_fi("kirja") == stem_fi("kirjan")
+
+
+def test_stopwords_and_compounds():
+    analyzer = FinnishAnalyzer()
+    assert analyzer.analyze("oppilas ja opettaja") == [stem_fi("oppilas"), stem_fi("opettaja")]
+    lexicon = {stem_fi("ilmaisu"), stem_fi("taidot")}
+    assert analyzer.analyze("ilmaisutaitojen", lexicon) == [
+        stem_fi("ilmaisutaitojen"), stem_fi("ilmaisu"), stem_fi("taidot"),
+    ]
+
+
+def test_analyzer_selected_by_setting(settings):
+    settings.OPS_ANALYZER = "simple"
+    assert get_analyzer().analyze("Murtoluvut ja") == ["murtoluvut", "ja"]
+
+
+def test_base_analyzer_is_abstract():
+    with pytest.raises(TypeError):
+        Analyzer()
@@ -0,0 +1,166 @@
+import json
+
+import pytest
+from django.test import Client
+from django.urls import reverse
+
+from TaskuOpe import ops_chunks
+
+
+ROWS = [
+    {"subject": "Matematiikka", "grade_context": "1-2", "content_type": "Tavoite",
+     "content": "T1 ohjata oppilasta harjoittelemaan yhteenlaskua ja vähennyslaskua"},
+    {"subject": "Matematiikka", "grade_context": "3-6", "content_type": "Keskeinen sisältö",
+     "content": "Murtoluvut ja desimaaliluvut: murtoluvut lukusuoralla"},
+    {"subject": "Historia", "grade_context": "3-6", "content_type": "Tavoite",
+     "content": "T2 johdattaa oppilasta tunnistamaan erilaisia historian lähteitä"},
+    {"subject": "Musiikki", "grade_context": "1-2", "content_type": "Arviointi",
+     "content": "Laulaminen"},
+]
+
+
+@pytest.fixture
+def ops_data(tmp_path, settings):
+    (tmp_path / "ops_data").mkdir()
+    path = tmp_path / "ops_data" / ops_chunks.JSON_FILENAME
+    path.write_text(json.dumps(ROWS, ensure_ascii=False), encoding="utf-8")
+    settings.BASE_DIR = tmp_path
+    ops_chunks._load_data(force=True)
+    return path
+
+
+def test_bm25_ranks_matching_rows_first(ops_data):
+    results = ops_chunks.retrieve_chunks("murtoluvut lukusuoralla", k=3)
+    assert [r["id"] for r in results] == ["ops-1"]
+    assert results[0]["score"] > 0
+
+
+def test_facet_filter_and_min_score(ops_data):
+    results = ops_chunks.retrieve_chunks("oppilasta", k=5, subjects=["historia"])
+    assert [r["id"] for r in results] == ["ops-2"]
+    assert ops_chunks.retrieve_chunks("oppilasta", k=5, min_score=100.0) == []
+
+
+def test_empty_query_returns_shortest_rows(ops_data):
+    results = ops_chunks.retrieve_chunks("", k=2, grades=["1-2"])
+    assert [r["id"] for r in results] == ["ops-3", "ops-0"]
+    assert "score" not in results[0]
+
+
+def test_length_order_counts_characters_not_bytes():
+    # 9 merkkiä mutta 13 tavua vs. 12 merkkiä ja 12 tavua
+    raw = [{"content": "abcdefghijkl"}, {"content": "äiti äänä"}]
+    _, arrays, _ = ops_chunks.build_index(raw, "testi")
+    assert list(arrays["by_length"]) == [1, 0]
+
+
+def test_facet_counts(ops_data):
+    facets = ops_chunks.get_facets()
+    assert facets["subjects"] == ["Historia", "Matematiikka", "Musiikki"]
+    assert facets["counts"]["subjects"] == {"Matematiikka": 2, "Historia": 1, "Musiikki": 1}
+    narrowed = ops_chunks.get_facets(subjects=["Matematiikka"])
+    assert narrowed["counts"]["grades"] == {"1-2": 1, "3-6": 1}
+    assert narrowed["counts"]["content_types"]["Arviointi"] == 0
+
+
+def test_unknown_facet_value_returns_nothing(ops_data):
+    assert ops_chunks.retrieve_chunks("oppilasta", subjects=["Kemia"]) == []
+
+
+def test_prebuilt_index_is_memory_mapped(ops_data):
+    expected = ops_chunks.retrieve_chunks("oppilasta murtoluvut", k=4)
+    meta = ops_chunks.write_index()
+    ops_chunks._load_data(force=True)
+    assert ops_chunks.index_version() == meta["version"]
+    assert isinstance(ops_chunks._INDEX.post_doc, ops_chunks.np.memmap)
+    assert ops_chunks.retrieve_chunks("oppilasta murtoluvut", k=4) == expected
+
+    # Muuttunut lähdedata -> vanha indeksi hylätään ja rakennetaan muistiin
+    ops_data.write_text(json.dumps(ROWS[:2], ensure_ascii=False), encoding="utf-8")
+    ops_chunks._load_data(force=True)
+    assert ops_chunks.index_version() != meta["version"]
+    assert ops_chunks.get_facets()["subjects"] == ["Matematiikka"]
+
+
+def test_inflected_query_matches(ops_data):
+    results = ops_chunks.retrieve_chunks("murtolukujen", k=3)
+    assert [r["id"] for r in results] == ["ops-1"]
+
+
+def test_vector_and_hybrid_modes(ops_data):
+    vector = ops_chunks.retrieve_chunks("murtolukujen lukusuora", k=2, mode="vector")
+    assert vector[0]["id"] == "ops-1"
+    assert 0 < vector[0]["score"] <= 1.0
+    hybrid = ops_chunks.retrieve_chunks("historian lähteet", k=2, mode="hybrid", grades=["3-6"])
+    assert hybrid[0]["id"] == "ops-2"
+    assert {r["grade_context"] for r in hybrid} == {"3-6"}
+    with pytest.raises(ValueError):
+        ops_chunks.retrieve_chunks("luvut", mode="semantic")
+
+
+def test_result_cache_hits_and_returns_copies(ops_data):
+    ops_chunks.clear_cache()
+    first = ops_chunks.retrieve_chunks("Murtoluvut", k=3, subjects=["Matematiikka"])
+    first[0]["text"] = "muutettu"
+    second = ops_chunks.retrieve_chunks("murtoluvut!", k=3, subjects=["matematiikka "])
+    assert second[0]["text"] != "muutettu"
+    stats = ops_chunks.cache_stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 1)
+    assert ops_chunks.retrieve_chunks("ja", k=2) == []
+    assert len(ops_chunks.retrieve_chunks("", k=2)) == 2
+
+
+def test_result_cache_invalidated_on_new_index(ops_data):
+    ops_chunks.retrieve_chunks("murtoluvut", k=3)
+    ops_data.write_text(json.dumps(ROWS[2:], ensure_ascii=False), encoding="utf-8")
+    ops_chunks._load_data(force=True)
+    assert ops_chunks.cache_stats()["size"] == 0
+    assert ops_chunks.retrieve_chunks("murtoluvut", k=3) == []
+
+
+def test_batch_search_endpoint(ops_data, client, settings):
+    settings.OPS_MAX_K = 2
+    body = {
+        "queries": [
+            {"q": "oppilasta", "k": 100, "limit": 1},
+            {"q": "oppilasta", "k": 100, "limit": 1, "offset": 1},
+            {"q": "", "grade": "1-2"},
+        ],
+        "snippet": True,
+    }
+    resp = client.post(reverse("ops_search_batch"), json.dumps(body), content_type="application/json")
+    assert resp.status_code == 200
+    first, second, empty = resp.json()["results"]
+    assert first["has_more"] and not second["has_more"]
+    assert [r["id"] for r in first["results"] + second["results"]] == ["ops-0", "ops-2"]
+    assert "snippet" in first["results"][0] and "text" not in first["results"][0]
+    assert [r["id"] for r in empty["results"]] == ["ops-3", "ops-0"]
+    assert first["took_ms"] >= 0
+
+    # Sivu ei voi olla k:ta suurempi
+    resp = client.post(reverse("ops_search_batch"), json.dumps({"queries": [{"q": "oppilasta", "k": 1, "limit": 5}]}),
+                       content_type="application/json")
+    (capped,) = resp.json()["results"]
+    assert capped["limit"] == 1 and len(capped["results"]) == 1
+
+    resp = client.get(reverse("ops_search"), {"q": "oppilasta", "k": 100})
+    assert len(resp.json()["results"]) == 2
+    resp = client.post(reverse("ops_search_batch"), json.dumps({"queries": [{"mode": "x"}]}),
+                       content_type="application/json")
+    assert resp.status_code == 400
+    for bad in ({"q": "luku", "mode": 5}, {"min_score": [1]}, {"min_score": {"a": 1}}, {"min_score": "x"}):
+        resp = client.post(reverse("ops_search_batch"), json.dumps({"queries": [bad]}),
+                           content_type="application/json")
+        assert resp.status_code == 400, bad
+
+
+def test_batch_search_needs_no_csrf_token(ops_data):
+    client = Client(enforce_csrf_checks=True)
+    resp = client.post(reverse("ops_search_batch"), json.dumps({"queries": [{"q": "oppilasta"}]}),
+                       content_type="application/json")
+    assert resp.status_code == 200 and resp.json()["results"][0]["results"]
+
+
+def test_make_snippet():
+    assert ops_chunks.make_snippet("lyhyt teksti", 50) == "lyhyt teksti"
+    assert ops_chunks.make_snippet("yksi kaksi kolme neljä", 12) == "yksi kaksi…"
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+from django.core.management import call_command
+
+from materials.models import OpsChunk
+from TaskuOpe import ops_chunks, ops_db
+
+ROWS = [
+    {"subject": "Matematiikka", "grade_context": "1-2", "content_type": "Tavoite",
+     "content": "T1 ohjata oppilasta harjoittelemaan yhteenlaskua ja vähennyslaskua"},
+    {"subject": "Matematiikka", "grade_context": "3-6", "content_type": "Keskeinen sisältö",
+     "content": "Murtoluvut ja desimaaliluvut: murtolukujen vertailu lukusuoralla"},
+    {"subject": "Historia", "grade_context": "3-6", "content_type": "Tavoite",
+     "content": "T2 johdattaa oppilasta tunnistamaan erilaisia historian lähteitä"},
+]
+
+
+@pytest.fixture
+def db_backend(tmp_path, settings, db):
+    path = tmp_path / "ops.json"
+    path.write_text(json.dumps(ROWS, ensure_ascii=False), encoding="utf-8")
+    call_command("load_ops_chunks", file=str(path))
+    settings.OPS_SEARCH_BACKEND = "db"
+    return path
+
+
+def test_load_command_replaces_source_rows(db_backend):
+    call_command("load_ops_chunks", file=str(db_backend))
+    assert OpsChunk.objects.count() == 3
+    assert set(OpsChunk.objects.values_list("external_id", flat=True)) == {"ops-0", "ops-1", "ops-2"}
+
+
+def test_fts_search_through_retrieve_chunks(db_backend):
+    results = ops_chunks.retrieve_chunks("murtoluvut", k=5)
+    assert [r["id"] for r in results] == ["ops-1"]
+    assert results[0]["score"] > 0
+
+    results = ops_chunks.retrieve_chunks("oppilasta", k=5, subjects=["historia"])
+    assert [r["id"] for r in results] == ["ops-2"]
+    assert [r["id"] for r in ops_chunks.retrieve_chunks("", k=1, grades=["3-6"])] == ["ops-1"]
+
+
+def test_fts_index_follows_updates(db_backend):
+    chunk = OpsChunk.objects.get(external_id="ops-2")
+    chunk.content = "T2 ohjata oppilasta soittamaan rytmisoittimia"
+    chunk.save()
+    assert ops_chunks.retrieve_chunks("lähteitä", k=5) == []
+    assert [r["id"] for r in ops_chunks.retrieve_chunks("rytmisoittimia", k=5)] == ["ops-2"]
+    assert ops_chunks.get_facets()["counts"]["subjects"] == {"Historia": 1, "Matematiikka": 2}
+
+
+def test_multi_word_query_matches_any_term(db_backend):
+    # Kaikki sanat eivät esiinny samassa rivissä -> osumat kummastakin (OR)
+    results = ops_chunks.retrieve_chunks("murtoluvut historian lähteitä", k=5)
+    assert {r["id"] for r in results} == {"ops-1", "ops-2"}
+    assert ops_db._tsquery("Murtoluvut ja lähteitä") == "'murtoluvut':* | 'lähteitä':*"
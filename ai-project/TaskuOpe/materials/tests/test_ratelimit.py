@@ -0,0 +1,111 @@
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+
+from materials import jobs, ratelimit
+from materials.models import BackgroundJob, RateLimitBucket, RateLimitLease
+from users.models import CustomUser
+
+
+@pytest.fixture(autouse=True)
+def fresh_cooldown():
+    ratelimit._COOLDOWN.update(until=0.0, checked=0.0)
+    yield
+    ratelimit._COOLDOWN.update(until=0.0, checked=0.0)
+
+
+@pytest.mark.django_db
+def test_game_endpoint_rejects_with_retry_after(client, settings):
+    settings.AI_RATE_LIMITS = {"game": {"TEACHER": {"rate": 1, "per": 60, "burst": 2}}}
+    teacher = CustomUser.objects.create_user(username="ope", password="x", role="TEACHER")
+    client.force_login(teacher)
+    url = reverse("generate_game_ajax")
+    body = {"topic": "Avaruus", "game_type": "quiz"}
+
+    for _ in range(2):
+        assert client.post(url, body, content_type="application/json").status_code == 202
+    resp = client.post(url, body, content_type="application/json")
+    assert resp.status_code == 429
+    assert 1 <= int(resp["Retry-After"]) <= 60 and resp.json()["retry_after"] == int(resp["Retry-After"])
+    assert BackgroundJob.objects.filter(kind="game").count() == 2
+
+    # Toisen opettajan kori on erillinen; yhteinen kori riittää vielä
+    other = CustomUser.objects.create_user(username="toinen", password="x", role="TEACHER")
+    client.force_login(other)
+    assert client.post(url, body, content_type="application/json").status_code == 202
+
+
+@pytest.mark.django_db
+def test_concurrency_leases_and_upstream_cooldown(settings):
+    settings.AI_RATE_LIMITS = {"image": {"global": {"concurrency": 1}}}
+    assert ratelimit.acquire("k", 1) and ratelimit.acquire("k", 1) is None
+    RateLimitLease.objects.filter(key="k").delete()
+    with ratelimit.slots("image", scope="job"):
+        with pytest.raises(ratelimit.RateLimited):
+            with ratelimit.slots("image", scope="job"):
+                pass
+    assert not RateLimitLease.objects.exists()
+
+    ratelimit.note_upstream_limit(20)
+    ratelimit._COOLDOWN.update(until=0.0, checked=0.0)
+    assert 15 < ratelimit.upstream_cooldown() <= 20
+    with pytest.raises(ratelimit.RateLimited) as exc:
+        ratelimit.check("game", None)
+    assert exc.value.scope == "openai"
+
+
+@pytest.mark.django_db
+def test_worker_defers_job_when_slots_are_full(settings):
+    settings.AI_RATE_LIMITS = {"game": {"global": {"concurrency": 1}}}
+    job = jobs.enqueue("game", {"topic": "x", "game_type": "quiz"})
+    held = ratelimit.acquire("game:job:global", 1)
+    job = jobs.run_job(jobs.claim_next("w1"), throttle=True)
+    assert job.status == BackgroundJob.Status.QUEUED and job.retry_after >= 1
+    job.refresh_from_db()
+    assert (job.status, job.attempts) == (BackgroundJob.Status.QUEUED, 0)
+    ratelimit.release(held)
+
+    # Siirretty työ odottaa run_after-hetkeen; myöhempi työ varataan ensin
+    assert job.run_after > timezone.now() and jobs.claim_next("w2") is None
+    later = jobs.enqueue("game", {"topic": "y", "game_type": "quiz"})
+    assert jobs.claim_next("w2").pk == later.pk
+    BackgroundJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+    assert jobs.claim_next("w2").pk == job.pk
+
+
+@pytest.mark.django_db
+def test_global_rejection_refunds_user_token(settings):
+    settings.AI_RATE_LIMITS = {"game": {"TEACHER": {"rate": 1, "per": 60, "burst": 2},
+                                        "global": {"rate": 1, "per": 60, "burst": 1}}}
+    teacher = CustomUser.objects.create_user(username="ope", password="x", role="TEACHER")
+    ratelimit.check("game", teacher)
+    with pytest.raises(ratelimit.RateLimited) as exc:
+        ratelimit.check("game", teacher)
+    assert exc.value.scope == "global"
+    assert RateLimitBucket.objects.get(key=f"game:user:{teacher.pk}").tokens == pytest.approx(1, abs=0.1)
+
+
+@pytest.mark.django_db
+def test_busy_slot_rejection_refunds_tokens(client, settings):
+    settings.AI_RATE_LIMITS = {"game": {"TEACHER": {"rate": 1, "per": 60, "burst": 2, "concurrency": 1},
+                                        "global": {"rate": 1, "per": 60, "burst": 5}}}
+    teacher = CustomUser.objects.create_user(username="ope", password="x", role="TEACHER")
+    client.force_login(teacher)
+    held = ratelimit.acquire(f"game:request:user:{teacher.pk}", 1)
+    resp = client.post(reverse("generate_game_ajax"), {"topic": "Avaruus", "game_type": "quiz"},
+                       content_type="application/json")
+    assert resp.status_code == 429
+    assert RateLimitBucket.objects.get(key=f"game:user:{teacher.pk}").tokens == pytest.approx(2, abs=0.1)
+    assert RateLimitBucket.objects.get(key="game:global").tokens == pytest.approx(5, abs=0.1)
+    ratelimit.release(held)
+
+
+@pytest.mark.django_db
+def test_worker_respects_job_creator_slots(settings):
+    settings.AI_RATE_LIMITS = {"game": {"TEACHER": {"concurrency": 1}}}
+    teacher = CustomUser.objects.create_user(username="ope", password="x", role="TEACHER")
+    job = jobs.enqueue("game", {"topic": "x", "game_type": "quiz"}, user=teacher)
+    held = ratelimit.acquire(f"game:job:user:{teacher.pk}", 1)
+    job = jobs.run_job(jobs.claim_next("w1"), throttle=True)
+    assert job.status == BackgroundJob.Status.QUEUED and job.retry_after >= 1
+    ratelimit.release(held)
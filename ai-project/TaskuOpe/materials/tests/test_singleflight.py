@@ -0,0 +1,49 @@
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from materials import singleflight
+from materials.models import SingleFlight
+
+
+@pytest.mark.django_db
+def test_concurrent_calls_in_process_share_one_call():
+    key = singleflight.make_key("tts", "Hei kaikki")
+    calls, results = [], []
+
+    def follower():
+        results.append(singleflight.do(key, lambda: calls.append("follower") or {"url": "b"}))
+
+    def leader():
+        calls.append("leader")
+        thread = threading.Thread(target=follower)
+        thread.start()
+        time.sleep(0.2)
+        return {"url": "a"}
+
+    assert singleflight.do(key, leader) == {"url": "a"}
+    while not results:
+        time.sleep(0.01)
+    assert results == [{"url": "a"}] and calls == ["leader"]
+
+
+@pytest.mark.django_db
+def test_result_from_other_worker_is_reused_and_stale_lock_taken_over(settings):
+    settings.SINGLEFLIGHT_POLL_INTERVAL = 0.01
+    key = singleflight.make_key("game", "avaruus", "quiz", "easy")
+    SingleFlight.objects.create(key=key, status=SingleFlight.Status.DONE, result={"x": 1},
+                                expires_at=timezone.now() + timedelta(seconds=5))
+    assert singleflight.do(key, lambda: pytest.fail("ei uutta kutsua")) == {"x": 1}
+
+    # Kaatuneen workerin vanhentunut lukko -> uusi johtaja
+    SingleFlight.objects.filter(key=key).update(status=SingleFlight.Status.RUNNING, result=None,
+                                                expires_at=timezone.now() - timedelta(seconds=1))
+    assert singleflight.do(key, lambda: {"x": 2}) == {"x": 2}
+
+    SingleFlight.objects.filter(key=key).update(status=SingleFlight.Status.FAILED, error="429",
+                                                expires_at=timezone.now() + timedelta(seconds=5))
+    with pytest.raises(singleflight.SingleFlightError):
+        singleflight.do(key, lambda: {"x": 3})
@@ -0,0 +1,27 @@
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+
+from materials.storage import IMMUTABLE_CACHE_CONTROL, PublicMediaStorage
+from users.models import CustomUser
+
+
+def test_public_acl_and_cache_headers_are_sent_with_the_upload():
+    storage = PublicMediaStorage(bucket_name="taskuope", location="media",
+                                 object_parameters={"CacheControl": "max-age=86400"})
+    params = storage._get_write_parameters("media/ai_images/abc.png")
+    assert params == {"ACL": "public-read", "CacheControl": IMMUTABLE_CACHE_CONTROL, "ContentType": "image/png"}
+    assert storage._get_write_parameters("media/muut/raportti.txt")["CacheControl"] == "max-age=86400"
+
+
+@pytest.mark.django_db
+def test_uploaded_image_is_saved_once_and_url_returned(client, settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    teacher = CustomUser.objects.create_user(username="ope", password="x", role="TEACHER")
+    client.force_login(teacher)
+    upload = SimpleUploadedFile("kuva.png", b"\x89PNG data", content_type="image/png")
+    resp = client.post(reverse("generate_image"), {"image_upload": upload})
+    assert resp.status_code == 201
+    url = resp.json()["image_url"]
+    assert url.startswith(settings.MEDIA_URL + "uploaded_images/")
+    assert (tmp_path / url[len(settings.MEDIA_URL):]).read_bytes() == b"\x89PNG data"
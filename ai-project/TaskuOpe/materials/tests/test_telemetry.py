@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+import pytest
+from django.urls import reverse
+
+from materials import ai_service, llm_cache, telemetry
+from materials.models import LLMCallLog
+from users.models import CustomUser
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.fail = False
+
+    def create(self, **kwargs):
+        if self.fail:
+            raise RuntimeError("palvelu alhaalla")
+        message = SimpleNamespace(content="vastaus")
+        usage = SimpleNamespace(prompt_tokens=1000, completion_tokens=100)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    completions = FakeCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    monkeypatch.setattr(ai_service, "get_openai_client", lambda: client)
+    llm_cache.clear()
+    telemetry._BUFFER.clear()
+    return completions
+
+
+@pytest.mark.django_db
+def test_calls_are_buffered_and_flushed_in_bulk(fake_openai, django_assert_num_queries):
+    teacher = CustomUser.objects.create_user(username="ope", password="x", role="TEACHER")
+    messages = [{"role": "user", "content": "Arvioi"}]
+    with telemetry.context(feature="ai_grade", user_id=teacher.pk):
+        ai_service.chat_completion(messages, temperature=0)
+        ai_service.chat_completion(messages, temperature=0)
+    fake_openai.fail = True
+    with pytest.raises(RuntimeError):
+        ai_service.chat_completion(messages, feature="game_content")
+    assert not LLMCallLog.objects.exists()
+
+    with django_assert_num_queries(1):
+        assert telemetry.flush() == 3
+    first, hit = LLMCallLog.objects.filter(feature="ai_grade").order_by("created_at")
+    assert (first.prompt_tokens, first.completion_tokens, first.user_id) == (1000, 100, teacher.pk)
+    assert first.cost_usd == pytest.approx(0.0035) and not first.cache_hit
+    assert hit.cache_hit and hit.cost_usd == 0
+    failed = LLMCallLog.objects.get(feature="game_content")
+    assert failed.status == LLMCallLog.Status.ERROR and "palvelu alhaalla" in failed.error
+
+
+@pytest.mark.django_db
+def test_daily_summary_percentiles_and_admin(admin_client):
+    telemetry._BUFFER.clear()
+    for latency in range(1, 101):
+        telemetry.record(feature="tts", model="tts-1", latency_ms=latency * 10, units=100)
+    telemetry.record(feature="tts", model="tts-1", cache_hit=True)
+
+    row = next(r for r in telemetry.daily_summary() if r["feature"] == "tts")
+    assert (row["calls"], row["cache_hits"], row["p50_ms"], row["p95_ms"]) == (101, 1, 500, 950)
+    assert row["cost_usd"] == pytest.approx(0.15)
+
+    resp = admin_client.get(reverse("admin:materials_llmcalllog_changelist"), {"days": 7})
+    assert resp.status_code == 200 and resp.context["summary_days"] == 7
+    assert b"p95 (ms)" in resp.content
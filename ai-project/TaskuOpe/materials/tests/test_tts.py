@@ -0,0 +1,160 @@
+import os
+import threading
+
+import pytest
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.urls import reverse
+from django.utils import timezone
+
+from materials import ai_service, tts
+from materials.models import Assignment, Material, SingleFlight
+from users.models import CustomUser
+
+
+@pytest.fixture
+def classroom(settings, tmp_path, monkeypatch):
+    settings.MEDIA_ROOT = tmp_path
+    settings.JOBS_EAGER = True
+    calls = []
+    monkeypatch.setattr(ai_service, "generate_speech", lambda text: calls.append(text) or bytes(range(256)) * 4)
+    teacher = CustomUser.objects.create_user(username="ope", password="x", role="TEACHER")
+    material = Material.objects.create(title="Kuuntelu", content="![kuva](a.png) Hei kaikki", author=teacher)
+    students = []
+    for n in range(2):
+        student = CustomUser.objects.create_user(username=f"oppilas{n}", password="x", role="STUDENT")
+        students.append(Assignment.objects.create(material=material, student=student, assigned_by=teacher,
+                                                  due_at=timezone.now()))
+    return material, students, calls
+
+
+@pytest.mark.django_db
+def test_audio_is_generated_once_per_material_version(client, classroom):
+    material, (first, second), calls = classroom
+
+    client.force_login(first.student)
+    job = client.post(reverse("assignment_tts", args=[first.pk])).json()
+    assert job["status"] == "DONE" and calls == ["Hei kaikki"]
+
+    client.force_login(second.student)
+    cached = client.post(reverse("assignment_tts", args=[second.pk])).json()
+    assert cached["cached"] and cached["result"]["url"] == job["result"]["url"]
+    assert calls == ["Hei kaikki"]
+
+    url = cached["result"]["url"]
+    full = client.get(url)
+    assert full.status_code == 200 and full["Accept-Ranges"] == "bytes" and "immutable" in full["Cache-Control"]
+    part = client.get(url, HTTP_RANGE="bytes=10-19")
+    assert part.status_code == 206 and part.content == bytes(range(10, 20))
+    assert part["Content-Range"] == "bytes 10-19/1024"
+    assert client.get(url, HTTP_RANGE="bytes=-4").content == bytes(range(252, 256))
+    assert client.get(url, HTTP_IF_NONE_MATCH=full["ETag"]).status_code == 304
+
+    # Sisältö muuttuu -> uusi ääni generoidaan seuraavalla kerralla; vanha säilyy
+    # kopiolla, kunnes lakaisu toteaa, ettei mikään materiaali käytä sitä
+    old_name = tts.audio_path(tts.audio_key("Hei kaikki"))
+    copy = Material.objects.create(title="Kopio", content=material.content, author=material.author)
+    material.content = "Uusi teksti"
+    material.save()
+    assert default_storage.exists(old_name)
+    client.post(reverse("assignment_tts", args=[second.pk]))
+    assert calls == ["Hei kaikki", "Uusi teksti"]
+
+    assert tts.sweep_unused_audio(min_age=0) == 0 and default_storage.exists(old_name)
+    copy.delete()
+    assert tts.sweep_unused_audio(min_age=3600) == 0
+    assert tts.sweep_unused_audio(min_age=0) == 1 and not default_storage.exists(old_name)
+    assert default_storage.exists(tts.audio_path(tts.audio_key("Uusi teksti")))
+
+
+@pytest.mark.django_db
+def test_cached_playlist_does_not_spend_tts_tokens(client, classroom, settings):
+    settings.AI_RATE_LIMITS = {"tts": {"STUDENT": {"rate": 1, "per": 3600, "burst": 1}}}
+    material, (first, _), calls = classroom
+    client.force_login(first.student)
+    url = reverse("assignment_tts", args=[first.pk])
+    assert client.post(url).json()["status"] == "DONE"
+    for _ in range(3):
+        assert client.post(url).json()["cached"]
+
+    # Uusi sisältö vaatii generoinnin -> käyttäjän kiintiö on käytetty
+    material.content = "Uusi teksti"
+    material.save()
+    assert client.post(url).status_code == 429
+    assert calls == ["Hei kaikki"]
+
+
+class RemoteStorage(FileSystemStorage):
+    """Kuten Spaces: ei paikallista polkua, osoite toisessa alkuperässä."""
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.location, name))
+
+    def path(self, name):
+        raise NotImplementedError
+
+    def url(self, name):
+        return f"https://cdn.example.com/{name}"
+
+
+@pytest.mark.django_db
+def test_remote_storage_answers_head_and_redirects_get(client, classroom, tmp_path, monkeypatch):
+    material, (first, _), calls = classroom
+    monkeypatch.setattr("materials.views.api.default_storage", RemoteStorage(location=tmp_path))
+    client.force_login(first.student)
+    url = client.post(reverse("assignment_tts", args=[first.pk])).json()["result"]["url"]
+
+    head = client.head(url)
+    assert head.status_code == 200 and not head.content and "Location" not in head
+    get = client.get(url)
+    assert get.status_code == 302 and get["Location"].startswith("https://cdn.example.com/tts/")
+    assert client.head(reverse("tts_audio", args=["0" * 64])).status_code == 404
+
+
+def test_text_is_split_at_paragraph_and_sentence_boundaries():
+    text = "Otsikko\n\nEnsimmäinen kappale on tässä.\n\n" + "Pitkä lause tässä. " * 10
+    segments = tts.split_segments(text, limit=60, min_chars=10)
+    assert segments[0] == "Otsikko\n\nEnsimmäinen kappale on tässä."
+    assert all(len(s) <= 60 for s in segments)
+    assert segments[1].startswith("Pitkä lause tässä.") and segments[1].endswith(".")
+    assert " ".join(segments[1:]) == ("Pitkä lause tässä. " * 10).strip()
+
+
+@pytest.mark.django_db
+def test_missing_segments_are_synthesized_concurrently(settings, tmp_path, monkeypatch):
+    settings.MEDIA_ROOT = tmp_path
+    settings.TTS_MIN_SEGMENT_CHARS = 0
+    # Jokainen kutsu odottaa, kunnes kaikki kolme ovat käynnissä yhtä aikaa
+    barrier = threading.Barrier(3, timeout=5)
+    done = []
+
+    def synthesize_segment(segment, key):
+        barrier.wait()
+        done.append(segment)
+
+    monkeypatch.setattr(tts, "_synthesize_segment", synthesize_segment)
+    keys = tts.synthesize("Yksi.\n\nKaksi.\n\nKolme.\n\nYksi.")
+    assert sorted(done) == ["Kaksi.", "Kolme.", "Yksi."] and keys[0] == keys[3] == tts.audio_key("Yksi.")
+    assert SingleFlight.objects.filter(status=SingleFlight.Status.DONE).count() == 3
+
+
+@pytest.mark.django_db
+def test_only_edited_paragraph_is_regenerated(client, classroom, settings):
+    settings.TTS_MIN_SEGMENT_CHARS = 0
+    material, (first, _), calls = classroom
+    material.content = "Yksi.\n\nKaksi.\n\nKolme."
+    material.save()
+    client.force_login(first.student)
+
+    job = client.post(reverse("assignment_tts", args=[first.pk])).json()
+    segments = job["result"]["segments"]
+    assert job["segments"] == segments and len(segments) == 3
+    assert sorted(calls) == ["Kaksi.", "Kolme.", "Yksi."]
+    assert client.head(segments[1]).status_code == 200
+
+    material.content = "Yksi.\n\nKaksi muokattu.\n\nKolme."
+    material.save()
+    assert client.head(segments[1]).status_code == 200
+    again = client.post(reverse("assignment_tts", args=[first.pk])).json()
+    new_segments = again["result"]["segments"]
+    assert new_segments[0] == segments[0] and new_segments[2] == segments[2]
+    assert calls[3:] == ["Kaksi muokattu."]
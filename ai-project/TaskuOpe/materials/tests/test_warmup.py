@@ -0,0 +1,76 @@
+import io
+
+import pytest
+from django.core.files.base import ContentFile
+from django.urls import reverse
+from PIL import Image
+
+from materials import ai_service, jobs, ratelimit
+from materials.models import Assignment, BackgroundJob, Material, MaterialImage
+from users.models import CustomUser
+
+
+def _png() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (800, 500), "red").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.mark.django_db
+def test_assigning_material_prewarms_audio_html_and_thumbnails(client, settings, tmp_path, monkeypatch):
+    settings.MEDIA_ROOT = tmp_path
+    settings.JOBS_EAGER = True
+    calls = []
+    monkeypatch.setattr(ai_service, "generate_speech", lambda text: calls.append(text) or b"mp3")
+    teacher = CustomUser.objects.create_user(username="ope", password="x", role="TEACHER")
+    student = CustomUser.objects.create_user(username="oppilas", password="x", role="STUDENT")
+    material = Material.objects.create(title="Kuuntelu", content="# Otsikko\n\nHei **kaikki**", author=teacher)
+    image = MaterialImage.objects.create(material=material, created_by=teacher)
+    image.image.save("kuva.png", ContentFile(_png()))
+
+    client.force_login(teacher)
+    client.post(reverse("assign_material", args=[material.pk]), {"students": [student.pk]})
+    job = BackgroundJob.objects.get(kind="warmup", ref=f"material:{material.pk}")
+    assert job.status == BackgroundJob.Status.DONE, job.error
+    assert job.result == {"html": True, "thumbnails": 1, "tts_segments": 1}
+    assert calls == ["# Otsikko\n\nHei **kaikki**"]
+    assert image.thumbnail.storage.exists(image.thumbnail.name)
+    assert "valmisteltu oppilaille" in client.get(reverse("material_detail", args=[material.pk])).content.decode()
+
+    # Oppilaan avaus: HTML esirenderöinnistä, ääni välimuistista
+    material.refresh_from_db()
+    assert "<strong>kaikki</strong>" in material.rendered_html
+    assignment = Assignment.objects.get(material=material, student=student)
+    client.force_login(student)
+    monkeypatch.setattr("materials.views.shared.render_material_content_to_html",
+                        lambda text: pytest.fail("ei uutta renderöintiä"))
+    assert "<strong>kaikki</strong>" in client.get(reverse("assignment_detail", args=[assignment.pk])).content.decode()
+    assert client.post(reverse("assignment_tts", args=[assignment.pk])).json()["cached"]
+    assert len(calls) == 1
+
+
+@pytest.mark.django_db
+def test_warmup_steps_fail_independently_and_wait_for_tts_slot(settings, tmp_path, monkeypatch):
+    settings.MEDIA_ROOT = tmp_path
+    settings.AI_RATE_LIMITS = {"tts": {"global": {"concurrency": 1}}}
+    calls = []
+    monkeypatch.setattr(ai_service, "generate_speech", lambda text: calls.append(text) or b"mp3")
+
+    def broken_html(material):
+        raise ValueError("rikki")
+
+    monkeypatch.setattr("materials.views.shared.cached_material_html", broken_html)
+    teacher = CustomUser.objects.create_user(username="ope", password="x", role="TEACHER")
+    material = Material.objects.create(title="Kuuntelu", content="Hei kaikki", author=teacher)
+
+    # TTS-paikka varattu -> työ palaa jonoon vasta puheäänen kohdalla
+    held = ratelimit.acquire("tts:job:global", 1)
+    jobs.enqueue("warmup", {"material_id": str(material.pk)})
+    job = jobs.run_job(jobs.claim_next("w1"), throttle=True)
+    assert job.status == BackgroundJob.Status.QUEUED and calls == []
+    ratelimit.release(held)
+
+    BackgroundJob.objects.filter(pk=job.pk).update(run_after=job.created_at)
+    job = jobs.run_job(jobs.claim_next("w1"), throttle=True)
+    assert job.status == BackgroundJob.Status.FAILED and "HTML: rikki" in job.error
+    assert calls == ["Hei kaikki"]
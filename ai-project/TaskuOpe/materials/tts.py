@@ -0,0 +1,358 @@
+# materials/tts.py
+"""Sisältöosoitteinen välimuisti tehtävänantojen puheäänelle.
+
+Teksti jaetaan kappaleiden (ja tarvittaessa lauseiden) rajoilta segmentteihin,
+jotka mahtuvat TTS-rajapinnan syöterajaan (split_segments). Jokainen segmentti
+tallennetaan default_storageen omaan tiedostoonsa ``tts/<aa>/<avain>.mp3``,
+jossa avain on SHA-256-tiiviste segmentin tekstistä sekä mallista, äänestä ja
+nopeudesta (materials.ai_models, tehtävä "tts"). Sama teksti tuottaa samat
+tiedostot, joten kallis generate_speech-kutsu tehdään kerran materiaalin
+versiota kohden, vaikka 25 oppilasta kuuntelisi sen. Kun yhtä kappaletta
+muokataan, vain sen segmentti generoidaan uudelleen.
+
+Puuttuvat segmentit generoidaan rinnakkain rajatussa säiepoolissa
+(synthesize, TTS_POOL_SIZE). Selain soittaa segmentit järjestyksessä
+soittolistana heti, kun ensimmäinen on valmis (assignment_tts_view).
+
+Samaa segmenttiä voivat käyttää useat materiaalit, kopiot ja aiemmat versiot,
+joten tiedostoja ei poisteta tallennuksen yhteydessä. Käyttämättömät segmentit
+siivotaan erikseen komennolla ``python manage.py sweep_tts_audio``
+(sweep_unused_audio).
+"""
+
+import contextvars
+import hashlib
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+
+from . import ai_models
+
+KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+
+_POOL: Optional[ThreadPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def clean_text(raw: str) -> str:
+    """
+    Poistaa Markdown-kuvat tekstistä ennen puheeksi muuntamista.
+
+    Args:
+        raw (str): Materiaalin sisältö.
+
+    Returns:
+        str: Luettava teksti (voi olla tyhjä).
+    """
+    # Tarkka lauseke: poistaa vain oikeat Markdown-kuvat
+    return re.sub(r'!\[[^\]]*\]\([^\)]*\)\s*', '', raw or '')
+
+
+def _pack(parts: list[str], limit: int, sep: str) -> list[str]:
+    """Yhdistää peräkkäiset osat ahneesti enintään limit-merkin paloiksi."""
+    out, current = [], ""
+    for part in parts:
+        candidate = f"{current}{sep}{part}" if current else part
+        if len(candidate) <= limit:
+            current = candidate
+            continue
+        if current:
+            out.append(current)
+        # Yksittäinen liian pitkä osa (esim. sana) katkaistaan kovalla rajalla
+        while len(part) > limit:
+            out.append(part[:limit])
+            part = part[limit:]
+        current = part
+    if current:
+        out.append(current)
+    return out
+
+
+def _split_long(paragraph: str, limit: int) -> list[str]:
+    """Jakaa liian pitkän kappaleen lauseiden (ja tarvittaessa sanojen) rajoilta."""
+    pieces = []
+    for sentence in _SENTENCE_RE.split(paragraph):
+        if len(sentence) <= limit:
+            pieces.append(sentence)
+        else:
+            pieces.extend(_pack(sentence.split(), limit, " "))
+    return _pack(pieces, limit, " ")
+
+
+def split_segments(text: str, limit: Optional[int] = None, min_chars: Optional[int] = None) -> list[str]:
+    """
+    Jakaa tekstin puhesegmentteihin kappaleiden ja lauseiden rajoilta.
+
+    Jokainen kappale on oma segmenttinsä, jotta yhden kappaleen muokkaus ei
+    muuta muiden segmenttien avaimia. Lyhyet kappaleet (esim. otsikot)
+    yhdistetään seuraavaan kappaleeseen, ja syöterajaa pidemmät kappaleet
+    jaetaan lauseiden rajoilta.
+
+    Args:
+        text (str): Siivottu teksti.
+        limit (int | None): Segmentin enimmäispituus merkkeinä
+            (oletus TTS_SEGMENT_CHARS; rajapinnan raja on 4096).
+        min_chars (int | None): Tätä lyhyempi kappale yhdistetään seuraavaan
+            (oletus TTS_MIN_SEGMENT_CHARS).
+
+    Returns:
+        list[str]: Segmentit järjestyksessä (tyhjä lista tyhjälle tekstille).
+    """
+    limit = int(limit or getattr(settings, "TTS_SEGMENT_CHARS", 4000))
+    if min_chars is None:
+        min_chars = int(getattr(settings, "TTS_MIN_SEGMENT_CHARS", 200))
+
+    pieces = []
+    for paragraph in _PARAGRAPH_RE.split(text or ""):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        pieces.extend([paragraph] if len(paragraph) <= limit else _split_long(paragraph, limit))
+
+    segments, carry = [], ""
+    for piece in pieces:
+        if carry:
+            joined = f"{carry}\n\n{piece}"
+            if len(joined) <= limit:
+                piece = joined
+            else:
+                segments.append(carry)
+        carry = ""
+        if len(piece) < min_chars:
+            carry = piece
+            continue
+        segments.append(piece)
+    if carry:
+        segments.append(carry)
+    return segments
+
+
+def audio_key(text: str) -> str:
+    """
+    Laskee äänitiedoston avaimen tekstistä ja TTS-asetuksista.
+
+    Args:
+        text (str): Siivottu teksti (yksi segmentti).
+
+    Returns:
+        str: 64-merkkinen heksadesimaalitiiviste.
+    """
+    config = ai_models.get("tts")
+    raw = json.dumps(
+        [text, config["model"], config.get("voice"), config.get("speed")],
+        ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def audio_path(key: str) -> str:
+    """Palauttaa avaimen tiedostopolun default_storagessa."""
+    return f"tts/{key[:2]}/{key}.mp3"
+
+
+def audio_url(key: str) -> str:
+    """Palauttaa äänen jakeluosoitteen (tts_audio_view)."""
+    return reverse("tts_audio", args=[key])
+
+
+def segment_keys(text: str) -> list[str]:
+    """Palauttaa tekstin segmenttien avaimet soittojärjestyksessä."""
+    return [audio_key(segment) for segment in split_segments(text)]
+
+
+def cached_playlist(text: str) -> Optional[list[str]]:
+    """
+    Palauttaa segmenttien avaimet, jos kaikki segmentit on jo generoitu.
+
+    Returns:
+        Optional[list[str]]: Avaimet järjestyksessä tai None.
+    """
+    keys = segment_keys(text)
+    if keys and all(default_storage.exists(audio_path(key)) for key in keys):
+        return keys
+    return None
+
+
+def save_audio(key: str, audio_bytes: bytes) -> str:
+    """
+    Tallentaa äänen avaimen polkuun (korvaa mahdollisen keskeneräisen tiedoston).
+
+    Returns:
+        str: Tallennetun tiedoston nimi.
+    """
+    name = audio_path(key)
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    return default_storage.save(name, ContentFile(audio_bytes))
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(
+                max_workers=int(getattr(settings, "TTS_POOL_SIZE", 4)), thread_name_prefix="tts"
+            )
+    return _POOL
+
+
+def _synthesize_segment(segment: str, key: str) -> None:
+    """
+    Generoi yhden segmentin äänen ja tallentaa sen, ellei se ole jo tallessa.
+
+    Ajetaan poolin säikeessä: vain HTTP-kutsu ja tiedoston tallennus, ei
+    tietokantakirjoituksia (SQLite lukitsisi taulun rinnakkaisilta säikeiltä).
+    """
+    from .ai_service import generate_speech
+
+    # Toinen työ ehti jo luoda saman segmentin
+    if default_storage.exists(audio_path(key)):
+        return
+    audio_bytes = generate_speech(segment)
+    if not audio_bytes:
+        raise RuntimeError("Äänitiedoston luonti epäonnistui.")
+    save_audio(key, audio_bytes)
+
+
+def _in_pool(func, *args):
+    """Ajaa funktion poolin säikeessä kutsujan kontekstilla (telemetria)."""
+    def run():
+        try:
+            return func(*args)
+        finally:
+            # Poolin säikeen tietokantayhteys ei saa jäädä auki
+            connection.close()
+    return _pool().submit(contextvars.copy_context().run, run)
+
+
+def synthesize(text: str) -> list[str]:
+    """
+    Generoi tekstin puuttuvat segmentit rinnakkain ja palauttaa kaikkien avaimet.
+
+    Segmentit lähetetään pooliin soittojärjestyksessä, joten ensimmäinen
+    valmistuu yleensä ensin ja selain voi aloittaa toiston sen jälkeen.
+    Valmiit segmentit (myös muista materiaaliversioista) käytetään sellaisenaan.
+
+    Yhdistäminen (materials.singleflight) tehdään kutsuvassa säikeessä:
+    se varaa segmentit, joita kukaan muu ei ole generoimassa, ja päättää
+    varaukset, kun poolin HTTP-kutsut valmistuvat. Toisen työn varaamat
+    segmentit odotetaan lopuksi.
+
+    Args:
+        text (str): Siivottu teksti.
+
+    Returns:
+        list[str]: Segmenttien avaimet soittojärjestyksessä.
+
+    Raises:
+        RuntimeError: Jos jonkin segmentin generointi epäonnistuu.
+    """
+    from . import singleflight
+
+    segments = split_segments(text)
+    keys = [audio_key(segment) for segment in segments]
+    missing = {}
+    for segment, key in zip(segments, keys):
+        if key not in missing and not default_storage.exists(audio_path(key)):
+            missing[key] = segment
+
+    if len(missing) <= 1 or int(getattr(settings, "TTS_POOL_SIZE", 4)) <= 1:
+        # Sama segmentti (esim. monta oppilasta samalla materiaalilla) -> yksi kutsu ja tiedosto
+        for key, segment in missing.items():
+            singleflight.do(singleflight.make_key("tts", key),
+                            lambda segment=segment, key=key: _synthesize_segment(segment, key) or {"key": key})
+        return keys
+
+    owned, others = {}, {}
+    for key, segment in missing.items():
+        if singleflight.claim(singleflight.make_key("tts", key)):
+            owned[key] = _in_pool(_synthesize_segment, segment, key)
+        else:
+            others[key] = segment
+
+    error = None
+    for key, future in owned.items():
+        flight = singleflight.make_key("tts", key)
+        try:
+            future.result()
+        except Exception as e:
+            singleflight.complete(flight, error=e)
+            error = error or e
+        else:
+            singleflight.complete(flight, {"key": key})
+    if error is not None:
+        raise error
+
+    # Toisen työn generoimat segmentit: odotetaan tulos (tai otetaan johtajuus)
+    for key, segment in others.items():
+        singleflight.do(singleflight.make_key("tts", key),
+                        lambda segment=segment, key=key: _synthesize_segment(segment, key) or {"key": key})
+    return keys
+
+
+def _walk(path: str):
+    try:
+        dirs, files = default_storage.listdir(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    for name in files:
+        yield f"{path}/{name}"
+    for sub in dirs:
+        yield from _walk(f"{path}/{sub}")
+
+
+def keys_in_use() -> set[str]:
+    """Palauttaa kaikkien materiaalien nykyisen sisällön segmenttien avaimet."""
+    from .models import Material
+
+    used: set[str] = set()
+    for content in Material.objects.exclude(content="").values_list("content", flat=True).iterator():
+        used.update(segment_keys(clean_text(content)))
+    return used
+
+
+def sweep_unused_audio(*, min_age: Optional[float] = None, dry_run: bool = False) -> int:
+    """
+    Poistaa äänitiedostot, joita mikään materiaali ei enää käytä.
+
+    Sama segmentti voi kuulua useaan materiaaliin (kopiot, yhteiset kappaleet),
+    joten tiedostoa ei poisteta tallennuksen yhteydessä. Sen sijaan tämä
+    lakaisu tarkistaa kaikkien materiaalien nykyiset avaimet ennen poistoa.
+    Tuoreita tiedostoja (alle min_age sekuntia) ei poisteta, jotta juuri
+    generoitu ääni ei katoa ennen kuin sen materiaalin tallennus näkyy.
+
+    Args:
+        min_age (Optional[float]): Vähimmäisikä sekunteina (oletus TTS_SWEEP_MIN_AGE).
+        dry_run (bool): Lasketaan vain poistettavat tiedostot.
+
+    Returns:
+        int: Poistettujen (tai dry_run-tilassa poistettavien) tiedostojen määrä.
+    """
+    if min_age is None:
+        min_age = float(getattr(settings, "TTS_SWEEP_MIN_AGE", 86400))
+    used = keys_in_use()
+    cutoff = timezone.now() - timedelta(seconds=min_age)
+    deleted = 0
+    for name in _walk("tts"):
+        key = name.rsplit("/", 1)[-1].removesuffix(".mp3")
+        if not KEY_RE.match(key) or key in used:
+            continue
+        if min_age > 0 and default_storage.get_modified_time(name) > cutoff:
+            continue
+        if not dry_run:
+            default_storage.delete(name)
+        deleted += 1
+    return deleted
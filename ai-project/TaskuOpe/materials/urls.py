@@ -3,7 +3,7 @@ from . import views
 from users import views as user_views
 from django.conf import settings
 from django.conf.urls.static import static
-from .views import ops_facets, ops_search
+from .views import ops_facets, ops_search, ops_search_batch, ops_stats
 
 
 
@@ -18,6 +18,7 @@ urlpatterns = [
 
     # Material URLs
     path("create/", views.create_material_view, name="create_material"),
+    path("create/stream/", views.create_material_stream_view, name="create_material_stream"),
     path("material/<uuid:material_id>/", views.material_detail_view, name="material_detail"),
     path("material/<uuid:material_id>/assign/", views.assign_material_view, name="assign_material"),
     path("material/<uuid:material_id>/delete/", views.delete_material_view, name="delete_material"),
@@ -43,6 +44,11 @@ urlpatterns = [
 
     #Puheengenerointi
     path("assignment/<uuid:assignment_id>/tts/", views.assignment_tts_view, name="assignment_tts"),
+    path("audio/tts/<str:key>.mp3", views.tts_audio_view, name="tts_audio"),
+
+    # Taustatyöt (pitkät tekoälykutsut)
+    path("api/jobs/<uuid:job_id>/", views.job_status_view, name="job_status"),
+    path("api/jobs/<uuid:job_id>/result/", views.job_result_view, name="job_result"),
 
     # Submission URLs
     path("submission/<uuid:submission_id>/grade/", views.grade_submission_view, name="grade_submission"),
@@ -64,6 +70,8 @@ urlpatterns = [
     # JSON chunkit
     path("api/ops/facets", ops_facets, name="ops_facets"),
     path("api/ops/search", ops_search, name="ops_search"),
+    path("api/ops/search/batch", ops_search_batch, name="ops_search_batch"),
+    path("api/ops/stats", ops_stats, name="ops_stats"),
 ]
 
 # LISÄÄ TÄMÄ LOHKO TIEDOSTON LOPPUUN
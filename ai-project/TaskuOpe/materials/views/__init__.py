@@ -3,7 +3,7 @@
 from .main import dashboard_view
 
 from .teacher import (
-    teacher_dashboard_view, create_material_view, material_list_view, edit_material_view,
+    teacher_dashboard_view, create_material_view, create_material_stream_view, material_list_view, edit_material_view,
     delete_material_view, assign_material_view, unassign_assignment, delete_assignment_view,
     view_submissions, grade_submission_view, view_all_submissions_view,
     export_submissions_csv_view, teacher_student_list_view,
@@ -19,10 +19,11 @@ from .student import (
 
 from .api import (
     generate_game_ajax_view, complete_game_ajax_view, assignment_autosave_view,
-    generate_image_view, assignment_tts_view, ops_facets, ops_search
+    generate_image_view, assignment_tts_view, ops_facets, ops_search, ops_search_batch, ops_stats,
+    job_status_view, job_result_view, tts_audio_view
 )
 
 from .shared import (
-    material_detail_view, render_material_content_to_html,
+    material_detail_view, render_material_content_to_html, cached_material_html,
     format_game_content_for_display
 )
\ No newline at end of file
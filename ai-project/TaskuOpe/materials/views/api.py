@@ -1,12 +1,13 @@
-from django.http import JsonResponse, HttpResponse, HttpResponseForbidden
-from django.views.decorators.http import require_POST, require_GET
-from django.shortcuts import get_object_or_404
+from django.http import FileResponse, JsonResponse, HttpResponse, HttpResponseForbidden
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, require_GET, require_safe
+from django.shortcuts import get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
 from django.conf import settings # Tuo Django-asetukset
-import boto3 # Tuo AWS SDK
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile 
+from django.db import connection
 
 import json
 import os
@@ -14,14 +15,18 @@ import uuid
 import base64
 import requests
 import re
+import threading
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from urllib.parse import urljoin
 
-from ..models import Assignment, Submission, Material, MaterialImage
-from ..ai_service import generate_speech, generate_image_bytes
-from TaskuOpe.ops_chunks import get_facets, retrieve_chunks
-from openai import OpenAI
-
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from ..models import Assignment, BackgroundJob, Submission, Material, MaterialImage
+from .. import images, jobs, llm_cache, singleflight, tts
+from ..ratelimit import rate_limited
+from ..storage import save_public
+from ..ai_service import chat_completion, generate_image_bytes
+from TaskuOpe.ops_chunks import cache_stats, get_facets, max_results, retrieve_chunks, retrieve_chunks_batch
 
 # Pelisisältö
 def generate_game_content(topic: str, game_type: str, difficulty: str = 'medium') -> dict:
@@ -96,13 +101,11 @@ Palauta VAIN JSON: {{"pairs":[...]}}
     else:
         raise ValueError("Tuntematon pelityyppi")
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
+    content = chat_completion(
+        [{"role": "user", "content": prompt}],
+        task="game_content",
         response_format={"type": "json_object"},
-        messages=[{"role": "user", "content": prompt}]
     )
-    
-    content = response.choices[0].message.content
     return json.loads(content)
 
 # Pelin metadata
@@ -164,14 +167,11 @@ Palauta täsmälleen tässä muodossa:
 """
     
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        content = chat_completion(
+            [{"role": "user", "content": prompt}],
+            task="game_metadata",
             response_format={"type": "json_object"},
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
         )
-        
-        content = response.choices[0].message.content
         result = json.loads(content)
         
         # Varmista että palautettu oppiaine on listalla
@@ -185,24 +185,123 @@ Palauta täsmälleen tässä muodossa:
         }
     except Exception as e:
         # Fallback jos API-kutsu epäonnistuu
-        return {
-            'title': f'{game_name.capitalize()}: {topic[:40]}',
-            'subject': 'Ympäristöoppi'
-        }
+        return _fallback_game_metadata(game_name, topic)
+
+
+def _fallback_game_metadata(game_name: str, topic: str) -> dict:
+    """Oletusotsikko ja -oppiaine, kun metadataa ei saada mallilta."""
+    return {
+        'title': f'{game_name.capitalize()}: {topic[:40]}',
+        'subject': 'Ympäristöoppi'
+    }
+
+
+def game_key(topic: str, game_type: str, difficulty: str = 'medium') -> str:
+    """
+    Laskee pelin välimuisti- ja yhdistämisavaimen normalisoidusta aiheesta
+    (pienet kirjaimet, ylimääräiset välilyönnit poistettu), pelityypistä ja
+    vaikeustasosta.
+    """
+    return singleflight.make_key("game", " ".join(topic.lower().split()), game_type, difficulty or 'medium')
+
+
+def cached_game(topic: str, game_type: str, difficulty: str = 'medium') -> dict | None:
+    """
+    Hakee aiemmin generoidun pelin (game_data, metadata) välimuistista.
+
+    Returns:
+        dict | None: Tallennettu peli tai None.
+    """
+    if not llm_cache.enabled():
+        return None
+    raw = llm_cache.get(game_key(topic, game_type, difficulty))
+    return json.loads(raw) if raw else None
+
+
+def store_game(topic: str, game_type: str, difficulty: str, game: dict) -> None:
+    """Tallentaa generoidun pelin välimuistiin (llm_cache, vanhenee LLM_CACHE_TTL)."""
+    if llm_cache.enabled():
+        llm_cache.put(game_key(topic, game_type, difficulty), "game", json.dumps(game, ensure_ascii=False))
+
+
+_GAME_POOL = None
+_GAME_POOL_LOCK = threading.Lock()
+
+
+def _game_pool() -> ThreadPoolExecutor:
+    global _GAME_POOL
+    with _GAME_POOL_LOCK:
+        if _GAME_POOL is None:
+            _GAME_POOL = ThreadPoolExecutor(
+                max_workers=int(getattr(settings, "GAME_POOL_SIZE", 8)), thread_name_prefix="game"
+            )
+    return _GAME_POOL
+
+
+def _in_pool(func, *args):
+    """Ajaa funktion poolin säikeessä kutsujan kontekstilla (telemetria)."""
+    def run():
+        try:
+            return func(*args)
+        finally:
+            # Poolin säikeen tietokantayhteys ei saa jäädä auki
+            connection.close()
+    return _game_pool().submit(contextvars.copy_context().run, run)
+
+
+def generate_game(topic: str, game_type: str, difficulty: str = 'medium', *, timeout: float | None = None) -> dict:
+    """
+    Generoi pelisisällön ja metadatan rinnakkain (kaksi erillistä OpenAI-kutsua).
+
+    Kokonaisaika on hitaamman kutsun kesto summan sijaan. Molemmilla on
+    yhteinen aikaraja (GAME_GENERATION_TIMEOUT). Jos metadata epäonnistuu
+    tai ei valmistu ajoissa, käytetään oletusotsikkoa ja -oppiainetta.
+
+    Args:
+        topic (str): Pelin aihe.
+        game_type (str): Pelityyppi.
+        difficulty (str): Vaikeustaso.
+        timeout (float | None): Yhteinen aikaraja sekunteina.
+
+    Returns:
+        dict: {"game_data": ..., "metadata": ...}
+
+    Raises:
+        TimeoutError: Jos pelisisältö ei valmistu ajoissa.
+        Exception: Pelisisällön generoinnin virhe.
+    """
+    timeout = timeout or float(getattr(settings, "GAME_GENERATION_TIMEOUT", 90))
+    deadline = time.monotonic() + timeout
+    content_future = _in_pool(generate_game_content, topic, game_type, difficulty)
+    metadata_future = _in_pool(generate_game_metadata, game_type, topic)
+    try:
+        game_data = content_future.result(timeout=timeout)
+    except FuturesTimeout:
+        raise TimeoutError("Pelisisällön generointi ei valmistunut ajoissa.") from None
+    try:
+        metadata = metadata_future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except Exception as e:
+        print(f"Pelin metadata epäonnistui, käytetään oletusta: {e!r}")
+        metadata = _fallback_game_metadata(game_type, topic)
+    return {"game_data": game_data, "metadata": metadata}
 
 @require_POST
 @login_required
+@rate_limited('game')
 def generate_game_ajax_view(request):
     """
     AJAX-näkymä pelisisällön ja metadatan generointiin tekoälyllä.
-    Vain opettajat voivat käyttää tätä.
+    Vain opettajat voivat käyttää tätä. Generointi ajetaan taustatyönä.
 
     Args:
         request: HTTP-pyyntö, sisältää aiheen, pelityypin ja vaikeustason.
 
     Returns:
-        JsonResponse: Sisältää generoidun pelidatan ja metadatan
-                      tai virheilmoituksen.
+        JsonResponse: 202 ja taustatyön tiedot ("job"); valmis tulos
+                      (game_data, metadata) haetaan työn status_url-osoitteesta.
+                      Välimuistissa oleva peli palautetaan heti (200, valmis
+                      työ), ellei pyynnössä ole "regenerate": true.
+                      Virhetilanteessa virheilmoitus.
     """
     if not hasattr(request.user, "role") or request.user.role != "TEACHER":
         return JsonResponse({'error': 'Vain opettajat voivat luoda pelejä.'}, status=403)
@@ -216,18 +315,18 @@ def generate_game_ajax_view(request):
         if not topic or not game_type:
             return JsonResponse({'error': 'Aihe ja pelityyppi ovat pakollisia.'}, status=400)
 
-        # Generoi pelisisältö vaikeustasolla
-        game_data = generate_game_content(topic, game_type, difficulty)
-        
-        # Generoi otsikko ja aihe automaattisesti
-        metadata = generate_game_metadata(topic, game_type)
-        
-        # Palauta sekä pelisisältö että metadata
-        return JsonResponse({
-            'success': True, 
-            'game_data': game_data,
-            'metadata': metadata
-        })
+        payload = {'topic': topic, 'game_type': game_type, 'difficulty': difficulty}
+        # Sama (normalisoitu) pyyntö aiemmin -> valmis peli heti välimuistista
+        cached = None if data.get('regenerate') else cached_game(topic, game_type, difficulty)
+        if cached:
+            job = jobs.record_result('game', payload, cached, user=request.user)
+            return JsonResponse({'success': True, 'job': jobs.to_dict(job), 'cached': True})
+
+        # Pelisisältö ja metadata generoidaan taustatyönä (materials.job_handlers.game)
+        if data.get('regenerate'):
+            payload['regenerate'] = True
+        job = jobs.enqueue('game', payload, user=request.user)
+        return JsonResponse({'success': True, 'job': jobs.to_dict(job)}, status=202)
 
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
@@ -399,10 +498,12 @@ def assignment_autosave_view(request, assignment_id):
 # materials/views/api.py
 
 @require_POST
+@rate_limited('image', when=lambda request: not request.FILES.get('image_upload'))
 def generate_image_view(request):
     """
-    Handles image requests via AJAX. Sets ACL to public-read in production
-    to ensure permanent URLs. Includes enhanced logging.
+    Handles image requests via AJAX. The file is saved through
+    materials.storage.save_public, which sets the public-read ACL in the same
+    upload to ensure permanent URLs. Includes enhanced logging.
     """
     print("\n--- generate_image_view CALLED ---")
     print(f"Request Method: {request.method}")
@@ -465,7 +566,7 @@ def generate_image_view(request):
                  size = size_map.get(size, "1024x1024") # Default to square if mapping fails
 
             print(f"Generating image with prompt: '{prompt}', size: {size}")
-            image_bytes = generate_image_bytes(prompt=prompt, size=size) # Use the validated/mapped size
+            image_bytes = generate_image_bytes(prompt=prompt, size=size, user_id=request.user.pk) # Use the validated/mapped size
             if not image_bytes:
                 print("ERROR: AI generation returned empty result.")
                 return JsonResponse({"error": "Generointi palautti tyhjän tuloksen."}, status=502)
@@ -486,47 +587,13 @@ def generate_image_view(request):
 
     try:
         print(f"Attempting to save file to: {file_path}")
-        # 1. Save the file using default storage
-        saved_path = default_storage.save(file_path, uploaded_file)
-        print(f"File saved initially, returned path/key: {saved_path}")
+        # Tallennus julkisena yhdellä PUT-pyynnöllä (ACL ja Cache-Control mukana)
+        saved_path, image_url = save_public(file_path, uploaded_file)
+        print(f"File saved, returned path/key: {saved_path}, URL: {image_url}")
+        # Pakatut WebP/AVIF-versiot srcset-renderöintiä varten taustalla
+        images.schedule_variants(saved_path, user=request.user)
 
-        # 2. Set ACL to public-read ONLY in production (DEBUG=False) and if boto3 is available
-        if not settings.DEBUG and boto3: # IF starts here
-            print("Attempting to set ACL to public-read...")
-            try:
-                # Initialize S3 client using credentials from settings
-                s3_client = boto3.client('s3',
-                                         aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                                         aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                                         endpoint_url=settings.AWS_S3_ENDPOINT_URL,
-                                         region_name=settings.DO_SPACES_REGION)
-
-                # Determine the correct object key
-                object_key = saved_path
-                if hasattr(settings, 'AWS_LOCATION') and settings.AWS_LOCATION and not saved_path.startswith(settings.AWS_LOCATION + '/'):
-                        object_key = f"{settings.AWS_LOCATION}/{saved_path}"
-                        print(f"Prepending AWS_LOCATION. Corrected Key for ACL: {object_key}")
-                else:
-                        print(f"Using returned path as Key for ACL: {object_key}")
-
-                # Set the ACL
-                s3_client.put_object_acl(Bucket=settings.AWS_STORAGE_BUCKET_NAME,
-                                           Key=object_key,
-                                           ACL='public-read')
-                print(f"Successfully set ACL public-read for: {object_key}")
-            except Exception as e:
-                print(f"WARNING: Failed to set ACL public-read for {object_key}: {e}. URL might be temporary.")
-        # --- THIS IS THE CORRECTED INDENTATION ---
-        elif not settings.DEBUG and not boto3:
-             # This aligns with the 'if not settings.DEBUG and boto3:' block
-             print("WARNING: boto3 library not found. Cannot set public-read ACL. URL might be temporary.")
-        # --- END OF CORRECTED INDENTATION ---
-
-        # 3. Get the URL (should be permanent if ACL was set)
-        image_url = default_storage.url(saved_path)
-        print(f"Generated URL: {image_url}") # Check the logs for this URL format
-
-        # 4. Return the URL in JSON response
+        # Return the URL in JSON response
         return JsonResponse({"image_url": image_url}, status=201)
 
     except Exception as e:
@@ -564,11 +631,18 @@ def material_detail_view(request, material_id):
 @require_POST
 def assignment_tts_view(request, assignment_id):
     """
-    Generoi äänitiedoston tehtävänannon sisällöstä (ilman kuvatekstejä) ja palauttaa sen.
+    Käynnistää äänitiedoston generoinnin tehtävänannon sisällöstä (ilman kuvatekstejä).
 
     Vaatii käyttäjän kirjautumisen ja POST-pyynnön.
     Tarkistaa, että käyttäjä on tehtävän omistaja.
     Poistaa Markdown-kuvat tehtävän sisällöstä ennen äänitiedoston luontia.
+    Teksti jaetaan segmentteihin (materials.tts). Jos kaikki segmentit on jo
+    generoitu, palauttaa heti valmiin tuloksen (200). Muuten palauttaa 202 ja
+    taustatyön tiedot sekä segmenttien osoitteet ("segments"), jotta selain voi
+    aloittaa toiston heti ensimmäisen segmentin valmistuttua. Valmiin työn
+    tulos sisältää samat osoitteet ("segments") ja ensimmäisen segmentin ("url").
+    Nopeusrajoitus ('tts') koskee vain uuden äänen generointia, ei valmista
+    soittolistaa.
     """
     assignment = get_object_or_404(Assignment, id=assignment_id)
 
@@ -579,26 +653,118 @@ def assignment_tts_view(request, assignment_id):
     if not raw_text:
         return JsonResponse({"Virhe": "Ei sisältöä luettavaksi."}, status=400)
 
-    # === KORJATTU SÄÄNNÖLLINEN LAUSEKE ===
-    # Tämä on tarkempi ja poistaa vain oikeat Markdown-kuvat.
-    clean_text = re.sub(r'!\[[^\]]*\]\([^\)]*\)\s*', '', raw_text)
+    clean_text = tts.clean_text(raw_text)
 
     # Varmistetaan, että tekstiä jäi jäljelle siivouksen jälkeen
     if not clean_text.strip():
         # Jos jäljelle jäi vain tyhjää, palautetaan virhe.
         return JsonResponse({"Virhe": "Ei luettavaa tekstiä löytynyt siivouksen jälkeen."}, status=400)
 
-    audio_bytes = generate_speech(clean_text)
+    # Sama materiaaliversio on jo luettu -> ei uutta OpenAI-kutsua eikä työtä
+    keys = tts.cached_playlist(clean_text)
+    if keys:
+        segments = [tts.audio_url(key) for key in keys]
+        return JsonResponse({"status": BackgroundJob.Status.DONE, "finished": True, "cached": True,
+                             "result": {"url": segments[0], "segments": segments}})
+    return _enqueue_tts(request, assignment, clean_text)
+
+
+@rate_limited('tts')
+def _enqueue_tts(request, assignment, clean_text):
+    """Lisää puuttuvien segmenttien generoinnin taustatyöjonoon (rajoitettu)."""
+    job = jobs.enqueue('tts', {'assignment_id': str(assignment.id), 'text': clean_text},
+                       user=request.user, ref=f"assignment:{assignment.id}")
+    if job.status == BackgroundJob.Status.FAILED:
+        return JsonResponse({"Virhe": "Äänitiedoston luonti epäonnistui."}, status=500)
+    data = jobs.to_dict(job)
+    data["segments"] = [tts.audio_url(key) for key in tts.segment_keys(clean_text)]
+    return JsonResponse(data, status=202)
+
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+@login_required(login_url='kirjaudu')
+@require_safe
+def tts_audio_view(request, key):
+    """
+    Jakaa sisältöosoitteisen TTS-äänitiedoston (materials.tts).
+
+    Tiedosto ei muutu koskaan (avain on sisällön tiiviste), joten vastaus
+    välimuistitetaan pitkäksi aikaa. Paikallisesta tallennustilasta
+    palvellaan HTTP Range -pyynnöt (206), jotta selain voi kelata ääntä.
+    Pilvitallennuksessa (Spaces/S3) GET ohjataan tiedoston suoraan osoitteeseen,
+    joka tukee Range-pyyntöjä itse. HEAD-pyynnöllä selain tarkistaa, onko
+    segmentti jo valmis (tyhjä 200 tai 404, jos ei vielä); siihen vastataan
+    aina itse, ettei tarkistus seuraa ohjausta toiseen alkuperään.
 
-    if audio_bytes:
-        return HttpResponse(audio_bytes, content_type='audio/mpeg')
+    Args:
+        request: HTTP GET- tai HEAD-pyyntö.
+        key (str): Äänitiedoston avain.
+
+    Returns:
+        HttpResponse: 200/206-äänivastaus, tyhjä 200 (HEAD), 304, 302-ohjaus, 404 tai 416.
+    """
+    if not tts.KEY_RE.match(key):
+        return HttpResponse(status=404)
+    name = tts.audio_path(key)
+    etag = f'"{key}"'
+    cache_control = "public, max-age=31536000, immutable"
+    if request.headers.get("If-None-Match") == etag:
+        resp = HttpResponse(status=304)
+        resp["ETag"] = etag
+        resp["Cache-Control"] = cache_control
+        return resp
+    if not default_storage.exists(name):
+        return HttpResponse(status=404)
+    if request.method == "HEAD":
+        # Valmiustarkistus vastataan itse: ohjaus Spacesiin vaatisi selaimelta CORS-säännön
+        resp = HttpResponse(status=200, content_type="audio/mpeg")
+        resp["ETag"] = etag
+        resp["Cache-Control"] = cache_control
+        return resp
+    try:
+        default_storage.path(name)
+    except NotImplementedError:
+        return redirect(default_storage.url(name))
+
+    size = default_storage.size(name)
+    match = _RANGE_RE.match(request.headers.get("Range", "").strip())
+    if match and (match.group(1) or match.group(2)):
+        if match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+        else:
+            start, end = max(0, size - int(match.group(2))), size - 1
+        if start > end:
+            resp = HttpResponse(status=416)
+            resp["Content-Range"] = f"bytes */{size}"
+            return resp
+        with default_storage.open(name, "rb") as fh:
+            fh.seek(start)
+            resp = HttpResponse(fh.read(end - start + 1), status=206, content_type="audio/mpeg")
+        resp["Content-Range"] = f"bytes {start}-{end}/{size}"
     else:
-        return JsonResponse({"Virhe": "Äänitiedoston luonti epäonnistui."}, status=500)
-    
+        resp = FileResponse(default_storage.open(name, "rb"), content_type="audio/mpeg")
+    resp["Accept-Ranges"] = "bytes"
+    resp["ETag"] = etag
+    resp["Cache-Control"] = cache_control
+    return resp
+
 #JSON Chunks lataus tekoälylle
 @require_GET
 def ops_facets(request):
-    return JsonResponse(get_facets())
+    """
+    Palauttaa OPS-facetit ja niiden rivimäärät JSON-muodossa.
+
+    Valinnaiset GET-parametrit subject/grade/ctype (voivat toistua) rajaavat
+    lukumäärät suodatettuun joukkoon.
+    """
+    return JsonResponse(get_facets(
+        subjects=request.GET.getlist("subject"),
+        grades=request.GET.getlist("grade"),
+        ctypes=request.GET.getlist("ctype"),
+    ))
 
 @require_GET
 def ops_search(request):
@@ -612,8 +778,135 @@ def ops_search(request):
         k = int(request.GET.get("k", "8") or 8)
     except ValueError:
         k = 8
+    k = max(1, min(k, max_results()))  # OPS_MAX_K
     subjects = request.GET.getlist("subject")  # voi toistua
     grades   = request.GET.getlist("grade")
     ctypes   = request.GET.getlist("ctype")
-    results = retrieve_chunks(q, k=k, subjects=subjects, grades=grades, ctypes=ctypes)
-    return JsonResponse({"results": results})
\ No newline at end of file
+    mode     = request.GET.get("mode") or None  # bm25 / vector / hybrid
+    try:
+        results = retrieve_chunks(q, k=k, subjects=subjects, grades=grades, ctypes=ctypes, mode=mode)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"results": results})
+
+@csrf_exempt
+@require_POST
+def ops_search_batch(request):
+    """
+    Suorittaa useita OPS-hakuja yhdellä pyynnöllä.
+
+    POST on vain rungon kuljettamista varten: haku ei muuta tilaa, joten
+    CSRF-tarkistus ohitetaan ja muutkin kuin selainasiakkaat voivat käyttää sitä.
+
+    Runko on JSON: {"queries": [{"q": ..., "subject": [...], "grade": [...],
+    "ctype": [...], "k": 8, "offset": 0, "limit": 8, "mode": "bm25"}, ...],
+    "snippet": false}. Facet-kentät voivat olla merkkijonoja tai listoja.
+    Kyselyjen määrä on rajattu asetuksella OPS_BATCH_MAX ja k asetuksella OPS_MAX_K.
+
+    Palauttaa kullekin kyselylle tulokset, sivutustiedot ja keston (took_ms).
+    """
+    try:
+        data = json.loads(request.body or b"{}")
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return JsonResponse({"error": "Virheellinen JSON"}, status=400)
+    queries = data.get("queries") if isinstance(data, dict) else None
+    if not isinstance(queries, list) or not queries:
+        return JsonResponse({"error": "queries-lista puuttuu"}, status=400)
+    max_batch = getattr(settings, "OPS_BATCH_MAX", 20)
+    if len(queries) > max_batch:
+        return JsonResponse({"error": f"Enintään {max_batch} hakua kerralla"}, status=400)
+
+    def as_list(value):
+        if value is None:
+            return []
+        return [str(v) for v in value] if isinstance(value, list) else [str(value)]
+
+    specs = []
+    for item in queries:
+        if not isinstance(item, dict):
+            return JsonResponse({"error": "Jokaisen haun on oltava objekti"}, status=400)
+        if not isinstance(item.get("mode"), (str, type(None))):
+            return JsonResponse({"error": "mode on merkkijono"}, status=400)
+        min_score = item.get("min_score")
+        if min_score is not None and (isinstance(min_score, bool) or not isinstance(min_score, (int, float))):
+            return JsonResponse({"error": "min_score on luku"}, status=400)
+        specs.append({
+            "q": item.get("q", ""),
+            "subjects": as_list(item.get("subject")),
+            "grades": as_list(item.get("grade")),
+            "ctypes": as_list(item.get("ctype")),
+            "k": item.get("k"),
+            "offset": item.get("offset"),
+            "limit": item.get("limit"),
+            "min_score": item.get("min_score"),
+            "mode": item.get("mode"),
+        })
+
+    snippet_chars = getattr(settings, "OPS_SNIPPET_CHARS", 200) if data.get("snippet") else None
+    started = time.perf_counter()
+    try:
+        results = retrieve_chunks_batch(specs, snippet_chars=snippet_chars)
+    except (TypeError, ValueError) as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    took_ms = (time.perf_counter() - started) * 1000
+    return JsonResponse({"results": results, "took_ms": round(took_ms, 3)})
+
+@require_GET
+@login_required
+def ops_stats(request):
+    """
+    Palauttaa OPS-haun tulosvälimuistin osuma- ja hutilaskurit (tämä prosessi)
+    sekä LLM-vastausvälimuistin tilastot avaimessa "llm_cache".
+
+    Vain ylläpitäjille.
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden("Sinulla ei ole oikeuksia tähän.")
+    return JsonResponse({**cache_stats(), "llm_cache": llm_cache.cache_stats()})
+
+
+def _get_own_job(request, job_id):
+    """Palauttaa käyttäjän oman taustatyön tai None, jos oikeudet puuttuvat."""
+    job = get_object_or_404(BackgroundJob, id=job_id)
+    if job.created_by_id != request.user.id and not request.user.is_staff:
+        return None
+    return job
+
+
+@require_GET
+@login_required
+def job_status_view(request, job_id):
+    """
+    Palauttaa taustatyön tilan (ja valmiin työn tuloksen) pollausta varten.
+
+    Args:
+        request: HTTP-pyyntö.
+        job_id (uuid): Taustatyön tunniste.
+
+    Returns:
+        JsonResponse: id, kind, status, finished, error ja valmiille työlle result.
+    """
+    job = _get_own_job(request, job_id)
+    if job is None:
+        return HttpResponseForbidden("Sinulla ei ole oikeuksia tähän.")
+    return JsonResponse(jobs.to_dict(job))
+
+
+@require_GET
+@login_required
+def job_result_view(request, job_id):
+    """
+    Palauttaa taustatyön tuloksen.
+
+    Returns:
+        JsonResponse: 200 ja tulos valmiille työlle, 202 ja tila keskeneräiselle,
+                      500 ja virhe epäonnistuneelle.
+    """
+    job = _get_own_job(request, job_id)
+    if job is None:
+        return HttpResponseForbidden("Sinulla ei ole oikeuksia tähän.")
+    if job.status == BackgroundJob.Status.DONE:
+        return JsonResponse({'status': job.status, 'result': job.result})
+    if job.status == BackgroundJob.Status.FAILED:
+        return JsonResponse({'status': job.status, 'error': job.error}, status=500)
+    return JsonResponse({'status': job.status}, status=202)
@@ -1,23 +1,35 @@
 # materials/views/shared.py
 
+from django.core.files.storage import default_storage
 from django.shortcuts import render, get_object_or_404
 from django.utils.safestring import mark_safe
 import markdown as md
+import hashlib
 import re
 import json
 from urllib.parse import urlparse
 
-from ..models import Material
+from .. import images, jobs
+from ..models import BackgroundJob, Material
 
 _MD_IMG_RE = re.compile(r'!\[([^\]]*)\]\(([^)]+)\)')
 
 def render_material_content_to_html(text: str) -> str:
     """
     Muuntaa Markdown-tekstin HTML:ksi ja käsittelee kuvien URL-osoitteet oikein.
+
+    Kuville, joista on pakatut versiot (materials.images), tuotetaan
+    srcset/sizes-attribuutit (AVIF-versiot <picture>-elementin kautta);
+    alkuperäistä kuvaa ei tällöin ladata lainkaan. Kaikki kuvat ladataan
+    laiskasti (loading="lazy", decoding="async").
     """
     if not text:
         return ""
 
+    # Kaikkien kuvien versiot yhdellä kyselyllä
+    names = {m.group(2): images.source_name(m.group(2)) for m in _MD_IMG_RE.finditer(text)}
+    variants = images.variants_for(names.values()) if any(names.values()) else {}
+
     def replace_custom_image_syntax(match):
         alt_text = match.group(1)
         full_url = match.group(2)
@@ -35,8 +47,23 @@ def render_material_content_to_html(text: str) -> str:
         
         size_class = size_match.group(0) if size_match else "size-md"
         align_class = align_match.group(0) if align_match else "align-center"
-        
-        img_tag = f'<img src="{base_url}" alt="{alt_text}" class="img-fluid rounded border my-3 img-scaled {size_class}">'
+        img_class = f"img-fluid rounded border my-3 img-scaled {size_class}"
+
+        found = variants.get(names.get(full_url))
+        if found:
+            sizes = images.SIZES[size_class]
+            fallback = found.get("webp") or next(iter(found.values()))
+            largest = fallback[-1]
+            img_tag = (
+                f'<img src="{default_storage.url(largest.name)}" srcset="{images.srcset(fallback)}" '
+                f'sizes="{sizes}" width="{largest.width}" height="{largest.height}" alt="{alt_text}" '
+                f'class="{img_class}" loading="lazy" decoding="async">'
+            )
+            if "avif" in found:
+                img_tag = (f'<picture><source type="image/avif" srcset="{images.srcset(found["avif"])}" '
+                           f'sizes="{sizes}">{img_tag}</picture>')
+        else:
+            img_tag = f'<img src="{base_url}" alt="{alt_text}" class="{img_class}" loading="lazy" decoding="async">'
         
         return f'<div class="image-wrapper {align_class}">{img_tag}</div>'
 
@@ -50,6 +77,39 @@ def render_material_content_to_html(text: str) -> str:
     html = md.markdown(processed_text, extensions=['extra'])
     return mark_safe(html)
 
+# Kasvata, kun renderöinnin tulos muuttuu -> vanhat esirenderöinnit vanhenevat
+RENDER_VERSION = 2
+
+
+def _render_hash(text: str) -> str:
+    return hashlib.sha256(f"{RENDER_VERSION}:{text or ''}".encode("utf-8")).hexdigest()
+
+
+def cached_material_html(material: Material) -> str:
+    """
+    Palauttaa materiaalin sisällön HTML:nä esirenderöinnistä (Material.rendered_html).
+
+    Jos sisältö on muuttunut esirenderöinnin jälkeen (tai sitä ei ole), HTML
+    renderöidään ja tallennetaan, jolloin seuraavat lukijat saavat sen suoraan.
+    Materiaalin jakamisen jälkeinen valmistelutyö (job_handlers.warmup) tekee
+    tämän etukäteen.
+
+    Args:
+        material (Material): Materiaali.
+
+    Returns:
+        str: Turvalliseksi merkitty HTML.
+    """
+    digest = _render_hash(material.content)
+    if material.rendered_hash == digest:
+        return mark_safe(material.rendered_html)
+    html = render_material_content_to_html(material.content)
+    # Päivitys ohi save()-metodin: ei muuta updated_at-aikaa eikä laukaise signaaleja
+    Material.objects.filter(pk=material.pk).update(rendered_html=str(html), rendered_hash=digest)
+    material.rendered_html, material.rendered_hash = str(html), digest
+    return html
+
+
 def format_game_content_for_display(game_data):
     """
     Muotoilee pelin JSON-datan opettajalle helposti luettavaan muotoon.
@@ -239,10 +299,18 @@ def material_detail_view(request, material_id):
     """
     material = get_object_or_404(Material, pk=material_id)
 
-    rendered_content = render_material_content_to_html(material.content)
-    
+    rendered_content = cached_material_html(material)
+
+    # Jakamisen jälkeinen valmistelu (ääni, HTML, esikatselukuvat) tekijälle näkyviin
+    warmup_job = None
+    if request.user.is_authenticated and request.user.pk == material.author_id:
+        job = (BackgroundJob.objects.filter(kind="warmup", ref=f"material:{material.pk}")
+               .order_by("-created_at").first())
+        warmup_job = jobs.to_dict(job) if job else None
+
     return render(request, "materials/material_detail.html", {
         "material": material,
         "rendered_content": rendered_content,
+        "warmup_job": warmup_job,
     })
 
@@ -8,7 +8,7 @@ import json
 
 from ..models import Assignment, Submission
 from ..forms import SubmissionForm
-from .shared import render_material_content_to_html # Jaettu apufunktio
+from .shared import cached_material_html # Jaettu apufunktio
 
 # --- Oppilaan Dashboard ---
 @login_required(login_url='kirjaudu')
@@ -205,7 +205,8 @@ def assignment_detail_view(request, assignment_id):
     # --- LISÄYS PÄÄTTYY ---
 
     # Jos materiaali EI ole peli, jatketaan normaalisti vanhalla logiikalla:
-    content_html = render_material_content_to_html(assignment.material.content)
+    # Esirenderöity HTML (valmisteltu jo jakamisen yhteydessä)
+    content_html = cached_material_html(assignment.material)
 
     if assignment.status in (Assignment.Status.SUBMITTED, Assignment.Status.GRADED):
         # ... (TÄHÄN TULEE KOKO LOPPUOSA VANHASTA FUNKTIOSTASI, SITÄ EI TARVITSE MUUTTAA) ...
@@ -5,7 +5,7 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.db import transaction
 from django.db.models import Q, Value
-from django.http import HttpResponseNotAllowed, JsonResponse, HttpResponseForbidden
+from django.http import HttpResponseNotAllowed, JsonResponse, HttpResponseForbidden, StreamingHttpResponse
 from django.core.paginator import Paginator
 from django.utils import timezone
 from django.db.models.functions import Concat
@@ -15,10 +15,11 @@ from django.views.decorators.http import require_POST
 from users.models import CustomUser
 from ..models import Material, Assignment, Submission, MaterialImage
 from ..forms import MaterialForm, AssignForm, GradingForm, AddImageForm
-from ..ai_service import ask_llm, ask_llm_with_ops, generate_image_bytes
-from ..ai_rubric import create_or_update_ai_grade
-from ..plagiarism import build_or_update_report
-from .shared import format_game_content_for_display, render_material_content_to_html
+from ..ai_service import apply_format_fallback, build_ops_prompt, generate_image_bytes, stream_llm
+from .. import images, jobs
+from ..ratelimit import rate_limited
+from ..models import BackgroundJob
+from .shared import cached_material_html, format_game_content_for_display
 from TaskuOpe.ops_chunks import get_facets
 from urllib.parse import urljoin
 from django.core.files.storage import default_storage
@@ -26,7 +27,6 @@ import json
 import os
 import uuid
 from django.conf import settings
-import boto3
 
 # --- Opettajan Dashboard ---
 @login_required(login_url='kirjaudu')
@@ -75,6 +75,7 @@ def teacher_dashboard_view(request):
 
 
 @login_required(login_url='kirjaudu')
+@rate_limited('material_draft', when=lambda request: request.POST.get('action') == 'ai')
 def create_material_view(request):
 
     """
@@ -93,6 +94,7 @@ def create_material_view(request):
 
     ops_facets = get_facets()
     ai_reply = None
+    ai_job = None
     ai_prompt_val = ""
     ops_vals = {
         'use_ops': request.POST.get('use_ops') == 'on',
@@ -107,17 +109,18 @@ def create_material_view(request):
         if action == 'ai':
             ai_prompt_val = (request.POST.get('ai_prompt') or '').strip()
             if ai_prompt_val:
+                # Tekoälykutsu ajetaan taustatyönä; sivu hakee vastauksen tilarajapinnasta
+                payload = {'prompt': ai_prompt_val, 'user_id': request.user.id}
                 if ops_vals['use_ops'] and ops_vals['ops_subject'] and ops_vals['ops_grade']:
-                    result = ask_llm_with_ops(
-                        question=ai_prompt_val, subjects=[ops_vals['ops_subject']],
-                        grades=[ops_vals['ops_grade']], user_id=request.user.id
-                    )
-                    ai_reply = result.get('answer', '[Virhe haettaessa OPS-dataa]')
+                    payload.update(ops_subject=ops_vals['ops_subject'], ops_grade=ops_vals['ops_grade'])
+                job = jobs.enqueue('material_draft', payload, user=request.user)
+                if job.status == BackgroundJob.Status.DONE:
+                    ai_reply = (job.result or {}).get('answer')
                 else:
-                    ai_reply = ask_llm(ai_prompt_val, user_id=request.user.id)
-            
+                    ai_job = jobs.to_dict(job)
+
             return render(request, 'materials/create.html', {
-                'form': form, 'ai_prompt': ai_prompt_val, 'ai_reply': ai_reply,
+                'form': form, 'ai_prompt': ai_prompt_val, 'ai_reply': ai_reply, 'ai_job': ai_job,
                 'ops_vals': ops_vals, 'ops_facets': ops_facets
             })
 
@@ -164,6 +167,67 @@ def create_material_view(request):
         'ops_facets': ops_facets,
     })
 
+def _sse(data: dict, event: str = "") -> str:
+    """Muotoilee yhden Server-Sent Events -viestin."""
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@login_required(login_url='kirjaudu')
+@require_POST
+@rate_limited('material_draft')
+def create_material_stream_view(request):
+    """
+    Suoratoistaa tekoälyn sisältöehdotuksen Server-Sent Events -virtana.
+
+    Ottaa samat lomakekentät kuin create_material_view (ai_prompt, use_ops,
+    ops_subject, ops_grade). Virran tapahtumat:
+    - data: {"delta": "..."} jokaisesta mallin tuottamasta tekstipalasta
+    - event: done, data: {"text": valmis teksti, "job": taustatyön tiedot}
+      (muotovarmistus tehty, teksti tallennettu material_draft-työnä)
+    - event: error, data: {"error": "..."}
+
+    Args:
+        request: HTTP POST -pyyntö.
+
+    Returns:
+        StreamingHttpResponse: text/event-stream-vastaus tai virhe JSONina.
+    """
+    if request.user.role != 'TEACHER':
+        return HttpResponseForbidden("Sinulla ei ole oikeuksia tähän.")
+    ai_prompt_val = (request.POST.get('ai_prompt') or '').strip()
+    if not ai_prompt_val:
+        return JsonResponse({'error': 'Kirjoita pyyntö ensin.'}, status=400)
+    payload = {'prompt': ai_prompt_val, 'user_id': request.user.id}
+    if request.POST.get('use_ops') == 'on' and request.POST.get('ops_subject') and request.POST.get('ops_grade'):
+        payload.update(ops_subject=request.POST['ops_subject'], ops_grade=request.POST['ops_grade'])
+    user = request.user
+
+    def events():
+        started = timezone.now()
+        parts = []
+        # Kommenttirivi lähettää otsakkeet heti selaimelle
+        yield ": stream\n\n"
+        try:
+            prompt = ai_prompt_val
+            if payload.get('ops_subject'):
+                prompt = build_ops_prompt(
+                    ai_prompt_val, subjects=[payload['ops_subject']], grades=[payload['ops_grade']]
+                )["prompt"]
+            for delta in stream_llm(prompt, user_id=user.id):
+                parts.append(delta)
+                yield _sse({"delta": delta})
+            final = apply_format_fallback("".join(parts))
+            job = jobs.record_result('material_draft', payload, {'answer': final}, user=user, started_at=started)
+            yield _sse({"text": final, "job": jobs.to_dict(job, with_result=False)}, event="done")
+        except Exception as e:
+            yield _sse({"error": str(e)}, event="error")
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Estää välityspalvelimia (nginx) puskuroimasta virtaa
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @login_required(login_url='kirjaudu')
 def material_list_view(request):
     """
@@ -287,6 +351,9 @@ def assign_material_view(request, material_id):
     Varmistaa, että käyttäjä on opettaja ja materiaalin tekijä.
     Käyttäjä voi valita yksittäisiä opiskelijoita tai kokonaisen luokan.
     Luo uusia Assignment-objekteja tai päivittää olemassa olevia.
+    Jakamisen jälkeen taustatyö (job_handlers.warmup) valmistelee puheäänen,
+    renderöidyn HTML:n ja esikatselukuvat, jotta tehtävän avaaminen on
+    pelkkä välimuistiluku.
 
     Args:
         request: HttpRequest-objekti.
@@ -324,6 +391,9 @@ def assign_material_view(request, material_id):
                     defaults={"assigned_by": request.user, "due_at": due_at}
                 )
                 created += 1
+            if created:
+                # Ääni, HTML ja esikatselukuvat valmiiksi ennen kuin ensimmäinen oppilas avaa tehtävän
+                jobs.enqueue("warmup", {"material_id": str(m.id)}, user=request.user, ref=f"material:{m.id}")
             messages.success(request, f"Annettu {created} oppilaalle.")
             return redirect("material_detail", material_id=m.id)
     else:
@@ -441,6 +511,23 @@ def _calculate_grade_from_score(score, max_score):
     else:
         return 10
 
+def _report_job_message(request, job, label, success_text):
+    """
+    Lisää käyttäjälle viestin taustatyön tilasta.
+
+    Args:
+        request: HttpRequest-objekti.
+        job (BackgroundJob): Jonoon lisätty työ.
+        label (str): Työn nimi viesteissä.
+        success_text (Callable[[dict], str]): Muodostaa viestin valmiin työn tuloksesta.
+    """
+    if job.status == BackgroundJob.Status.DONE:
+        messages.success(request, success_text(job.result))
+    elif job.status == BackgroundJob.Status.FAILED:
+        messages.error(request, f"{label}: luonti epäonnistui: {job.error}")
+    else:
+        messages.info(request, f"{label} luodaan taustalla. Sivu päivittyy, kun se on valmis.")
+
 @login_required(login_url='kirjaudu')
 @transaction.atomic
 def grade_submission_view(request, submission_id):
@@ -472,11 +559,12 @@ def grade_submission_view(request, submission_id):
 
     # --- AI rubric grading: generate from button press ---
     if request.method == 'POST' and 'run_ai_grade' in request.POST:
-        try:
-            ag = create_or_update_ai_grade(submission)
-            messages.success(request, f"AI-arvosanaehdotus luotu ({ag.total_points:.1f} pistettä).")
-        except Exception as e:
-            messages.error(request, f"AI-arvosanaehdotuksen luonti epäonnistui: {e}")
+        # Olemassa oleva ehdotus -> opettaja pyytää uutta, ei välimuistin vanhaa
+        fresh = getattr(submission, 'ai_grade', None) is not None
+        job = jobs.enqueue('ai_grade', {'submission_id': str(submission.id), 'fresh': fresh},
+                           user=request.user, ref=f"submission:{submission.id}")
+        _report_job_message(request, job, "AI-arvosanaehdotus",
+                            lambda r: f"AI-arvosanaehdotus luotu ({r['total_points']:.1f} pistettä).")
         return redirect('grade_submission', submission_id=submission.id)
 
     # --- AI rubric grading: accept suggestion into fields ---
@@ -515,20 +603,13 @@ def grade_submission_view(request, submission_id):
 
     # --- Plagiarism check from button press ---
     if request.method == 'POST' and 'run_plagiarism' in request.POST:
-        try:
-            report = build_or_update_report(submission)
-            if report.suspected_source:
-                messages.success(
-                    request,
-                    f"Alkuperäisyysselvityksen raportti päivitetty. Samankaltaisuus: {report.score:.2f}"
-                )
-            else:
-                messages.info(
-                    request,
-                    "Raportti päivitetty. Merkittävää samankaltaisuutta ei löytynyt."
-                )
-        except Exception as e:
-            messages.error(request, f"Raportin luonti epäonnistui: {e}")
+        job = jobs.enqueue('plagiarism', {'submission_id': str(submission.id)},
+                           user=request.user, ref=f"submission:{submission.id}")
+        _report_job_message(
+            request, job, "Alkuperäisyysraportti",
+            lambda r: (f"Alkuperäisyysselvityksen raportti päivitetty. Samankaltaisuus: {r['score']:.2f}"
+                       if r['suspected'] else "Raportti päivitetty. Merkittävää samankaltaisuutta ei löytynyt."),
+        )
         return redirect('grade_submission', submission_id=submission.id)
 
     # --- Final form submission (saving the manual grade) ---
@@ -550,9 +631,17 @@ def grade_submission_view(request, submission_id):
     # Pass potential reports and suggestions to the template
     plagiarism_report = getattr(submission, "plagiarism_report", None)
     ai_grade = getattr(submission, "ai_grade", None)
+    # Keskeneräiset taustatyöt (sivu päivittyy, kun ne valmistuvat)
+    pending_jobs = [
+        jobs.to_dict(job, with_result=False)
+        for job in BackgroundJob.objects.filter(
+            ref=f"submission:{submission.id}",
+            status__in=[BackgroundJob.Status.QUEUED, BackgroundJob.Status.RUNNING],
+        )
+    ]
 
     # pelin HTML-esikatselu) renderöitäväksi HTML-koodiksi.
-    rendered_material_content = render_material_content_to_html(material.content)
+    rendered_material_content = cached_material_html(material)
     # =================================================================
 
     return render(request, 'assignments/grade.html', {
@@ -562,6 +651,7 @@ def grade_submission_view(request, submission_id):
         'form': form,
         'plagiarism_report': plagiarism_report,
         'ai_grade': ai_grade,
+        'pending_jobs': pending_jobs,
         'rendered_material_content': rendered_material_content,
     })
 
@@ -798,20 +888,14 @@ def teacher_student_list_view(request):
 def add_material_image_view(request, material_id):
     """
     Handles adding an image to a material, either via file upload or AI generation.
-    Sets the ACL to public-read in production for permanent URLs.
+    The image field uses the default storage (materials.storage.PublicMediaStorage
+    in production), which uploads the file as public-read for permanent URLs.
     
     This function has been fixed to:
     1. Correctly handle the client-side generated image (in `upload` field).
     2. Read the dynamic AI image size from request.POST.
     3. Bypass strict form validation errors when a client-generated image is present.
     """
-    from django.conf import settings
-    # Ensure boto3 is available globally if needed, though usually imported at the top
-    try:
-        import boto3
-    except ImportError:
-        boto3 = None 
-
     m = get_object_or_404(Material, pk=material_id)
     if request.user.role != "TEACHER" or m.author_id != request.user.id:
         messages.error(request, "Ei oikeutta.")
@@ -869,7 +953,7 @@ def add_material_image_view(request, material_id):
                 print(f"AI generation selected (server-side fallback). Prompt: '{prompt}', Size: '{ai_image_size}'")
                 try:
                     # Assume generate_image_bytes is globally available
-                    image_data = generate_image_bytes(prompt, size=ai_image_size) 
+                    image_data = generate_image_bytes(prompt, size=ai_image_size, user_id=request.user.pk)
                     if image_data:
                         image_to_save = ContentFile(image_data, name="gen.png")
                         rel_dir = "ai_images"
@@ -888,32 +972,12 @@ def add_material_image_view(request, material_id):
                 mi = MaterialImage(material=m, caption=caption, created_by=request.user)
 
                 try:
+                    # Julkinen ACL ja Cache-Control lähtevät samassa latauksessa (materials.storage)
                     mi.image.save(file_path, image_to_save, save=False)
-                    object_key = mi.image.name
-                    
-                    # --- Correct calculation of acl_key ---
-                    aws_location = getattr(settings, 'AWS_LOCATION', '').strip('/')
-                    if aws_location and not object_key.startswith(aws_location + '/'):
-                        acl_key = f"{aws_location}/{object_key}"
-                    else:
-                        acl_key = object_key
-                    # --- End Correct calculation ---
-                    
-                    # Start of the ACL block
-                    if not settings.DEBUG and boto3:
-                        # Initialize S3 client (safe settings access)
-                        s3_client = boto3.client('s3',
-                                                 aws_access_key_id=getattr(settings, 'AWS_ACCESS_KEY_ID', None),
-                                                 aws_secret_access_key=getattr(settings, 'AWS_SECRET_ACCESS_KEY', None),
-                                                 endpoint_url=getattr(settings, 'AWS_S3_ENDPOINT_URL', None),
-                                                 region_name=getattr(settings, 'DO_SPACES_REGION', None))
-                        
-                        s3_client.put_object_acl(Bucket=getattr(settings, 'AWS_STORAGE_BUCKET_NAME', 'DUMMY_BUCKET'),
-                                                   Key=acl_key,  # <-- CRITICAL FIX: USE acl_key INSTEAD OF object_key
-                                                   ACL='public-read')
-                    
                     mi.save()
                     image_url = mi.image.url
+                    # Pakatut WebP/AVIF-versiot srcset-renderöintiä varten taustalla
+                    images.schedule_variants(mi.image.name, user=request.user)
 
                     # Construct Markdown
                     size_fragment_short = size_fragment.replace('size-', 'size-') 
@@ -936,7 +1000,7 @@ def add_material_image_view(request, material_id):
                     return redirect("material_edit", material_id=m.id)
 
                 except Exception as e:
-                    print(f"ERROR saving MaterialImage file or setting ACL: {e}")
+                    print(f"ERROR saving MaterialImage file: {e}")
                     messages.error(request, f"Kuvan tallennus epäonnistui: {e}")
 
             else:
@@ -3,18 +3,43 @@
 Kerää perusopetuksen (POPS 2014) 1–6 -luokkien datan ePerusteet-rajapinnasta.
 
 Käsittelee vain ennalta määritellyt, halutut oppiaineet.
+
+Oppiaineiden tiedot haetaan rinnakkain yhteisellä HTTP-sessiolla
+(yhteyspooli, uudelleenyritykset eksponentiaalisella viiveellä). Jokainen
+vastaus tallennetaan levyvälimuistiin ETag/Last-Modified-otsakkeineen, jolloin
+uusi ajo saa muuttumattomista oppiaineista vain 304-vastauksen.
+
+Inkrementaalisessa tilassa (--incremental) edellisen ajon tila luetaan
+tiedostosta <output>.state.json, vain muuttuneet oppiaineet käsitellään
+uudelleen ja muutokset kirjoitetaan diff-tiedostoon (--diff).
+
+Käyttö:
+    python collect_ops_data_API_toimiva.py [--incremental] [--workers 8]
+        [--base-url URL] [--output FILE] [--cache-dir DIR] [--diff FILE]
 '''
 
-import requests
+import argparse
+import hashlib
 import json
+import os
 import re
-from typing import Any, Dict, List, Tuple
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 BASE_URL = "https://eperusteet.opintopolku.fi/eperusteet-service/api/external/peruste/419550/perusopetus"
 SUBJECTS_URL = f"{BASE_URL}/oppiaineet"
 HEADERS = {"Caller-Id": "script.opetussuunnitelma"}
 TIMEOUT = 30
 OUTPUT_FILE = "opetussuunnitelma_1-6_API_data.json"
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".http_cache")
+MAX_WORKERS = 8
+RETRIES = 4
+BACKOFF = 0.5
 
 # ======================================================================
 # === SÄILYTETTÄVIEN OPPIAINEIDEN LISTA ("WHITELIST")               ====
@@ -192,52 +217,233 @@ def process_subject(
 
     return total_g, total_c, total_e
 
-def main():
+def make_session(workers: int = MAX_WORKERS, retries: int = RETRIES, backoff: float = BACKOFF) -> requests.Session:
     """
-    Pääohjelma, joka hakee, käsittelee ja tallentaa perusopetuksen aineistoja.
+    Luo HTTP-session, jonka yhteyspooli riittää rinnakkaisille hauille.
+
+    Args:
+        workers (int): Samanaikaisten hakujen määrä (poolin koko).
+        retries (int): Uudelleenyritysten enimmäismäärä.
+        backoff (float): Eksponentiaalisen viiveen kerroin sekunteina.
+
+    Returns:
+        requests.Session: Valmiiksi konfiguroitu sessio.
     """
-    print("Haetaan oppiaineet...")
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET"}),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def fetch_json(session: requests.Session, url: str, cache_dir: Optional[str]) -> Tuple[Any, str]:
+    """
+    Hakee JSON-vastauksen ehdollisella pyynnöllä levyvälimuistia hyödyntäen.
+
+    Välimuistissa on kullekin URL:lle vastauksen runko ja otsakkeet
+    (ETag, Last-Modified). Jos palvelin vastaa 304, käytetään tallennettua runkoa.
+
+    Args:
+        session (requests.Session): Käytettävä sessio.
+        url (str): Haettava osoite.
+        cache_dir (Optional[str]): Välimuistihakemisto tai None (ei välimuistia).
+
+    Returns:
+        Tuple[Any, str]: Jäsennetty JSON ja rungon sha256-tiiviste, jota
+        kutsuja vertaa omaan tallennettuun tilaansa.
+    """
+    body_path = meta_path = None
+    meta: Dict[str, Any] = {}
+    headers: Dict[str, str] = {}
+    if cache_dir:
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        body_path = os.path.join(cache_dir, f"{key}.json")
+        meta_path = os.path.join(cache_dir, f"{key}.meta.json")
+        if os.path.exists(body_path) and os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f: meta = json.load(f)
+            if meta.get("etag"): headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"): headers["If-Modified-Since"] = meta["last_modified"]
+
+    resp = session.get(url, headers=headers, timeout=TIMEOUT)
+    if resp.status_code == 304 and body_path:
+        with open(body_path, "rb") as f: body = f.read()
+        return json.loads(body), meta.get("sha256") or hashlib.sha256(body).hexdigest()
+    resp.raise_for_status()
+
+    body = resp.content
+    digest = hashlib.sha256(body).hexdigest()
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(body_path, "wb") as f: f.write(body)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "url": url,
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "sha256": digest,
+            }, f)
+    return json.loads(body), digest
+
+def _row_key(row: Dict[str, Any]) -> Tuple[str, str, str, str]:
+    return (row["subject"], row["grade_context"], row["content_type"], row["content"])
+
+def diff_rows(old: List[Dict[str, Any]], new: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Vertaa kahta tietuelistaa ja palauttaa lisätyt ja poistetut tietueet.
+
+    Args:
+        old (List[Dict[str, Any]]): Edelliset tietueet.
+        new (List[Dict[str, Any]]): Uudet tietueet.
+
+    Returns:
+        Dict[str, List[Dict[str, Any]]]: Avaimet "added" ja "removed".
+    """
+    old_keys = {_row_key(r) for r in old}
+    new_keys = {_row_key(r) for r in new}
+    return {
+        "added": [r for r in new if _row_key(r) not in old_keys],
+        "removed": [r for r in old if _row_key(r) not in new_keys],
+    }
+
+def _load_state(path: str) -> Dict[str, Any]:
     try:
-        resp = requests.get(SUBJECTS_URL, headers=HEADERS, timeout=TIMEOUT)
-        resp.raise_for_status(); subjects = resp.json()
-    except Exception as e:
-        print(f"Oppiaineiden haku epäonnistui: {e}"); return
+        with open(path, "r", encoding="utf-8") as f: return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def collect(
+    base_url: str = BASE_URL,
+    output: str = OUTPUT_FILE,
+    cache_dir: Optional[str] = CACHE_DIR,
+    workers: int = MAX_WORKERS,
+    incremental: bool = False,
+    diff_path: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Hakee, käsittelee ja tallentaa perusopetuksen aineistot.
+
+    Args:
+        base_url (str): ePerusteet-rajapinnan perusosoite.
+        output (str): Tulostiedosto.
+        cache_dir (Optional[str]): HTTP-välimuistin hakemisto (None = ei välimuistia).
+        workers (int): Rinnakkaisten hakujen määrä.
+        incremental (bool): Käsitelläänkö vain muuttuneet oppiaineet edellisen ajon tilasta.
+        diff_path (Optional[str]): Tiedosto, johon muutokset kirjoitetaan.
+
+    Returns:
+        Dict[str, Any]: Yhteenveto: rivimäärä, muuttuneet oppiaineet ja diff.
+    """
+    started = time.monotonic()
+    state_path = f"{output}.state.json"
+    state = _load_state(state_path) if incremental else {}
+    session = make_session(workers)
 
+    print("Haetaan oppiaineet...")
+    subjects, _ = fetch_json(session, f"{base_url}/oppiaineet", cache_dir)
     print(f"Löytyi {len(subjects)} oppiainetta.")
-    results: List[Dict[str, Any]] = []
-    kept_subjects_count = 0
 
+    kept: List[Tuple[str, str]] = []
     for subj in subjects:
         if not isinstance(subj, dict): continue
         name = get_text(subj.get("nimi")) or get_text(subj.get("nimiFi"))
-        
+
         # Jos oppiaineen nimi ei sisällä mitään avainsanaa KEEP_SUBJECTS-listalta, ohita se.
         if not any(keep_name in name.lower() for keep_name in KEEP_SUBJECTS):
             continue
-        
-        kept_subjects_count += 1
+
         subj_id = subj.get("id") or subj.get("oppiaineId")
         if not subj_id: continue
+        kept.append((str(subj_id), name))
 
-        print(f"Käsitellään oppiaine {name} (ID {subj_id})...")
+    def fetch_subject(item: Tuple[str, str]):
+        subj_id, name = item
         try:
-            resp2 = requests.get(f"{BASE_URL}/oppiaineet/{subj_id}", headers=HEADERS, timeout=TIMEOUT)
-            resp2.raise_for_status(); subj_detail = resp2.json()
+            return fetch_json(session, f"{base_url}/oppiaineet/{subj_id}", cache_dir), None
         except Exception as e:
-            print(f"  Oppiaineen {name} tietojen haku epäonnistui: {e}"); continue
-        
-        g, c, e = process_subject(subj_detail, name, results)
-        print(f"  -> Kerätty {g} tavoitetta, {c} sisältöä, {e} arviointia.")
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        fetched = list(pool.map(fetch_subject, kept))
+
+    new_state: Dict[str, Any] = {}
+    changed_subjects: List[str] = []
+    results: List[Dict[str, Any]] = []
+    for (subj_id, name), (payload, error) in zip(kept, fetched):
+        previous = state.get(subj_id)
+        if error is not None:
+            print(f"  Oppiaineen {name} tietojen haku epäonnistui: {error}")
+            if previous:
+                # Säilytetään edellisen ajon tiedot, jos haku epäonnistuu
+                new_state[subj_id] = previous
+                results.extend(previous["rows"])
+            continue
+
+        # Muutos tunnistetaan tämän tulostiedoston omasta tilasta, ei jaetusta
+        # HTTP-välimuistista, jota toinen ajo (eri --output) on voinut jo päivittää
+        subj_detail, digest = payload
+        if previous and previous.get("sha256") == digest:
+            rows = previous["rows"]
+        else:
+            print(f"Käsitellään oppiaine {name} (ID {subj_id})...")
+            rows = []
+            g, c, e = process_subject(subj_detail, name, rows)
+            print(f"  -> Kerätty {g} tavoitetta, {c} sisältöä, {e} arviointia.")
+            changed_subjects.append(name)
+        new_state[subj_id] = {"name": name, "sha256": digest, "rows": rows}
+        results.extend(rows)
+
+    print(f"\nKäsiteltiin {len(kept)} oppiainetta KEEP_SUBJECTS-listan perusteella.")
 
-    print(f"\nKäsiteltiin {kept_subjects_count} oppiainetta KEEP_SUBJECTS-listan perusteella.")
-    
     final_results = [res for res in results if res.get("grade_context")]
     print(f"Kerättiin yhteensä {len(results)} tietuetta.")
     print(f"Suodatettiin pois {len(results) - len(final_results)} tietuetta ilman selkeää luokka-astetta.")
 
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
+    previous_rows = _load_state(output) if os.path.exists(output) else []
+    diff = diff_rows(previous_rows if isinstance(previous_rows, list) else [], final_results)
+
+    with open(output, "w", encoding="utf-8") as f:
         json.dump(final_results, f, ensure_ascii=False, indent=2)
-    print(f"Valmis. {len(final_results)} tietuetta tallennettu tiedostoon {OUTPUT_FILE}.")
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump(new_state, f, ensure_ascii=False)
+    if diff_path:
+        with open(diff_path, "w", encoding="utf-8") as f:
+            json.dump({"changed_subjects": changed_subjects, **diff}, f, ensure_ascii=False, indent=2)
+
+    print(f"Muuttuneita oppiaineita {len(changed_subjects)}; +{len(diff['added'])} / -{len(diff['removed'])} tietuetta.")
+    print(f"Valmis {time.monotonic() - started:.1f} s. {len(final_results)} tietuetta tallennettu tiedostoon {output}.")
+    return {"rows": len(final_results), "changed_subjects": changed_subjects, **diff}
+
+def main(argv: Optional[List[str]] = None):
+    """
+    Pääohjelma, joka hakee, käsittelee ja tallentaa perusopetuksen aineistoja.
+    """
+    parser = argparse.ArgumentParser(description="Kerää POPS 2014 1–6 -datan ePerusteet-rajapinnasta.")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="HTTP-välimuisti; tyhjä arvo poistaa käytöstä")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--incremental", action="store_true", help="Käsittele vain muuttuneet oppiaineet")
+    parser.add_argument("--diff", dest="diff_path", help="Kirjoita muutokset tähän JSON-tiedostoon")
+    args = parser.parse_args(argv)
+
+    try:
+        return collect(
+            base_url=args.base_url.rstrip("/"),
+            output=args.output,
+            cache_dir=args.cache_dir or None,
+            workers=args.workers,
+            incremental=args.incremental,
+            diff_path=args.diff_path,
+        )
+    except requests.RequestException as e:
+        print(f"Oppiaineiden haku epäonnistui: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()